@@ -0,0 +1,213 @@
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Iterable
+from uuid import UUID
+from sqlalchemy import BigInteger, DateTime, String, column, func, update, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.orm import Session
+from dependecies import get_redis_client
+import models
+from logger import get_logger
+from metrics import register_collector
+
+logger = get_logger(__name__)
+
+# "<owner_id>|<storage key>" -> accesses / epoch seconds of the last one, since the last
+# flush (access_field)
+ACCESS_COUNTS_KEY = "access:counts"
+ACCESS_LAST_KEY = "access:last"
+# what a flush is working on, renamed from the keys above
+FLUSHING_COUNTS_KEY = "access:counts:flushing"
+FLUSHING_LAST_KEY = "access:last:flushing"
+FLUSH_LOCK_KEY = "lock:access:flush"
+FLUSH_LOCK_SECONDS = 300
+
+# takes a snapshot of the counters, unless the previous flush left one behind
+SNAPSHOT_LUA = """
+for i = 1, 2 do
+    if redis.call('exists', KEYS[i + 2]) == 0 and redis.call('exists', KEYS[i]) == 1 then
+        redis.call('rename', KEYS[i], KEYS[i + 2])
+    end
+end
+return redis.call('hlen', KEYS[3])
+"""
+
+RELEASE_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+access_stats = {"recorded": 0, "errors": 0, "flushed": 0}
+
+register_collector("access", lambda: dict(access_stats))
+
+
+def access_field(owner_id, storage_key: str) -> str:
+    # the owner lets the flush find the row in its partition of file. empty when the
+    # caller does not know it
+    return f"{owner_id or ''}|{storage_key}"
+
+
+def parse_access_field(field: str) -> tuple[UUID | None, str]:
+    owner_id, separator, storage_key = field.partition("|")
+    if not separator:
+        # recorded before the owner was part of the field
+        return None, field
+    try:
+        return UUID(owner_id), storage_key
+    except ValueError:
+        return None, storage_key
+
+
+def key_owner(storage_key: str) -> str | None:
+    """
+    owner of a key laid out by the app ("<user_id>/<uuid><ext>"). None for the others,
+    e.g. the objects brought in by `reconcile.py import`
+    """
+    try:
+        return str(UUID(storage_key.split("/", 1)[0]))
+    except ValueError:
+        return None
+
+
+def record_access(objects: Iterable[tuple[UUID | str | None, str]]):
+    """
+    counts one access to each (owner_id, storage key), in Redis only (a pipeline, one
+    round trip). never fails the request, a lost count only delays tiering.
+    a blocking call: run it from a thread (or a background task) in the async routes.
+    """
+    fields = [access_field(owner_id, key) for owner_id, key in objects]
+    if not fields:
+        return
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        for field in fields:
+            pipe.hincrby(ACCESS_COUNTS_KEY, field, 1)
+        now = int(time.time())
+        pipe.hset(ACCESS_LAST_KEY, mapping={field: now for field in fields})
+        pipe.execute()
+        access_stats["recorded"] += len(fields)
+    except Exception as e:
+        access_stats["errors"] += 1
+        logger.warning("failed to record %d accesses: %s", len(fields), e)
+
+
+def add_access_counts(rows: list[tuple[UUID, str, int, datetime]]):
+    """
+    UPDATE file SET access_count = access_count + v.accesses, ...
+    FROM (VALUES (owner_id, storage_path, accesses, accessed_at), ...) AS v
+    WHERE file.owner_id = v.owner_id AND file.storage_path = v.storage_path
+
+    the owner prunes the partitions at run time: each row probes the unique
+    (storage_path, owner_id) index of one partition, not of all of them
+    """
+    data = values(
+        column("owner_id", PG_UUID(as_uuid=True)),
+        column("storage_path", String),
+        column("accesses", BigInteger),
+        column("accessed_at", DateTime),
+        name="accesses",
+    ).data(rows)
+    return _add_counts(
+        data,
+        models.File.owner_id == data.c.owner_id,
+        models.File.storage_path == data.c.storage_path,
+    )
+
+
+def add_unowned_access_counts(rows: list[tuple[str, int, datetime]]):
+    """
+    the counters recorded without an owner: joined on storage_path only, every
+    partition is probed
+    """
+    data = values(
+        column("storage_path", String),
+        column("accesses", BigInteger),
+        column("accessed_at", DateTime),
+        name="accesses",
+    ).data(rows)
+    return _add_counts(data, models.File.storage_path == data.c.storage_path)
+
+
+def _add_counts(data, *join):
+    return (
+        update(models.File)
+        .where(*join)
+        .values(
+            access_count=models.File.access_count + data.c.accesses,
+            # greatest() skips NULLs
+            last_accessed_at=func.greatest(
+                models.File.last_accessed_at, data.c.accessed_at
+            ),
+            # not a change of the file, keep the onupdate away
+            updated_at=models.File.updated_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def flush_access_counts(db: Session, batch_size: int) -> int:
+    """
+    moves the Redis counters to file.access_count / last_accessed_at, one UPDATE per
+    batch. counters recorded during the flush go to the next one. a batch is removed
+    from Redis once committed: a flush that dies half way is resumed by the next one
+    and may count its last batch twice, nothing is lost.
+    """
+    client = get_redis_client()
+    token = secrets.token_hex(16)
+    if not client.set(FLUSH_LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_SECONDS):
+        logger.info("another flush of the access counters is running")
+        return 0
+
+    flushed = 0
+    try:
+        keys = [ACCESS_COUNTS_KEY, ACCESS_LAST_KEY, FLUSHING_COUNTS_KEY, FLUSHING_LAST_KEY]
+        if not client.eval(SNAPSHOT_LUA, len(keys), *keys):
+            client.delete(FLUSHING_LAST_KEY)
+            return 0
+
+        batch = []
+        for field, accesses in client.hscan_iter(FLUSHING_COUNTS_KEY, count=batch_size):
+            batch.append((field.decode(), int(accesses)))
+            if len(batch) >= batch_size:
+                flushed += _flush_batch(db, client, batch)
+                batch = []
+        if batch:
+            flushed += _flush_batch(db, client, batch)
+        client.delete(FLUSHING_COUNTS_KEY, FLUSHING_LAST_KEY)
+    finally:
+        client.eval(RELEASE_LOCK_LUA, 1, FLUSH_LOCK_KEY, token)
+
+    access_stats["flushed"] += flushed
+    logger.info("flushed the access counts of %d objects", flushed)
+    return flushed
+
+
+def _flush_batch(db: Session, client, batch: list[tuple[str, int]]) -> int:
+    fields = [field for field, _ in batch]
+    last = client.hmget(FLUSHING_LAST_KEY, fields)
+    owned, unowned = [], []
+    for (field, accesses), at in zip(batch, last):
+        accessed_at = datetime.fromtimestamp(int(at or time.time()), timezone.utc)
+        accessed_at = accessed_at.replace(tzinfo=None)
+        owner_id, storage_key = parse_access_field(field)
+        if owner_id is None:
+            unowned.append((storage_key, accesses, accessed_at))
+        else:
+            owned.append((owner_id, storage_key, accesses, accessed_at))
+    try:
+        if owned:
+            db.execute(add_access_counts(owned))
+        if unowned:
+            db.execute(add_unowned_access_counts(unowned))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    client.hdel(FLUSHING_COUNTS_KEY, *fields)
+    # still flushing, keep the others out
+    client.expire(FLUSH_LOCK_KEY, FLUSH_LOCK_SECONDS)
+    return len(batch)
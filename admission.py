@@ -0,0 +1,146 @@
+import json
+import jwt
+from fastapi import HTTPException
+from config import get_settings
+from logger import get_logger
+from metrics import register_collector
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+UPLOAD_PATH = "/user/upload"
+
+
+class UploadAdmissionMiddleware:
+    """
+    admission control for uploads, as a plain ASGI middleware so it sees the body
+    while it is received (FastAPI reads the whole multipart body before the route).
+
+    - Content-Length over the limit -> 413 before a byte is read
+    - too many uploads of this user in flight on this worker -> 429
+    - the worker's byte budget is used up -> 503
+    - a body that grows past its Content-Length (or the limit, without one) is cut
+      off with 413 while it streams
+
+    the budget is held until the request is fully done, background tasks (the S3
+    upload, which keeps the file in memory) included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight_bytes = 0
+        self.uploads_per_user: dict[str, int] = {}
+        self.counters = {
+            "admitted": 0,
+            "too_large": 0,
+            "user_busy": 0,
+            "worker_busy": 0,
+        }
+        register_collector("uploads", self.snapshot)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"].rstrip("/") != UPLOAD_PATH
+        ):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        try:
+            declared = int(headers[b"content-length"])
+        except (KeyError, ValueError):
+            declared = None
+
+        limit = settings.upload_max_request_bytes
+        if declared is not None and declared > limit:
+            self.counters["too_large"] += 1
+            return await reject(send, 413, f"uploads are limited to {limit} bytes")
+
+        user = uploader(headers)
+        if self.uploads_per_user.get(user, 0) >= settings.upload_max_concurrent_per_user:
+            self.counters["user_busy"] += 1
+            return await reject(
+                send, 429, "too many uploads in progress", retry_after=True
+            )
+
+        reserved = declared if declared is not None else limit
+        if self.in_flight_bytes + reserved > settings.upload_worker_budget_bytes:
+            self.counters["worker_busy"] += 1
+            logger.warning(
+                "upload rejected, %d of %d bytes in flight",
+                self.in_flight_bytes,
+                settings.upload_worker_budget_bytes,
+            )
+            return await reject(
+                send, 503, "the server is busy, please retry", retry_after=True
+            )
+
+        self.counters["admitted"] += 1
+        self.in_flight_bytes += reserved
+        self.uploads_per_user[user] = self.uploads_per_user.get(user, 0) + 1
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > reserved:
+                    self.counters["too_large"] += 1
+                    # raised inside the body parsing, FastAPI turns it into the response
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"the request body is larger than {reserved} bytes",
+                    )
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            self.in_flight_bytes -= reserved
+            self.uploads_per_user[user] -= 1
+            if not self.uploads_per_user[user]:
+                del self.uploads_per_user[user]
+
+    def snapshot(self) -> dict:
+        budget = settings.upload_worker_budget_bytes
+        return {
+            **self.counters,
+            "in_flight_bytes": self.in_flight_bytes,
+            "budget_bytes": budget,
+            "budget_used": round(self.in_flight_bytes / budget, 3) if budget else None,
+            "uploads_in_flight": sum(self.uploads_per_user.values()),
+        }
+
+
+def uploader(headers: dict) -> str:
+    """
+    user id from the access token cookie, only used to count concurrent uploads (the
+    route still authenticates the request)
+    """
+    cookies = headers.get(b"cookie", b"").decode("latin-1")
+    for cookie in cookies.split(";"):
+        name, _, value = cookie.strip().partition("=")
+        if name == "access_token" and value:
+            try:
+                payload = jwt.decode(value, settings.secret_key, settings.algorithm)
+                return f"user:{payload.get('user_id')}"
+            except jwt.InvalidTokenError:
+                break
+    return "anonymous"
+
+
+async def reject(send, status_code: int, detail: str, retry_after: bool = False):
+    headers = [(b"content-type", b"application/json")]
+    if retry_after:
+        headers.append(
+            (b"retry-after", str(settings.upload_retry_after_seconds).encode())
+        )
+    # the body is not read: close the connection rather than leave it in the socket
+    headers.append((b"connection", b"close"))
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send(
+        {"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()}
+    )
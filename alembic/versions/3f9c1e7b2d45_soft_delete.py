@@ -0,0 +1,113 @@
+"""soft delete
+
+Revision ID: 3f9c1e7b2d45
+Revises: a983dcf46626
+Create Date: 2026-10-19 21:00:00.000000
+
+file.deleted_at / user.deleted_at tombstones. the owner indexes become partial
+(live rows only): each one is rebuilt concurrently under a temporary name, the old one
+dropped concurrently, and the new one renamed, so the table stays readable and writable
+and an index is always there.
+NOTE: downgrading makes every file in the trash live again, purge it first
+(python purge.py --retention 0).
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f9c1e7b2d45"
+down_revision: Union[str, None] = "a983dcf46626"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FOLDER_PATH_OPS = {"folder_path": "text_pattern_ops"}
+
+# name -> (columns, postgresql_ops)
+OWNER_INDEXES = {
+    "ix_file_owner_uploaded_at_id": (["owner_id", "uploaded_at", "id"], None),
+    "ix_file_owner_size_id": (["owner_id", "size", "id"], None),
+    "ix_file_owner_file_extension": (["owner_id", "file_extension"], None),
+    "ix_file_owner_content_type": (["owner_id", "content_type"], None),
+    "ix_file_owner_folder_path": (["owner_id", "folder_path"], FOLDER_PATH_OPS),
+}
+
+
+def rebuild_index(name, columns, ops, where):
+    op.create_index(
+        f"{name}_new",
+        "file",
+        columns,
+        postgresql_ops=ops or {},
+        postgresql_where=where,
+        postgresql_concurrently=True,
+        if_not_exists=True,
+    )
+    op.drop_index(
+        name, table_name="file", postgresql_concurrently=True, if_exists=True
+    )
+    op.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+
+
+def upgrade():
+    op.add_column("file", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+    op.add_column("user", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        for name, (columns, ops) in OWNER_INDEXES.items():
+            rebuild_index(name, columns, ops, sa.text("deleted_at IS NULL"))
+
+        op.create_index(
+            "ix_file_owner_deleted_at",
+            "file",
+            ["owner_id", "deleted_at"],
+            postgresql_where=sa.text("deleted_at IS NOT NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_file_deleted_at",
+            "file",
+            ["deleted_at"],
+            postgresql_where=sa.text("deleted_at IS NOT NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_user_deleted_at",
+            "user",
+            ["deleted_at"],
+            postgresql_where=sa.text("deleted_at IS NOT NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_deleted_at",
+            table_name="user",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            "ix_file_deleted_at",
+            table_name="file",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            "ix_file_owner_deleted_at",
+            table_name="file",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        for name, (columns, ops) in OWNER_INDEXES.items():
+            rebuild_index(name, columns, ops, None)
+
+    op.drop_column("user", "deleted_at")
+    op.drop_column("file", "deleted_at")
@@ -0,0 +1,79 @@
+"""owner scoped file indexes
+
+Revision ID: 5a8428d4a132
+Revises: 1c8388bbce4c
+Create Date: 2026-10-19 19:10:00.000000
+
+replace the single column indexes (which every query ignored, since all of them filter on
+owner_id first) with owner-leading composites. built/dropped CONCURRENTLY so the table
+stays writable; that can't run in a transaction, hence the autocommit blocks.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5a8428d4a132"
+down_revision: Union[str, None] = "1c8388bbce4c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+NEW_INDEXES = [
+    ("ix_file_owner_uploaded_at_id", ["owner_id", "uploaded_at", "id"]),
+    ("ix_file_owner_file_extension", ["owner_id", "file_extension"]),
+    ("ix_file_owner_content_type", ["owner_id", "content_type"]),
+]
+
+# unique index on the url column: ix_file_access_url after 1c8388bbce4c,
+# ix_file_s3_url on databases created with create_all
+REDUNDANT_INDEXES = [
+    ("ix_file_access_url", ["access_url"], True),
+    ("ix_file_s3_url", ["s3_url"], True),
+    ("ix_file_updated_at", ["updated_at"], False),
+    ("ix_file_content_type", ["content_type"], False),
+    ("ix_file_file_extension", ["file_extension"], False),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # new indexes first, so owner scoped queries never lose their index
+        for name, columns in NEW_INDEXES:
+            op.create_index(
+                name,
+                "file",
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        for name, _, _ in REDUNDANT_INDEXES:
+            op.drop_index(
+                name, table_name="file", postgresql_concurrently=True, if_exists=True
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        # only one of access_url / s3_url exists, depending on how the table was created
+        existing_columns = {
+            column["name"] for column in sa.inspect(op.get_bind()).get_columns("file")
+        }
+        for name, columns, unique in REDUNDANT_INDEXES:
+            if not set(columns) <= existing_columns:
+                continue
+            op.create_index(
+                name,
+                "file",
+                columns,
+                unique=unique,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        for name, _ in NEW_INDEXES:
+            op.drop_index(
+                name, table_name="file", postgresql_concurrently=True, if_exists=True
+            )
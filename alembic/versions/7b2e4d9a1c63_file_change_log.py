@@ -0,0 +1,53 @@
+"""file change log
+
+Revision ID: 7b2e4d9a1c63
+Revises: 3f9c1e7b2d45
+Create Date: 2026-10-20 10:00:00.000000
+
+file_change (per user log behind GET /user/files/changes) and the user's sequence
+counters. existing clients start with a resync (their cursor is missing).
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7b2e4d9a1c63"
+down_revision: Union[str, None] = "3f9c1e7b2d45"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # server defaults: no table rewrite
+    op.add_column(
+        "user",
+        sa.Column("change_seq", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+    op.add_column(
+        "user",
+        sa.Column("change_floor", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "file_change",
+        sa.Column("owner_id", sa.UUID(), nullable=False),
+        sa.Column("seq", sa.BigInteger(), nullable=False),
+        sa.Column("file_id", sa.UUID(), nullable=False),
+        sa.Column("op", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["owner_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("owner_id", "seq"),
+    )
+    op.create_index(
+        op.f("ix_file_change_created_at"), "file_change", ["created_at"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_file_change_created_at"), table_name="file_change")
+    op.drop_table("file_change")
+    op.drop_column("user", "change_floor")
+    op.drop_column("user", "change_seq")
@@ -0,0 +1,184 @@
+"""partitioned file table, step 2: the swap
+
+Revision ID: a8d4e2f6b1c9
+Revises: f3a7c9e1d5b8
+Create Date: 2026-10-21 15:30:00.000000
+
+file becomes file_unpartitioned and file_partitioned becomes file, indexes and
+constraints renamed to the names of models.File. only renames under an exclusive lock
+on both tables, so it takes as long as the lock takes to get. refuses to run until
+`python partition_files.py verify` has found both tables equal.
+
+file_content's foreign key now has to include owner_id; it is added NOT VALID and
+validated afterwards, without blocking writes.
+
+file_unpartitioned is kept for the downgrade, drop it once the partitioned table has
+proven itself:  DROP TABLE file_unpartitioned
+it loses its foreign key to user: nothing deletes its rows any more, and purge.py only
+looks at file before deleting an account, the old rows would block it forever. the
+downgrade puts the foreign key back once the rows are copied back.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a8d4e2f6b1c9"
+down_revision: Union[str, None] = "f3a7c9e1d5b8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SHADOW = "file_partitioned"
+OLD = "file_unpartitioned"
+
+# indexes (and constraint indexes) of file, "<name>_partitioned" on the shadow table
+INDEX_NAMES = [
+    "file_pkey",
+    "file_storage_path_key",
+    "ix_file_owner_uploaded_at_id",
+    "ix_file_owner_size_id",
+    "ix_file_owner_file_extension",
+    "ix_file_owner_content_type",
+    "ix_file_owner_folder_path",
+    "ix_file_owner_deleted_at",
+    "ix_file_deleted_at",
+    "ix_file_standard_last_access",
+    "ix_file_infrequent_access_count",
+    "ix_file_filename",
+    "ix_file_uploaded_at",
+]
+
+
+def rename_indexes(old_suffix: str, new_suffix: str):
+    # renaming a constraint's index renames the constraint too. IF EXISTS: the old
+    # table does not have every index, depending on how it was created
+    for name in INDEX_NAMES:
+        op.execute(
+            f"ALTER INDEX IF EXISTS {name}{old_suffix} RENAME TO {name}{new_suffix}"
+        )
+
+
+def drop_owner_foreign_keys(table: str):
+    # by lookup, the name depends on how the table was created
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if foreign_key["referred_table"] == "user":
+            op.drop_constraint(foreign_key["name"], table, type_="foreignkey")
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.execute(f"LOCK TABLE file, {SHADOW} IN ACCESS EXCLUSIVE MODE")
+    verified = bind.scalar(
+        sa.text("SELECT verified_at FROM file_partition_progress WHERE id = 1")
+    )
+    file_has_rows = bind.scalar(sa.text("SELECT EXISTS (SELECT 1 FROM file)"))
+    if file_has_rows and verified is None:
+        raise RuntimeError(
+            "file_partitioned is not verified yet: run `python partition_files.py "
+            "backfill` and `python partition_files.py verify` first"
+        )
+
+    op.execute("DROP TRIGGER file_partitioned_sync ON file")
+    op.execute("DROP FUNCTION file_partitioned_sync()")
+    op.drop_table("file_partition_progress")
+    op.drop_constraint("file_content_file_id_fkey", "file_content", type_="foreignkey")
+
+    op.rename_table("file", OLD)
+    rename_indexes("", "_unpartitioned")
+    drop_owner_foreign_keys(OLD)
+    op.rename_table(SHADOW, "file")
+    rename_indexes("_partitioned", "")
+    op.execute(
+        "ALTER TABLE file RENAME CONSTRAINT file_owner_id_fkey_partitioned "
+        "TO file_owner_id_fkey"
+    )
+
+    op.execute(
+        "ALTER TABLE file_content ADD CONSTRAINT file_content_file_fkey "
+        "FOREIGN KEY (file_id, owner_id) REFERENCES file (id, owner_id) "
+        "ON DELETE CASCADE NOT VALID"
+    )
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE file_content VALIDATE CONSTRAINT file_content_file_fkey")
+
+
+def downgrade():
+    """
+    copies the rows written since the swap back, under the lock: downtime grows with
+    the time since the upgrade
+    """
+    op.execute(f"LOCK TABLE file, {OLD} IN ACCESS EXCLUSIVE MODE")
+    op.drop_constraint("file_content_file_fkey", "file_content", type_="foreignkey")
+
+    op.execute(
+        "ALTER TABLE file RENAME CONSTRAINT file_owner_id_fkey "
+        "TO file_owner_id_fkey_partitioned"
+    )
+    op.rename_table("file", SHADOW)
+    rename_indexes("", "_partitioned")
+    op.rename_table(OLD, "file")
+    rename_indexes("_unpartitioned", "")
+
+    columns = [
+        column["name"] for column in sa.inspect(op.get_bind()).get_columns("file")
+    ]
+    updated = [name for name in columns if name != "id"]
+    targets = ", ".join(f'"{name}"' for name in updated)
+    values = ", ".join(f'EXCLUDED."{name}"' for name in updated)
+    op.execute(
+        f"DELETE FROM file WHERE NOT EXISTS (SELECT 1 FROM {SHADOW} AS p "
+        "WHERE p.id = file.id AND p.owner_id = file.owner_id)"
+    )
+    op.execute(
+        f"INSERT INTO file SELECT * FROM {SHADOW} "
+        f"ON CONFLICT (id) DO UPDATE SET ({targets}) = ROW({values})"
+    )
+    # the rows now all come from the partitioned table, their owners exist
+    op.create_foreign_key("file_owner_id_fkey", "file", "user", ["owner_id"], ["id"])
+    op.create_foreign_key(
+        "file_content_file_id_fkey",
+        "file_content",
+        "file",
+        ["file_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+
+    # back to the state after step 1, equal and verified
+    op.create_table(
+        "file_partition_progress",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("last_id", sa.UUID(), nullable=True),
+        sa.Column("copied", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("verified_at", sa.DateTime(), nullable=True),
+    )
+    op.execute(
+        "INSERT INTO file_partition_progress (id, verified_at) "
+        "VALUES (1, now() AT TIME ZONE 'utc')"
+    )
+    shadow_columns = [name for name in columns if name not in ("id", "owner_id")]
+    targets = ", ".join(f'"{name}"' for name in shadow_columns)
+    values = ", ".join(f'EXCLUDED."{name}"' for name in shadow_columns)
+    op.execute(
+        f"""
+        CREATE FUNCTION file_partitioned_sync() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM {SHADOW} WHERE id = OLD.id AND owner_id = OLD.owner_id;
+                RETURN NULL;
+            END IF;
+            INSERT INTO {SHADOW} SELECT NEW.*
+            ON CONFLICT (id, owner_id) DO UPDATE SET ({targets}) = ROW({values});
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    op.execute(
+        "CREATE TRIGGER file_partitioned_sync AFTER INSERT OR UPDATE OR DELETE ON file "
+        "FOR EACH ROW EXECUTE FUNCTION file_partitioned_sync()"
+    )
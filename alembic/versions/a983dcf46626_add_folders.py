@@ -0,0 +1,68 @@
+"""add folders
+
+Revision ID: a983dcf46626
+Revises: d8ef339fcd4f
+Create Date: 2026-10-19 19:30:00.000000
+
+folder table (materialised path) and file.folder_path. the new column has a constant
+default, so adding it does not rewrite the table; its index is built concurrently.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a983dcf46626"
+down_revision: Union[str, None] = "d8ef339fcd4f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        "folder",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("path", sa.String(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("owner_id", sa.UUID(), nullable=False),
+        sa.ForeignKeyConstraint(["owner_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_folder_owner_path",
+        "folder",
+        ["owner_id", "path"],
+        unique=True,
+        postgresql_ops={"path": "text_pattern_ops"},
+    )
+    op.add_column(
+        "file",
+        sa.Column("folder_path", sa.String(), nullable=False, server_default="/"),
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_file_owner_folder_path",
+            "file",
+            ["owner_id", "folder_path"],
+            postgresql_ops={"folder_path": "text_pattern_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_file_owner_folder_path",
+            table_name="file",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+    op.drop_column("file", "folder_path")
+    op.drop_index("ix_folder_owner_path", table_name="folder")
+    op.drop_table("folder")
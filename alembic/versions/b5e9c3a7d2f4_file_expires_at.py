@@ -0,0 +1,49 @@
+"""file expiry
+
+Revision ID: b5e9c3a7d2f4
+Revises: a8d4e2f6b1c9
+Create Date: 2026-10-22 10:00:00.000000
+
+file.expires_at (temporary files, deleted by expiry.py) with a partial index on the
+expiring files. file is partitioned and CREATE INDEX CONCURRENTLY does not work on a
+partitioned table: the index is created on the parent only (invalid), built
+concurrently on each partition and attached, which makes the parent's valid.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b5e9c3a7d2f4"
+down_revision: Union[str, None] = "a8d4e2f6b1c9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX = "ix_file_expires_at"
+PARTITIONS = 16
+WHERE = "deleted_at IS NULL AND expires_at IS NOT NULL"
+
+
+def upgrade():
+    # nullable, no default: no table rewrite
+    op.add_column("file", sa.Column("expires_at", sa.DateTime(), nullable=True))
+    op.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY file (expires_at) WHERE {WHERE}"
+    )
+
+    with op.get_context().autocommit_block():
+        for remainder in range(PARTITIONS):
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX}_p{remainder} "
+                f"ON file_p{remainder} (expires_at) WHERE {WHERE}"
+            )
+            op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {INDEX}_p{remainder}")
+
+
+def downgrade():
+    # the partitions' indexes go with the parent's
+    op.drop_index(INDEX, table_name="file", if_exists=True)
+    op.drop_column("file", "expires_at")
@@ -0,0 +1,78 @@
+"""file access counts and storage tier
+
+Revision ID: c4a81f5e2b07
+Revises: 7b2e4d9a1c63
+Create Date: 2026-10-20 14:00:00.000000
+
+file.access_count / last_accessed_at (flushed from Redis by tiering.py) and
+file.storage_tier, with the partial indexes tiering.py walks (built concurrently).
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4a81f5e2b07"
+down_revision: Union[str, None] = "7b2e4d9a1c63"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # server defaults: no table rewrite
+    op.add_column(
+        "file",
+        sa.Column("access_count", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+    op.add_column("file", sa.Column("last_accessed_at", sa.DateTime(), nullable=True))
+    op.add_column(
+        "file",
+        sa.Column(
+            "storage_tier", sa.String(), nullable=False, server_default="standard"
+        ),
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_file_standard_last_access",
+            "file",
+            [sa.text("coalesce(last_accessed_at, uploaded_at)")],
+            postgresql_where=sa.text(
+                "deleted_at IS NULL AND storage_tier = 'standard'"
+            ),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_file_infrequent_access_count",
+            "file",
+            ["access_count"],
+            postgresql_where=sa.text(
+                "deleted_at IS NULL AND storage_tier = 'infrequent'"
+            ),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_file_infrequent_access_count",
+            table_name="file",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            "ix_file_standard_last_access",
+            table_name="file",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+    op.drop_column("file", "storage_tier")
+    op.drop_column("file", "last_accessed_at")
+    op.drop_column("file", "access_count")
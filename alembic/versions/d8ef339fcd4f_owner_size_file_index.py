@@ -0,0 +1,40 @@
+"""owner size file index
+
+Revision ID: d8ef339fcd4f
+Revises: 5a8428d4a132
+Create Date: 2026-10-19 19:20:00.000000
+
+serves the min_size/max_size filters and sort_by=size of GET /user/files.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d8ef339fcd4f"
+down_revision: Union[str, None] = "5a8428d4a132"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_file_owner_size_id",
+            "file",
+            ["owner_id", "size", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_file_owner_size_id",
+            table_name="file",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
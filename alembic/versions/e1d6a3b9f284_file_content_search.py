@@ -0,0 +1,57 @@
+"""file content search
+
+Revision ID: e1d6a3b9f284
+Revises: c4a81f5e2b07
+Create Date: 2026-10-21 09:00:00.000000
+
+file_content: extracted text and tsvector of the text-like files (indexer.py), with
+the GIN index behind GET /user/files?q=. a new table, its indexes are built before it
+has rows. existing files are queued with `python indexer.py --backfill`.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e1d6a3b9f284"
+down_revision: Union[str, None] = "c4a81f5e2b07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        "file_content",
+        sa.Column("file_id", sa.UUID(), nullable=False),
+        sa.Column("owner_id", sa.UUID(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("document", sa.Text(), nullable=True),
+        sa.Column("search_vector", postgresql.TSVECTOR(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("indexed_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["file_id"], ["file.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["owner_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("file_id"),
+    )
+    op.create_index(
+        "ix_file_content_search",
+        "file_content",
+        ["search_vector"],
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_file_content_pending",
+        "file_content",
+        ["created_at"],
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_file_content_pending", table_name="file_content")
+    op.drop_index("ix_file_content_search", table_name="file_content")
+    op.drop_table("file_content")
@@ -0,0 +1,145 @@
+"""partitioned file table, step 1: the shadow copy
+
+Revision ID: f3a7c9e1d5b8
+Revises: e1d6a3b9f284
+Create Date: 2026-10-21 15:00:00.000000
+
+file_partitioned: the same columns as file, hash partitioned on owner_id into
+file_p0 ... file_p15, with the indexes of file under a "_partitioned" suffix. a trigger
+on file mirrors every insert / update / delete into it, so the existing rows can be
+copied while the app keeps writing:
+
+    alembic upgrade f3a7c9e1d5b8
+    python partition_files.py backfill
+    python partition_files.py verify
+    alembic upgrade a8d4e2f6b1c9      # the swap (a short exclusive lock)
+
+the tables are empty at this point, nothing needs to be built concurrently.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f3a7c9e1d5b8"
+down_revision: Union[str, None] = "e1d6a3b9f284"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+SHADOW = "file_partitioned"
+SUFFIX = "_partitioned"
+
+LIVE = sa.text("deleted_at IS NULL")
+TOMBSTONE = sa.text("deleted_at IS NOT NULL")
+
+# name -> (columns, postgresql_ops, postgresql_where), the indexes of models.File
+INDEXES = {
+    "ix_file_owner_uploaded_at_id": (["owner_id", "uploaded_at", "id"], None, LIVE),
+    "ix_file_owner_size_id": (["owner_id", "size", "id"], None, LIVE),
+    "ix_file_owner_file_extension": (["owner_id", "file_extension"], None, LIVE),
+    "ix_file_owner_content_type": (["owner_id", "content_type"], None, LIVE),
+    "ix_file_owner_folder_path": (
+        ["owner_id", "folder_path"],
+        {"folder_path": "text_pattern_ops"},
+        LIVE,
+    ),
+    "ix_file_owner_deleted_at": (["owner_id", "deleted_at"], None, TOMBSTONE),
+    "ix_file_deleted_at": (["deleted_at"], None, TOMBSTONE),
+    "ix_file_standard_last_access": (
+        [sa.text("coalesce(last_accessed_at, uploaded_at)")],
+        None,
+        sa.text("deleted_at IS NULL AND storage_tier = 'standard'"),
+    ),
+    "ix_file_infrequent_access_count": (
+        ["access_count"],
+        None,
+        sa.text("deleted_at IS NULL AND storage_tier = 'infrequent'"),
+    ),
+    "ix_file_filename": (["filename"], None, None),
+    "ix_file_uploaded_at": (["uploaded_at"], None, None),
+}
+
+
+def sync_function_sql(source_columns: list[str]) -> str:
+    """
+    the trigger function keeping file_partitioned equal to file. same column order
+    (LIKE), so NEW.* can be inserted as it is.
+    """
+    updated = [name for name in source_columns if name not in ("id", "owner_id")]
+    targets = ", ".join(f'"{name}"' for name in updated)
+    values = ", ".join(f'EXCLUDED."{name}"' for name in updated)
+    return f"""
+        CREATE FUNCTION file_partitioned_sync() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM {SHADOW} WHERE id = OLD.id AND owner_id = OLD.owner_id;
+                RETURN NULL;
+            END IF;
+            INSERT INTO {SHADOW} SELECT NEW.*
+            ON CONFLICT (id, owner_id) DO UPDATE SET ({targets}) = ROW({values});
+            RETURN NULL;
+        END
+        $$
+    """
+
+
+def upgrade():
+    op.execute(
+        f"CREATE TABLE {SHADOW} (LIKE file INCLUDING DEFAULTS) "
+        "PARTITION BY HASH (owner_id)"
+    )
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f"CREATE TABLE file_p{remainder} PARTITION OF {SHADOW} "
+            f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})"
+        )
+
+    # a unique constraint of a partitioned table has to include the partition key
+    op.create_primary_key(f"file_pkey{SUFFIX}", SHADOW, ["id", "owner_id"])
+    op.create_unique_constraint(
+        f"file_storage_path_key{SUFFIX}", SHADOW, ["storage_path", "owner_id"]
+    )
+    op.create_foreign_key(
+        f"file_owner_id_fkey{SUFFIX}", SHADOW, "user", ["owner_id"], ["id"]
+    )
+    for name, (columns, ops, where) in INDEXES.items():
+        op.create_index(
+            f"{name}{SUFFIX}",
+            SHADOW,
+            columns,
+            postgresql_ops=ops or {},
+            postgresql_where=where,
+        )
+
+    # progress of partition_files.py: where the backfill is, and when verify found
+    # both tables equal (the swap refuses to run before that)
+    op.create_table(
+        "file_partition_progress",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("last_id", sa.UUID(), nullable=True),
+        sa.Column("copied", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("verified_at", sa.DateTime(), nullable=True),
+    )
+    op.execute("INSERT INTO file_partition_progress (id) VALUES (1)")
+
+    columns = [
+        column["name"] for column in sa.inspect(op.get_bind()).get_columns("file")
+    ]
+    op.execute(sync_function_sql(columns))
+    op.execute(
+        "CREATE TRIGGER file_partitioned_sync AFTER INSERT OR UPDATE OR DELETE ON file "
+        "FOR EACH ROW EXECUTE FUNCTION file_partitioned_sync()"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS file_partitioned_sync ON file")
+    op.execute("DROP FUNCTION IF EXISTS file_partitioned_sync()")
+    op.drop_table("file_partition_progress")
+    # the partitions and indexes go with it
+    op.execute(f"DROP TABLE {SHADOW}")
@@ -0,0 +1,186 @@
+import posixpath
+import queue
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# size of the pieces read from storage and written to the zip
+CHUNK_SIZE = 1024 * 1024
+# chunks buffered per object that is being prefetched
+CHUNKS_PER_OBJECT = 4
+# how many objects are downloaded ahead of the one being written
+PREFETCH = 4
+
+# dates before this can't be stored in a zip
+ZIP_EPOCH = datetime(1980, 1, 1)
+
+_DONE = object()
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    # path inside the archive
+    name: str
+    # storage key
+    key: str
+    size: int
+    modified_at: datetime
+
+
+class _Sink:
+    """
+    write-only, unseekable target for ZipFile: zipfile then writes data descriptors
+    after each entry instead of seeking back to patch the headers
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def archive_names(paths: Iterable[str]) -> list[str]:
+    """
+    "/docs/a.txt" -> "docs/a.txt", duplicates get a counter: "a.txt", "a (1).txt"
+    """
+    names, seen = [], set()
+    for path in paths:
+        name = path.lstrip("/") or "untitled"
+        root, ext = posixpath.splitext(name)
+        counter = 1
+        while name in seen:
+            name = f"{root} ({counter}){ext}"
+            counter += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+class _Prefetcher:
+    """
+    downloads the object being written and up to `prefetch` after it, each into its
+    own small bounded queue, so memory stays at about
+    (prefetch + 1) * CHUNKS_PER_OBJECT * chunk_size whatever the size of the objects.
+    """
+
+    def __init__(self, entries, fetch, prefetch: int, chunk_size: int):
+        self.entries = entries
+        self.fetch = fetch
+        self.chunk_size = chunk_size
+        self.stopped = threading.Event()
+        self.window = max(prefetch, 0) + 1
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.window, thread_name_prefix="archive"
+        )
+        self.queues: dict[int, queue.Queue] = {}
+        self.next_to_start = 0
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _download(self, index: int, q: queue.Queue):
+        try:
+            for chunk in self.fetch(self.entries[index].key, self.chunk_size):
+                if not self._put(q, chunk):
+                    return
+            self._put(q, _DONE)
+        except Exception as e:
+            self._put(q, e)
+
+    def _fill(self, current: int):
+        while (
+            self.next_to_start < len(self.entries)
+            and self.next_to_start < current + self.window
+        ):
+            q = queue.Queue(maxsize=CHUNKS_PER_OBJECT)
+            self.queues[self.next_to_start] = q
+            self.pool.submit(self._download, self.next_to_start, q)
+            self.next_to_start += 1
+
+    def chunks(self, index: int) -> Iterator[bytes]:
+        """
+        chunks of entry `index`, in order. raises what the download raised.
+        """
+        self._fill(index)
+        q = self.queues.pop(index)
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        self.stopped.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_zip(
+    entries: list[ArchiveEntry],
+    fetch: Callable[[str, int], Iterable[bytes]],
+    prefetch: int = PREFETCH,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    yields a zip of `entries` as it is built: stored (the files are mostly compressed
+    already), ZIP64 so neither an entry nor the archive is limited to 4 GB, no
+    temporary file. `fetch(key, chunk_size)` returns the content of one object.
+
+    an object that can't be fetched at all is left out and listed in ERRORS.txt at the
+    end of the archive (the response status is long gone by then). one that fails
+    half way ends the stream, the client gets a truncated archive.
+    """
+    sink = _Sink()
+    prefetcher = _Prefetcher(entries, fetch, prefetch, chunk_size)
+    failed = []
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as zf:
+            for index, entry in enumerate(entries):
+                info = zipfile.ZipInfo(
+                    entry.name, max(entry.modified_at, ZIP_EPOCH).timetuple()[:6]
+                )
+                info.compress_type = zipfile.ZIP_STORED
+                try:
+                    chunks = prefetcher.chunks(index)
+                    first = next(chunks, b"")
+                except Exception as e:
+                    # nothing of this entry is written yet, it can still be skipped
+                    logger.error("archive: failed to fetch %s: %s", entry.key, e)
+                    failed.append(f"{entry.name}: {e}")
+                    continue
+
+                with zf.open(info, mode="w", force_zip64=True) as out:
+                    out.write(first)
+                    yield sink.drain()
+                    for chunk in chunks:
+                        out.write(chunk)
+                        yield sink.drain()
+
+            if failed:
+                zf.writestr("ERRORS.txt", "\n".join(failed) + "\n")
+        yield sink.drain()
+    finally:
+        prefetcher.close()
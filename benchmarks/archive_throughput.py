@@ -0,0 +1,124 @@
+"""
+throughput and peak memory of the streaming zip behind GET /user/files/archive.
+
+    python benchmarks/archive_throughput.py [--files 8] [--size-mb 512] [--prefetch 0,1,4]
+                                            [--first-byte-ms 40] [--object-mbps 200]
+                                            [--output archive.zip]
+
+the objects are generated in memory and fetched with a simulated storage latency (time
+to first byte, then a per object bandwidth cap), like S3 GETs. each prefetch setting
+runs in its own process, so the peak RSS reported is that of one archive. the default
+is an 8 x 512 MB = 4 GB archive, past the 4 GB limit of a zip without ZIP64.
+--output writes the last archive to disk (check it with `unzip -t`).
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import CHUNK_SIZE, ArchiveEntry, stream_zip  # noqa: E402
+
+
+def make_fetch(size: int, first_byte_ms: float, object_mbps: float):
+    payload = os.urandom(CHUNK_SIZE)
+
+    def fetch(key: str, chunk_size: int):
+        time.sleep(first_byte_ms / 1000)
+        bandwidth = object_mbps * 1024 * 1024
+        seconds_per_chunk = chunk_size / bandwidth if bandwidth else 0
+        sent = 0
+        while sent < size:
+            chunk = payload[: min(chunk_size, size - sent)]
+            time.sleep(seconds_per_chunk)
+            sent += len(chunk)
+            yield chunk
+
+    return fetch
+
+
+def run_one(args) -> dict:
+    size = args.size_mb * 1024 * 1024
+    entries = [
+        ArchiveEntry(
+            name=f"file_{i}.bin", key=str(i), size=size, modified_at=datetime.utcnow()
+        )
+        for i in range(args.files)
+    ]
+    fetch = make_fetch(size, args.first_byte_ms, args.object_mbps)
+
+    out = open(args.output, "wb") if args.output else None
+    written = 0
+    start = time.perf_counter()
+    for chunk in stream_zip(entries, fetch, prefetch=args.prefetch):
+        written += len(chunk)
+        if out:
+            out.write(chunk)
+    elapsed = time.perf_counter() - start
+    if out:
+        out.close()
+
+    return {
+        "prefetch": args.prefetch,
+        "bytes": written,
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(written / 1024 / 1024 / elapsed, 1),
+        # kilobytes on linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--prefetch", default="0,1,4", help="comma separated settings")
+    parser.add_argument("--first-byte-ms", type=float, default=40)
+    parser.add_argument("--object-mbps", type=float, default=200, help="0 = unlimited")
+    parser.add_argument("--output", help="write the (last) archive to this file")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        args.prefetch = int(args.prefetch)
+        print(json.dumps(run_one(args)))
+        return
+
+    total_gb = args.files * args.size_mb / 1024
+    print(
+        f"{args.files} x {args.size_mb} MB ({total_gb:.1f} GB), "
+        f"first byte {args.first_byte_ms} ms, "
+        f"{args.object_mbps or 'unlimited'} MB/s per object"
+    )
+    print(f"{'prefetch':>8} {'seconds':>9} {'MB/s':>8} {'peak RSS MB':>12}")
+    for prefetch in args.prefetch.split(","):
+        cmd = [
+            sys.executable,
+            __file__,
+            "--single",
+            "--files", str(args.files),
+            "--size-mb", str(args.size_mb),
+            "--prefetch", prefetch,
+            "--first-byte-ms", str(args.first_byte_ms),
+            "--object-mbps", str(args.object_mbps),
+        ]  # fmt: skip
+        if args.output:
+            cmd += ["--output", args.output]
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = json.loads(proc.stdout.splitlines()[-1])
+        print(
+            f"{result['prefetch']:>8} {result['seconds']:>9} {result['mb_per_s']:>8} "
+            f"{result['peak_rss_mb']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+load test of the whole app (middlewares, auth, Postgres, Redis, storage) with scripted
+traffic mixes, checked against latency/error SLOs.
+
+    python benchmarks/loadtest.py [--scenario listing_mix] [--duration 30] [--concurrency 32]
+                                  [--users 16] [--files 50] [--file-kb 64]
+                                  [--url http://localhost:8000] [--slo "GET /user/files:p95=150"]
+                                  [--max-error-rate 0.01] [--json report.json]
+
+scenarios: login_storm, listing_mix, bulk_upload, delete_all (comma separated, or "all").
+
+without --url the requests go to `main.app` in this process (httpx ASGI transport, the
+app's lifespan runs), with the local filesystem storage backend in a temporary directory
+instead of S3 and the rate limiter off. Postgres and Redis are the ones configured in
+the env, e.g. the docker-compose services on localhost:
+
+    docker compose up -d file-pg file-redis
+    POSTGRES_SERVICE=localhost HOST_NAME=localhost CREATE_SCHEMA_ON_STARTUP=true \\
+        python benchmarks/loadtest.py --scenario all
+
+every run registers its own users. prints throughput, p50/p95/p99 latency and error
+rate per route and the peak RSS (of the app too when in process), then exits 1 if an
+SLO is missed.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+PASSWORD = "loadtest-password"
+
+# route -> (p95 ms, p99 ms), checked for the routes a scenario sends
+DEFAULT_SLOS = {
+    "POST /auth/login": (800, 1500),
+    "GET /user/files": (150, 400),
+    "GET /user/files?filter": (250, 600),
+    "GET /user/files/changes": (150, 400),
+    "POST /user/upload": (1500, 3000),
+    "DELETE /user/files": (500, 1500),
+}
+MAX_ERROR_RATE = 0.01
+
+
+@dataclass
+class RouteStats:
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    statuses: dict = field(default_factory=dict)
+
+    def add(self, seconds: float, status: int | None, ok: bool):
+        self.latencies.append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    nearest rank, `values` sorted
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+class LoadClient:
+    """
+    one virtual user: its own cookie, every request timed under a route name
+    """
+
+    def __init__(self, http: httpx.AsyncClient, stats: dict):
+        self.http = http
+        self.stats = stats
+        self.cookie = None
+
+    async def request(self, route: str, method: str, url: str, expect=(200,), **kwargs):
+        headers = kwargs.pop("headers", {})
+        if self.cookie:
+            headers["Cookie"] = f"access_token={self.cookie}"
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+            status = response.status_code
+        except Exception:
+            response, status = None, None
+        elapsed = time.perf_counter() - start
+        self.stats.setdefault(route, RouteStats()).add(
+            elapsed, status, status in expect
+        )
+        return response
+
+    async def login(self, username: str):
+        response = await self.request(
+            "POST /auth/login",
+            "POST",
+            "/auth/login",
+            json={"username": username, "password": PASSWORD},
+        )
+        if response is not None and response.status_code == 200:
+            self.cookie = response.cookies.get("access_token")
+        return self.cookie is not None
+
+    async def upload(self, payload: bytes, count: int):
+        files = [
+            ("files", (f"file-{uuid.uuid4().hex[:8]}.bin", payload, "application/octet-stream"))
+            for _ in range(count)
+        ]
+        return await self.request(
+            "POST /user/upload", "POST", "/user/upload", expect=(201,), files=files
+        )
+
+
+# SCENARIOS
+# each one runs as `concurrency` copies of a loop until the deadline
+
+
+async def login_storm(client: LoadClient, user: str, ctx: dict, deadline: float):
+    # bcrypt on every request, the CPU bound path
+    while time.perf_counter() < deadline:
+        await client.login(user)
+
+
+async def listing_mix(client: LoadClient, user: str, ctx: dict, deadline: float):
+    """
+    mostly listings, some conditional (ETag), some filtered, delta sync polls, and a
+    few uploads that invalidate the caches
+    """
+    if not await client.login(user):
+        return
+    etag, cursor = None, None
+    while time.perf_counter() < deadline:
+        roll = random.random()
+        if roll < 0.55:
+            headers = {"If-None-Match": etag} if etag and random.random() < 0.5 else {}
+            response = await client.request(
+                "GET /user/files", "GET", "/user/files", expect=(200, 304), headers=headers
+            )
+            if response is not None and response.headers.get("etag"):
+                etag = response.headers["etag"]
+        elif roll < 0.75:
+            await client.request(
+                "GET /user/files?filter",
+                "GET",
+                "/user/files",
+                params={"file_extension": ".bin", "sort_by": "size", "order": "desc"},
+            )
+        elif roll < 0.95:
+            params = {} if cursor is None else {"since": cursor}
+            response = await client.request(
+                "GET /user/files/changes", "GET", "/user/files/changes", params=params
+            )
+            if response is not None and response.status_code == 200:
+                cursor = response.json()["cursor"]
+        else:
+            await client.upload(ctx["payload"], 1)
+
+
+async def bulk_upload(client: LoadClient, user: str, ctx: dict, deadline: float):
+    if not await client.login(user):
+        return
+    while time.perf_counter() < deadline:
+        await client.upload(ctx["payload"], ctx["files_per_upload"])
+
+
+async def delete_all(client: LoadClient, user: str, ctx: dict, deadline: float):
+    # refill then empty the account: the tombstone UPDATE of every file
+    if not await client.login(user):
+        return
+    while time.perf_counter() < deadline:
+        for _ in range(max(1, ctx["files"] // ctx["files_per_upload"])):
+            await client.upload(ctx["payload"], ctx["files_per_upload"])
+        await client.request("DELETE /user/files", "DELETE", "/user/files")
+
+
+SCENARIOS = {
+    "login_storm": login_storm,
+    "listing_mix": listing_mix,
+    "bulk_upload": bulk_upload,
+    "delete_all": delete_all,
+}
+
+
+# HELPERS FUNCTION
+
+
+def in_process_env(storage_root: str):
+    # must run before main is imported (settings are read at import)
+    os.environ.setdefault("STORAGE_BACKEND", "local")
+    os.environ.setdefault("STORAGE_LOCAL_ROOT", storage_root)
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("LOG_FILE", os.path.join(storage_root, "loadtest.log"))
+
+
+async def register_users(http: httpx.AsyncClient, count: int) -> list[str]:
+    run = uuid.uuid4().hex[:8]
+    users = []
+    for i in range(count):
+        username = f"lt_{run}_{i}"
+        response = await http.post(
+            "/auth/register",
+            json={
+                "username": username,
+                "email": f"{username}@loadtest.example.com",
+                "password": PASSWORD,
+                "confirm_password": PASSWORD,
+            },
+        )
+        if response.status_code != 201:
+            sys.exit(f"registering {username} failed: {response.status_code} {response.text}")
+        users.append(username)
+    return users
+
+
+async def seed_files(http: httpx.AsyncClient, users: list[str], ctx: dict):
+    # outside of the measurement
+    seeding = {}
+    for user in users:
+        client = LoadClient(http, seeding)
+        await client.login(user)
+        for _ in range(max(1, ctx["files"] // ctx["files_per_upload"])):
+            await client.upload(ctx["payload"], ctx["files_per_upload"])
+    errors = sum(stats.errors for stats in seeding.values())
+    if errors:
+        sys.exit(f"seeding failed: {errors} requests failed")
+
+
+async def run_scenario(http, name: str, users: list[str], args, ctx: dict) -> dict:
+    stats = {}
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            SCENARIOS[name](LoadClient(http, stats), users[i % len(users)], ctx, deadline)
+            for i in range(args.concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "routes": stats}
+
+
+def summarize(name: str, result: dict, slos: dict, max_error_rate: float):
+    elapsed = result["elapsed"]
+    routes, violations = {}, []
+    for route, stats in sorted(result["routes"].items()):
+        latencies = sorted(stats.latencies)
+        count = len(latencies)
+        summary = {
+            "requests": count,
+            "rps": round(count / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "errors": stats.errors,
+            "error_rate": round(stats.errors / count, 4) if count else 0,
+            "statuses": {str(k): v for k, v in stats.statuses.items()},
+        }
+        routes[route] = summary
+
+        p95, p99 = slos.get(route, (None, None))
+        if p95 is not None and summary["p95_ms"] > p95:
+            violations.append(f"{name}: {route} p95 {summary['p95_ms']}ms > {p95}ms")
+        if p99 is not None and summary["p99_ms"] > p99:
+            violations.append(f"{name}: {route} p99 {summary['p99_ms']}ms > {p99}ms")
+        if summary["error_rate"] > max_error_rate:
+            violations.append(
+                f"{name}: {route} error rate {summary['error_rate']:.2%} "
+                f"> {max_error_rate:.2%}"
+            )
+
+    total = sum(route["requests"] for route in routes.values())
+    report = {
+        "scenario": name,
+        "seconds": round(elapsed, 1),
+        "requests": total,
+        "rps": round(total / elapsed, 1) if elapsed else 0,
+        # of the process so far (kilobytes on linux)
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "routes": routes,
+        "violations": violations,
+    }
+    return report
+
+
+def print_report(report: dict):
+    print(
+        f"\n== {report['scenario']}: {report['requests']} requests in "
+        f"{report['seconds']}s ({report['rps']} req/s), peak RSS {report['peak_rss_mb']} MB"
+    )
+    print(
+        f"{'route':<28} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>7}"
+    )
+    for route, r in report["routes"].items():
+        print(
+            f"{route:<28} {r['requests']:>7} {r['rps']:>8} {r['p50_ms']:>8} "
+            f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['errors']:>7}"
+        )
+    for violation in report["violations"]:
+        print(f"SLO MISSED  {violation}")
+
+
+def parse_slos(values: list[str]) -> dict:
+    """
+    "GET /user/files:p95=150,p99=400" -> {"GET /user/files": (150, 400)}
+    """
+    slos = dict(DEFAULT_SLOS)
+    for value in values:
+        route, _, limits = value.rpartition(":")
+        p95, p99 = slos.get(route, (None, None))
+        for limit in limits.split(","):
+            key, _, ms = limit.partition("=")
+            if key == "p95":
+                p95 = float(ms)
+            elif key == "p99":
+                p99 = float(ms)
+            else:
+                raise ValueError(f"unknown SLO {limit!r} in {value!r}")
+        slos[route] = (p95, p99)
+    return slos
+
+
+async def main_async(args) -> int:
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    slos = parse_slos(args.slo)
+    ctx = {
+        "payload": os.urandom(args.file_kb * 1024),
+        "files": args.files,
+        "files_per_upload": min(args.files, args.files_per_upload),
+    }
+
+    lifespan = None
+    if args.url:
+        transport, base_url = None, args.url
+    else:
+        in_process_env(tempfile.mkdtemp(prefix="loadtest-"))
+        from main import app
+
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        transport, base_url = httpx.ASGITransport(app=app), "http://loadtest"
+
+    reports = []
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url=base_url, timeout=args.timeout
+        ) as http:
+            users = await register_users(http, args.users)
+            if "listing_mix" in names:
+                await seed_files(http, users, ctx)
+            for name in names:
+                result = await run_scenario(http, name, users, args, ctx)
+                report = summarize(name, result, slos, args.max_error_rate)
+                print_report(report)
+                reports.append(report)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 1 if any(report["violations"] for report in reports) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", default="listing_mix", help="comma separated, or all")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users")
+    parser.add_argument("--users", type=int, default=16, help="accounts they share")
+    parser.add_argument("--files", type=int, default=50, help="files per account")
+    parser.add_argument("--files-per-upload", type=int, default=10)
+    parser.add_argument("--file-kb", type=int, default=64)
+    parser.add_argument("--url", help="a running server instead of main.app in process")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--slo", action="append", default=[], help='"ROUTE:p95=MS,p99=MS", repeatable'
+    )
+    parser.add_argument("--max-error-rate", type=float, default=MAX_ERROR_RATE)
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
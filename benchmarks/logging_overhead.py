@@ -0,0 +1,103 @@
+"""
+measure how much time the logging calls of one request cost the caller (the event loop).
+
+    python benchmarks/logging_overhead.py [--requests 20000] [--calls-per-request 6]
+
+compares the old setup (FileHandler + StreamHandler on the root logger, f-string messages)
+against the queue pipeline from logger.py (lazy %-args, JSON records, background writer).
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP_DIR = tempfile.mkdtemp(prefix="log-bench-")
+os.environ["LOG_FILE"] = os.path.join(TMP_DIR, "queue.log")
+
+import logger as app_logging  # noqa: E402  (must be imported after LOG_FILE is set)
+
+# the format logger.py used before the queue pipeline
+SYNC_LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+
+def _silence_stream(handlers):
+    devnull = open(os.devnull, "w")
+    for handler in handlers:
+        if isinstance(handler, logging.StreamHandler) and not isinstance(
+            handler, logging.FileHandler
+        ):
+            handler.setStream(devnull)
+
+
+def setup_sync():
+    handlers = [
+        logging.FileHandler(os.path.join(TMP_DIR, "sync.log")),
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(SYNC_LOG_FORMAT))
+    _silence_stream(handlers)
+    root = logging.getLogger()
+    root.handlers = handlers
+
+
+def setup_queue():
+    app_logging._stop_listener(app_logging.listener)
+    listener = app_logging.setup_logging()
+    _silence_stream(listener.handlers)
+    return listener
+
+
+def one_request(log, n_calls, lazy, i):
+    user = f"user-{i}"
+    for n in range(n_calls):
+        if lazy:
+            log.info("listing files for %s (%d/%d)", user, n, n_calls)
+            log.debug("cache payload %s", {"user": user, "n": n})
+        else:
+            log.info(f"listing files for {user} ({n}/{n_calls})")
+            log.debug(f"cache payload {({'user': user, 'n': n})}")
+
+
+def run(name, log, n_requests, n_calls, lazy):
+    samples = []
+    for i in range(n_requests):
+        start = time.perf_counter()
+        one_request(log, n_calls, lazy, i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    print(
+        f"{name:<28} mean {statistics.fmean(samples):8.1f}us  "
+        f"p50 {samples[len(samples) // 2]:8.1f}us  "
+        f"p99 {samples[int(len(samples) * 0.99)]:8.1f}us  per request"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--calls-per-request", type=int, default=6)
+    args = parser.parse_args()
+
+    log = logging.getLogger("routers.user")
+
+    setup_sync()
+    run("sync handlers, f-strings", log, args.requests, args.calls_per_request, False)
+
+    listener = setup_queue()
+    run("queue pipeline, lazy args", log, args.requests, args.calls_per_request, True)
+
+    start = time.perf_counter()
+    app_logging._stop_listener(listener)
+    print(f"writer thread drained backlog in {(time.perf_counter() - start) * 1000:.1f}ms")
+    print(f"log files written to {TMP_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+listing and bulk delete latency of file, unpartitioned vs hash partitioned on owner_id.
+
+    python benchmarks/partitioning.py [--users 1000] [--files 2000000] [--samples 200]
+                                      [--json] [--keep]
+
+builds both layouts in scratch schemas of the configured database (POSTGRES_* env),
+seeds them with the same generated rows (benchmarks/query_plans.py), ANALYZEs them,
+then times the statements the app issues for a sample of owners: the default listing,
+a filtered listing, DELETE /user/files (to the trash) and the purge of an owner's rows.
+the deletes are rolled back, every owner sees the same data. the gap grows with the
+table: run it at the size you care about.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import MetaData, delete, text, update  # noqa: E402
+
+import models  # noqa: E402
+from benchmarks.loadtest import percentile  # noqa: E402
+from benchmarks.query_plans import SEED_FILES, SEED_USERS  # noqa: E402
+from database import engine  # noqa: E402
+from routers.user import build_files_query  # noqa: E402
+
+SCHEMAS = {
+    "unpartitioned": "partition_bench_plain",
+    "partitioned": "partition_bench_hash",
+}
+
+
+def create_tables(conn, layout: str):
+    if layout == "partitioned":
+        models.Base.metadata.create_all(
+            conn, tables=[models.User.__table__, models.File.__table__]
+        )
+        return
+    # the same table without PARTITION BY (a copy drops the partition listeners)
+    plain = MetaData()
+    models.User.__table__.to_metadata(plain)
+    file = models.File.__table__.to_metadata(plain)
+    file.dialect_options["postgresql"]["partition_by"] = None
+    plain.create_all(conn)
+
+
+def statements(owner_id):
+    return {
+        "list all files": build_files_query(owner_id),
+        "list by extension": build_files_query(owner_id, file_extension=".pdf"),
+        "delete all (trash)": update(models.File)
+        .where(models.File.owner_id == owner_id, models.File.deleted_at.is_(None))
+        .values(deleted_at=models._utcnow())
+        .returning(models.File.id),
+        "purge owner rows": delete(models.File).where(models.File.owner_id == owner_id),
+    }
+
+
+def relations_scanned(conn, owner_id) -> int:
+    compiled = build_files_query(owner_id).compile(dialect=conn.dialect)
+    rows = conn.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    ).scalar()
+    plan = (rows if isinstance(rows, list) else json.loads(rows))[0]["Plan"]
+
+    relations = set()
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if "Relation Name" in node:
+            relations.add(node["Relation Name"])
+        stack.extend(node.get("Plans", []))
+    return len(relations)
+
+
+def run_layout(conn, layout: str, args) -> dict:
+    schema = SCHEMAS[layout]
+    conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.exec_driver_sql(f"CREATE SCHEMA {schema}")
+    conn.exec_driver_sql(f"SET search_path TO {schema}")
+    create_tables(conn, layout)
+
+    print(f"[{layout}] seeding {args.users} users / {args.files} files ...")
+    conn.execute(text(SEED_USERS), {"users": args.users})
+    conn.execute(text(SEED_FILES), {"files": args.files, "users": args.users})
+    conn.commit()
+    conn.exec_driver_sql(f"SET search_path TO {schema}")
+    conn.exec_driver_sql("ANALYZE")
+
+    owners = [
+        str(owner_id)
+        for owner_id in conn.execute(text('SELECT id FROM "user" ORDER BY id')).scalars()
+    ]
+    sample = random.Random(42).sample(owners, min(args.samples, len(owners)))
+
+    latencies: dict[str, list] = {}
+    for owner_id in sample:
+        for name, stmt in statements(owner_id).items():
+            start = time.perf_counter()
+            result = conn.execute(stmt)
+            if result.returns_rows:
+                result.all()
+            latencies.setdefault(name, []).append(time.perf_counter() - start)
+            # the deletes are undone, the next owner sees the same table
+            conn.rollback()
+            conn.exec_driver_sql(f"SET search_path TO {schema}")
+
+    summary = {
+        name: {
+            "p50_ms": round(percentile(sorted(values), 50) * 1000, 2),
+            "p95_ms": round(percentile(sorted(values), 95) * 1000, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        }
+        for name, values in latencies.items()
+    }
+    summary["relations scanned by a listing"] = relations_scanned(conn, sample[0])
+    conn.rollback()
+
+    if not args.keep:
+        conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=2_000_000)
+    parser.add_argument("--samples", type=int, default=200, help="owners timed")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schemas")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        results = {layout: run_layout(conn, layout, args) for layout in SCHEMAS}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    before, after = results["unpartitioned"], results["partitioned"]
+    print(f"{'':<24}{'unpartitioned p50/p95 ms':>28}{'partitioned p50/p95 ms':>28}")
+    for name in statements("00000000-0000-0000-0000-000000000000"):
+        print(
+            f"{name:<24}"
+            f"{before[name]['p50_ms']:>18.2f} / {before[name]['p95_ms']:<7.2f}"
+            f"{after[name]['p50_ms']:>18.2f} / {after[name]['p95_ms']:<7.2f}"
+        )
+    key = "relations scanned by a listing"
+    print(f"{key:<24}{before[key]:>28}{after[key]:>28}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+check that the core file queries are served by the owner-leading indexes.
+
+    python benchmarks/query_plans.py [--users 200] [--files 200000] [--keep]
+
+builds the models into a scratch schema of the configured database (POSTGRES_* env),
+seeds it with generated rows, ANALYZEs it, and runs EXPLAIN on the statements the app
+issues. exits 1 if any of them scans `file` sequentially, picks an unexpected index, or
+(when it is owner scoped) reads more than one partition of file, so it can run in CI
+against a throwaway postgres. tests/test_query_plans.py runs the same checks with the
+test suite.
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, text, update  # noqa: E402
+
+import models  # noqa: E402
+from database import engine  # noqa: E402
+from routers.user import build_files_query  # noqa: E402
+
+SCHEMA = "query_plan_check"
+
+# the statements that are not owner scoped, they may read every partition
+CROSS_OWNER = {"purge batch (purge.py)"}
+
+# partitions of file and their indexes (named by Postgres) -> the index of file
+PARTITION_INDEXES = """
+SELECT child.relname, parent.relname
+FROM pg_inherits
+JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_namespace ON pg_namespace.oid = child.relnamespace
+WHERE pg_namespace.nspname = current_schema()
+"""
+
+OWNER_INDEXES = {
+    "ix_file_owner_uploaded_at_id",
+    "ix_file_owner_size_id",
+    "ix_file_owner_file_extension",
+    "ix_file_owner_content_type",
+    "ix_file_owner_folder_path",
+}
+
+SEED_USERS = """
+INSERT INTO "user" (id, username, hashed_password, email)
+SELECT gen_random_uuid(), 'user_' || g, 'x', 'user_' || g || '@example.com'
+FROM generate_series(1, :users) AS g
+"""
+
+SEED_FILES = """
+WITH owners AS (SELECT id, row_number() OVER () AS n FROM "user")
+INSERT INTO file (id, filename, uploaded_at, updated_at, storage_path, size, s3_url,
+                  content_type, file_extension, folder_path, deleted_at, owner_id)
+SELECT gen_random_uuid(),
+       'file_' || g,
+       now() - g * interval '1 second',
+       now() - g * interval '1 second',
+       owners.id || '/' || g,
+       (g * 7919) % 100000000,
+       'https://bucket.s3.amazonaws.com/' || owners.id || '/' || g,
+       (ARRAY['image/png', 'text/plain', 'application/pdf', 'video/mp4', 'text/csv'])[g % 5 + 1],
+       (ARRAY['.png', '.txt', '.pdf', '.mp4', '.csv'])[g % 5 + 1],
+       '/folder_' || g % 20 || '/' || CASE WHEN g % 3 = 0 THEN 'sub/' ELSE '' END,
+       CASE WHEN g % 50 = 0 THEN now() - g % 30 * interval '1 day' END,
+       owners.id
+FROM generate_series(1, :files) AS g
+JOIN owners ON owners.n = g % :users + 1
+"""
+
+# the indexed text of the text files, one of four topics each
+SEED_CONTENT = """
+INSERT INTO file_content (file_id, owner_id, status, document, search_vector,
+                          created_at, indexed_at)
+SELECT id, owner_id, 'indexed', document, to_tsvector('english', document), now(), now()
+FROM (
+    SELECT id, owner_id,
+           'quarterly ' || (ARRAY['invoice', 'budget', 'travel', 'meeting'])[
+               abs(hashtext(filename)) % 4 + 1
+           ] || ' notes of ' || filename AS document
+    FROM file
+    WHERE content_type LIKE 'text/%'
+) AS texts
+"""
+
+
+def core_queries(owner_id):
+    """
+    (name, statement, allowed indexes). owner_id is passed as text so the compiled
+    params can go to the driver as they are.
+    """
+    return [
+        ("list all files", build_files_query(owner_id), OWNER_INDEXES),
+        (
+            "filter by extension",
+            build_files_query(owner_id, file_extension=".pdf"),
+            {"ix_file_owner_file_extension"},
+        ),
+        (
+            "filter by content type",
+            build_files_query(owner_id, content_type="text/csv"),
+            {"ix_file_owner_content_type"},
+        ),
+        (
+            "files over 90 MB, largest first",
+            build_files_query(owner_id, min_size=90_000_000, sort_by="size"),
+            {"ix_file_owner_size_id"},
+        ),
+        (
+            "uploaded in the last hour",
+            build_files_query(
+                owner_id, uploaded_after=datetime.utcnow() - timedelta(hours=1)
+            ),
+            {"ix_file_owner_uploaded_at_id"},
+        ),
+        (
+            "folder listing",
+            build_files_query(owner_id, folder="/folder_7/"),
+            {"ix_file_owner_folder_path"},
+        ),
+        (
+            "folder subtree listing",
+            build_files_query(owner_id, folder="/folder_7/", recursive=True),
+            {"ix_file_owner_folder_path"},
+        ),
+        (
+            # the GIN index on file_content, then file by primary key, or the other
+            # way round for a user with few files
+            "content search (q=)",
+            build_files_query(owner_id, q="invoice", sort_by="rank"),
+            OWNER_INDEXES | {"file_pkey"},
+        ),
+        (
+            "move to trash (delete_files)",
+            update(models.File)
+            .where(models.File.owner_id == owner_id, models.File.deleted_at.is_(None))
+            .values(deleted_at=datetime.utcnow()),
+            OWNER_INDEXES,
+        ),
+        (
+            "trash listing",
+            select(models.File)
+            .where(
+                models.File.owner_id == owner_id,
+                models.File.deleted_at.is_not(None),
+                models.File.deleted_at >= datetime.utcnow() - timedelta(days=7),
+            )
+            .order_by(models.File.deleted_at.desc())
+            .limit(100),
+            {"ix_file_owner_deleted_at"},
+        ),
+        (
+            "purge batch (purge.py)",
+            select(models.File.id, models.File.storage_path)
+            .where(models.File.deleted_at < datetime.utcnow() - timedelta(days=28))
+            .order_by(models.File.deleted_at)
+            .limit(1000),
+            {"ix_file_deleted_at"},
+        ),
+    ]
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def check_plan(conn, stmt, allowed, parents: dict, single_partition: bool):
+    """
+    parents: partition / partition index -> file / index of file
+    """
+    compiled = stmt.compile(dialect=conn.dialect)
+    rows = conn.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    ).scalar()
+    plan = (rows if isinstance(rows, list) else json.loads(rows))[0]["Plan"]
+
+    problems, used, partitions = [], set(), set()
+    for node in walk(plan):
+        relation = node.get("Relation Name")
+        if parents.get(relation, relation) != "file":
+            continue
+        partitions.add(relation)
+        if node["Node Type"] == "Seq Scan":
+            problems.append(f"sequential scan on {relation}")
+        if "Index Name" in node:
+            used.add(parents.get(node["Index Name"], node["Index Name"]))
+    if single_partition and len(partitions) > 1:
+        problems.append(f"{len(partitions)} partitions of file read, expected 1")
+    if not used & allowed:
+        problems.append(f"expected one of {sorted(allowed)}, got {sorted(used) or 'none'}")
+    return problems, used
+
+
+def create_scratch_schema(conn, users: int, files: int):
+    """
+    the models in SCHEMA, seeded and ANALYZEd. returns (owner_id, parents) for
+    check_queries. the caller drops the schema (drop_scratch_schema).
+    """
+    conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.exec_driver_sql(f"CREATE SCHEMA {SCHEMA}")
+    conn.exec_driver_sql(f"SET search_path TO {SCHEMA}")
+    models.Base.metadata.create_all(conn)
+
+    conn.execute(text(SEED_USERS), {"users": users})
+    conn.execute(text(SEED_FILES), {"files": files, "users": users})
+    conn.execute(text(SEED_CONTENT))
+    conn.exec_driver_sql("ANALYZE")
+
+    owner_id = str(conn.execute(text('SELECT id FROM "user" LIMIT 1')).scalar())
+    parents = dict(conn.execute(text(PARTITION_INDEXES)).all())
+    return owner_id, parents
+
+
+def drop_scratch_schema(conn):
+    conn.rollback()
+    conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.commit()
+
+
+def check_queries(conn, owner_id, parents):
+    """yields (name, problems, used indexes) for every core query"""
+    for name, stmt, allowed in core_queries(owner_id):
+        problems, used = check_plan(
+            conn, stmt, allowed, parents, single_partition=name not in CROSS_OWNER
+        )
+        yield name, problems, used
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schema")
+    args = parser.parse_args()
+
+    failed = False
+    with engine.connect() as conn:
+        print(f"seeding {args.users} users / {args.files} files ...")
+        owner_id, parents = create_scratch_schema(conn, args.users, args.files)
+
+        for name, problems, used in check_queries(conn, owner_id, parents):
+            status = "FAIL" if problems else "ok"
+            print(f"{status:<5}{name:<32}{', '.join(sorted(used)) or '-'}")
+            for problem in problems:
+                print(f"     - {problem}")
+            failed = failed or bool(problems)
+
+        if args.keep:
+            conn.commit()
+        else:
+            drop_scratch_schema(conn)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
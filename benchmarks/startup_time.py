@@ -0,0 +1,95 @@
+"""
+measure worker cold start: how long `import main` takes and where the time goes.
+
+    python benchmarks/startup_time.py [--runs 5] [--top 15]
+
+every run is a fresh interpreter (`python -X importtime -c "import main"`), the table shows
+the slowest top-level packages (summed self time of their modules) of the median run.
+no database/redis/S3 connection is made, only placeholder env values are needed.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLACEHOLDER_ENV = {
+    "POSTGRES_USER": "bench",
+    "POSTGRES_PASSWORD": "bench",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "bench",
+    "POSTGRES_SERVICE": "localhost",
+    "SECRET_KEY": "bench",
+    "ALGORITHM": "HS256",
+    "LOG_FILE": os.path.join(tempfile.gettempdir(), "startup-bench.log"),
+}
+
+
+def run_once(env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.exit(f"`import main` failed:\n{proc.stderr[-2000:]}")
+    return wall, proc.stderr
+
+
+def parse_importtime(stderr):
+    """
+    returns {top-level package: microseconds}, the sum of the self time of every module
+    of that package, so the numbers add up to the total import time.
+    """
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  <self us> | <cumulative us> | <indented module name>"
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        top = name.strip().split(".")[0]
+        totals[top] = totals.get(top, 0) + int(self_us)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    env = {**os.environ}
+    for key, value in PLACEHOLDER_ENV.items():
+        env.setdefault(key, value)
+
+    runs = sorted((run_once(env) for _ in range(args.runs)), key=lambda r: r[0])
+    walls = [wall for wall, _ in runs]
+    median_wall, median_stderr = runs[len(runs) // 2]
+
+    print(
+        f"`import main` wall time over {args.runs} runs: "
+        f"median {median_wall * 1000:.0f}ms  min {walls[0] * 1000:.0f}ms  "
+        f"max {walls[-1] * 1000:.0f}ms  stdev {statistics.pstdev(walls) * 1000:.0f}ms"
+    )
+
+    totals = parse_importtime(median_stderr)
+    print(f"\n{'package':<28}{'import time':>12}")
+    for name, us in sorted(totals.items(), key=lambda t: t[1], reverse=True)[: args.top]:
+        print(f"{name:<28}{us / 1000:>10.1f}ms")
+
+    for heavy in ("boto3", "botocore"):
+        print(f"\n{heavy} imported at startup: {'yes' if heavy in totals else 'no'}", end="")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class LocalCache:
+    """
+    per worker LRU cache bounded by bytes (the size of each value is given by the
+    caller) with a TTL. thread safe, values are shared as they are: don't mutate them.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, size, expires at (monotonic))
+        self.entries: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key: str):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                self.counters["misses"] += 1
+                return None
+            if time.monotonic() >= item[2]:
+                self._pop(key)
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return item[0]
+
+    def set(self, key: str, value, size: int, ttl: float | None = None):
+        # a value bigger than the whole cache would only flush everything else
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + min(self.ttl, ttl if ttl is not None else self.ttl)
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (value, size, expires_at)
+            self.size += size
+            # least recently used first
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._pop(oldest)
+                self.counters["evictions"] += 1
+
+    def delete(self, key: str):
+        with self.lock:
+            if self._pop(key):
+                self.counters["invalidations"] += 1
+
+    def delete_where(self, predicate: Callable[[str], bool]):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self._pop(key)
+                self.counters["invalidations"] += 1
+
+    def _pop(self, key: str) -> bool:
+        item = self.entries.pop(key, None)
+        if item is None:
+            return False
+        self.size -= item[1]
+        return True
+
+    def snapshot(self) -> dict:
+        return {**self.counters, "keys": len(self.entries), "bytes": self.size}
@@ -0,0 +1,92 @@
+from datetime import datetime
+from typing import Iterable
+from sqlalchemy import delete, func, insert, literal, select, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.orm import Session
+import models
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+
+def record_changes(db: Session, owner_id, file_ids: Iterable, op: str):
+    """
+    appends one entry per file to the owner's change log, in the caller's transaction
+    (call it after the statements that change the files, before the commit). two
+    statements whatever the number of files.
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    # locks the user row until the commit, the next writer gets the following numbers
+    last = db.scalar(
+        update(models.User)
+        .where(models.User.id == owner_id)
+        .values(change_seq=models.User.change_seq + len(file_ids))
+        .returning(models.User.change_seq)
+        .execution_options(synchronize_session=False)
+    )
+    ids = (
+        func.unnest(literal(file_ids, ARRAY(PG_UUID(as_uuid=True))))
+        .table_valued("file_id", with_ordinality="ord")
+        .render_derived()
+    )
+    db.execute(
+        insert(models.FileChange).from_select(
+            ["owner_id", "seq", "file_id", "op", "created_at"],
+            select(
+                literal(owner_id, PG_UUID(as_uuid=True)),
+                ids.c.ord + (last - len(file_ids)),
+                ids.c.file_id,
+                literal(op),
+                literal(models._utcnow()),
+            ),
+        )
+    )
+
+
+def compact_changes(db: Session, cutoff: datetime, batch_size: int) -> int:
+    """
+    drops the entries older than `cutoff` and raises the owners' change_floor past
+    them, so the clients whose cursor pointed there are told to resync
+    """
+    compacted = 0
+    while True:
+        old = (
+            select(models.FileChange.owner_id, models.FileChange.seq)
+            .where(models.FileChange.created_at < cutoff)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        gone = db.execute(
+            delete(models.FileChange)
+            .where(
+                tuple_(models.FileChange.owner_id, models.FileChange.seq).in_(old)
+            )
+            .returning(models.FileChange.owner_id, models.FileChange.seq)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not gone:
+            db.rollback()
+            return compacted
+
+        floors = {}
+        for owner_id, seq in gone:
+            floors[owner_id] = max(seq, floors.get(owner_id, 0))
+        # always in the same order, concurrent compactions don't deadlock
+        for owner_id, seq in sorted(floors.items()):
+            db.execute(
+                update(models.User)
+                .where(models.User.id == owner_id)
+                .values(change_floor=func.greatest(models.User.change_floor, seq))
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        compacted += len(gone)
+        logger.info(
+            "compacted %d change log entries of %d users", len(gone), len(floors)
+        )
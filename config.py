@@ -0,0 +1,168 @@
+from functools import lru_cache
+from typing import Literal
+
+from dotenv import load_dotenv
+from pydantic import AliasChoices, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """
+    every env variable the service reads, parsed and typed once.
+    missing values stay None so each component can report exactly what it needs
+    (database.py still raises if a POSTGRES_* variable is missing).
+    """
+
+    model_config = SettingsConfigDict(extra="ignore", populate_by_name=True)
+
+    # postgres
+    postgres_user: str | None = None
+    postgres_password: str | None = None
+    postgres_port: int | None = None
+    postgres_db: str | None = None
+    postgres_service: str | None = None
+
+    # read replicas, comma separated SQLAlchemy URLs (empty = everything on the primary)
+    database_replica_urls: str = ""
+    # reads of a user who wrote within this window go to the primary
+    read_your_writes_seconds: int = 5
+    # a replica that failed to connect is skipped for this long
+    replica_retry_seconds: int = 30
+
+    # connection pool (per engine, per worker)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # PgBouncer in transaction mode does the pooling: no client-side pool
+    db_pgbouncer_mode: bool = False
+
+    # redis
+    redis_host_name: str | None = Field(
+        default=None, validation_alias=AliasChoices("REDIS_HOST_NAME", "REDIS_HOST")
+    )
+    redis_port: int | None = None
+    redis_password: str | None = None
+
+    # jwt
+    secret_key: str | None = None
+    algorithm: str | None = None
+
+    # per worker cache in front of the Redis listing cache (0 bytes disables it)
+    l1_cache_max_bytes: int = 32 * 1024 * 1024
+    l1_cache_ttl_seconds: int = 30
+
+    # rate limits, "<requests>/<seconds>" per client ip (login, register) or per user
+    rate_limit_enabled: bool = True
+    rate_limit_login: str = "10/60"
+    rate_limit_register: str = "5/60"
+    rate_limit_upload: str = "30/60"
+    rate_limit_files: str = "120/60"
+    # only behind a proxy that sets X-Forwarded-For itself
+    rate_limit_trust_forwarded_for: bool = False
+
+    # uploads (POST /user/upload), enforced while the body is received
+    upload_max_request_bytes: int = 512 * 1024 * 1024
+    upload_max_file_bytes: int = 256 * 1024 * 1024
+    upload_max_files: int = 20
+    upload_max_concurrent_per_user: int = 2
+    # bytes of uploads in flight per worker (a request reserves its Content-Length)
+    upload_worker_budget_bytes: int = 1024 * 1024 * 1024
+    upload_retry_after_seconds: int = 5
+
+    # deleted files stay in the trash (restorable) this long, then purge.py removes them
+    trash_retention_seconds: int = 7 * 24 * 60 * 60
+    purge_batch_size: int = 1000
+    purge_interval_seconds: int = 300
+    # entries of the file change log (GET /user/files/changes) are kept this long, a
+    # client that has not synced for longer lists everything again
+    change_log_retention_seconds: int = 30 * 24 * 60 * 60
+
+    # temporary files (expires_in at upload or in a batch), deleted by expiry.py
+    file_expiry_max_seconds: int = 365 * 24 * 60 * 60
+    expiry_batch_size: int = 500
+    expiry_interval_seconds: int = 60
+
+    # share links (signed with SECRET_KEY/ALGORITHM)
+    share_link_default_seconds: int = 24 * 60 * 60
+    share_link_max_seconds: int = 30 * 24 * 60 * 60
+
+    # where file contents are stored: "s3" (S3_BUCKET_NAME) or "local" (a directory,
+    # downloads are served by the app through signed urls)
+    storage_backend: Literal["s3", "local"] = "s3"
+    storage_local_root: str = "data/storage"
+    # prefix of the local download urls, e.g. https://files.example.com ("" = relative)
+    storage_public_base_url: str = ""
+    # set when nginx serves the root as an internal location, e.g. "/protected/":
+    # downloads are answered with X-Accel-Redirect and nginx sends the file
+    storage_local_accel_prefix: str | None = None
+
+    # access counting and storage tiering (tiering.py): a file not accessed for
+    # TIERING_COLD_AFTER_SECONDS moves to TIERING_S3_STORAGE_CLASS, and back once it
+    # has been accessed TIERING_WARM_ACCESSES times there
+    tiering_cold_after_seconds: int = 30 * 24 * 60 * 60
+    tiering_warm_accesses: int = 3
+    # S3 bills infrequent access objects as at least 128 KB, smaller ones stay
+    tiering_min_size_bytes: int = 128 * 1024
+    tiering_s3_storage_class: str = "STANDARD_IA"
+    tiering_batch_size: int = 500
+    tiering_interval_seconds: int = 300
+
+    # full-text search of the file contents (fulltext.py, indexer.py): the text search
+    # configuration (language) and how much of a file is indexed
+    fulltext_config: str = "english"
+    fulltext_max_bytes: int = 512 * 1024
+    # PDFs are read whole (when pypdf is installed), larger ones are not indexed
+    fulltext_pdf_max_bytes: int = 20 * 1024 * 1024
+    # files are picked up once they are this old, their object is written after the
+    # upload response
+    fulltext_delay_seconds: int = 10
+    fulltext_batch_size: int = 100
+    fulltext_interval_seconds: int = 10
+
+    # storage / database reconciliation (reconcile.py): objects and rows younger than
+    # this are left alone, their upload may still be in flight
+    reconcile_min_age_seconds: int = 24 * 60 * 60
+    # key ranges listed at once
+    reconcile_workers: int = 16
+    reconcile_batch_size: int = 1000
+
+    # request profiling (profiling.py), off unless one of these two is set: the
+    # fraction of requests profiled, and the key of the X-Debug-Profile header
+    profiling_sample_rate: float = 0.0
+    profiling_secret: str | None = None
+    profiling_interval_ms: float = 5
+    profiling_tracemalloc_frames: int = 10
+    # profiles kept in Redis (newest), and for how long
+    profiling_ring_size: int = 50
+    profiling_retention_seconds: int = 24 * 60 * 60
+    # bearer token of the /admin endpoints, unset = no admin endpoints
+    admin_token: str | None = None
+
+    # aws
+    aws_region: str | None = Field(
+        default=None, validation_alias=AliasChoices("AWS_REGION", "AWS_DEFAULT_REGION")
+    )
+    s3_bucket_name: str | None = None
+
+    # logging (see logger.py)
+    log_level: str = "INFO"
+    log_file: str = "app.log"
+    log_json: bool = True
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_queue_size: int = 10000
+    # e.g. "routers.user=0.1,dependecies=0.5"
+    log_sample_rates: str = ""
+
+    # run Base.metadata.create_all when the app starts (dev only, use alembic otherwise)
+    create_schema_on_startup: bool = False
+
+
+@lru_cache
+def get_settings() -> Settings:
+    # boto3 reads the AWS_* credentials straight from os.environ, so .env is still
+    # loaded into the environment, but only once for the whole process.
+    load_dotenv()
+    return Settings()
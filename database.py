@@ -1,14 +1,21 @@
-from logger import logger
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import itertools
+import threading
+import time
+from fastapi import Request
+import jwt
+from logger import get_logger
+from config import get_settings
+from metrics import register_collector
+from timing import add_span
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 
-try:
-    load_dotenv()
-except Exception as e:
-    logger.error(f"Error loading .env file: {e}")
-    raise
+logger = get_logger(__name__)
+
+settings = get_settings()
 
 required_vars = [
     "POSTGRES_USER",
@@ -17,38 +24,238 @@ required_vars = [
     "POSTGRES_DB",
     "POSTGRES_SERVICE",
 ]
-missing_vars = [var for var in required_vars if os.getenv(var) is None]
+missing_vars = [var for var in required_vars if getattr(settings, var.lower()) is None]
 if missing_vars:
-    logger.error(f"Missing required environment variables: {', '.join(missing_vars)}")
+    logger.error(
+        "Missing required environment variables: %s", ", ".join(missing_vars)
+    )
     raise EnvironmentError(
         f"Missing required environment variables: {', '.join(missing_vars)}"
     )
 
-load_dotenv()
+SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.postgres_user}:{settings.postgres_password}@{settings.postgres_service}:{settings.postgres_port}/{settings.postgres_db}"
+
+REPLICA_DATABASE_URLS = [
+    url.strip() for url in settings.database_replica_urls.split(",") if url.strip()
+]
+
+
+def build_engine(url: str):
+    """
+    create_engine does not connect, the first checkout does.
+    in pgbouncer mode the bouncer owns the pool, so every session opens (and really
+    closes) its own server connection and no pooled connection can outlive a bouncer
+    restart; pre-ping/recycle are meaningless there.
+    """
+    if settings.db_pgbouncer_mode:
+        return create_engine(url, poolclass=NullPool)
+    return create_engine(
+        url,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+
+
+class PoolStats:
+    """
+    checkout wait time of one engine, measured around the first connection of a session
+    (waiting for a free pooled connection, or opening a new one).
+    """
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float, failed: bool = False):
+        with self.lock:
+            if failed:
+                self.failures += 1
+                return
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
 
-POSTGRES_USER = os.getenv("POSTGRES_USER")
-POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
-POSTGRES_PORT = os.getenv("POSTGRES_PORT")
-POSTGRES_DB = os.getenv("POSTGRES_DB")
-POSTGRES_SERVICE = os.getenv("POSTGRES_SERVICE")
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        with self.lock:
+            snapshot = {
+                "checkouts": self.checkouts,
+                "failures": self.failures,
+                "wait_avg_ms": round(
+                    self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0, 3
+                ),
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+        # NullPool (pgbouncer mode) has no size/overflow
+        for attr in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, attr):
+                snapshot[attr] = getattr(pool, attr)()
+        return snapshot
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVICE}:{int(POSTGRES_PORT)}/{POSTGRES_DB}"
 
 try:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = build_engine(SQLALCHEMY_DATABASE_URL)
+    replica_engines = [build_engine(url) for url in REPLICA_DATABASE_URLS]
 except Exception as e:
-    logger.error(f"Error creating database engine: {e}")
+    logger.error("Error creating database engine: %s", e)
     raise
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+primary_stats = PoolStats("primary", engine)
+replica_stats = [
+    PoolStats(f"replica-{i}", replica_engine)
+    for i, replica_engine in enumerate(replica_engines)
+]
+
+# replica index -> monotonic time until which it is skipped
+_replica_down_until: dict[int, float] = {}
+_replica_cycle = itertools.cycle(range(len(replica_engines)))
+
+register_collector(
+    "db_pools",
+    lambda: {stats.name: stats.snapshot() for stats in [primary_stats, *replica_stats]},
+)
+
+
+def _checkout(db: Session, stats: PoolStats):
+    start = time.perf_counter()
+    try:
+        db.connection()
+    except (OperationalError, PoolTimeoutError):
+        stats.record(0.0, failed=True)
+        raise
+    wait = time.perf_counter() - start
+    stats.record(wait)
+    add_span("db", wait)
+
+
+# statement time of every engine, for the "db" Server-Timing span (timing.py)
+@event.listens_for(Engine, "before_cursor_execute")
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["statement_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _statement_done(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("statement_start", None)
+    if start is not None:
+        add_span("db", time.perf_counter() - start)
+
 
 def get_db():
     db = SessionLocal()
     try:
+        _checkout(db, primary_stats)
+        yield db
+    except Exception as e:
+        logger.error("Database session error: %s", e)
+        raise
+    finally:
+        db.close()
+
+
+def _recent_write_key(user_id) -> str:
+    # NOTE: not "<user_id>:..." so delete_redis(user_id) does not clear it
+    return f"rw:{user_id}"
+
+
+def mark_user_write(user_id):
+    """
+    call after committing a write for `user_id`: that user's reads stay on the primary
+    for READ_YOUR_WRITES_SECONDS, so they never see a replica that lags behind.
+    """
+    if not replica_engines:
+        return
+    from dependecies import get_redis_client
+
+    try:
+        get_redis_client().set(
+            _recent_write_key(user_id), 1, ex=settings.read_your_writes_seconds
+        )
+    except Exception as e:
+        logger.warning("could not record write marker for %s: %s", user_id, e)
+
+
+def _wrote_recently(request: Request) -> bool:
+    token = request.cookies.get("access_token")
+    if not token:
+        return False
+    try:
+        payload = jwt.decode(token, settings.secret_key, settings.algorithm)
+    except jwt.InvalidTokenError:
+        # the auth dependency rejects the request anyway
+        return False
+    from dependecies import get_redis_client
+
+    try:
+        return bool(get_redis_client().exists(_recent_write_key(payload.get("user_id"))))
+    except Exception:
+        # can't tell, the primary is always correct
+        return True
+
+
+def _open_replica_session() -> Session | None:
+    now = time.monotonic()
+    for _ in range(len(replica_engines)):
+        index = next(_replica_cycle)
+        if _replica_down_until.get(index, 0.0) > now:
+            continue
+        db = Session(bind=replica_engines[index], autoflush=False)
+        try:
+            _checkout(db, replica_stats[index])
+            return db
+        except (OperationalError, PoolTimeoutError) as e:
+            db.close()
+            _replica_down_until[index] = now + settings.replica_retry_seconds
+            logger.warning("replica-%s unavailable, skipping it: %s", index, e)
+    return None
+
+
+def get_read_db(request: Request):
+    """
+    session for read-only dependencies. goes to a healthy replica (round robin) and
+    falls back to the primary when there is none, or when the caller wrote recently.
+    never write through this session.
+    """
+    db = None
+    if replica_engines and not _wrote_recently(request):
+        db = _open_replica_session()
+    primary = db is None
+    if primary:
+        db = SessionLocal()
+    try:
+        if primary:
+            # inside the try: a failed checkout must still close the session
+            _checkout(db, primary_stats)
         yield db
     except Exception as e:
-        logger.error(f"Database session error: {e}")
+        logger.error("Database session error: %s", e)
         raise
     finally:
         db.close()
+
+
+def create_schema():
+    """
+    create missing tables straight from the models.
+    kept out of the app startup: run it once per deploy (or use `alembic upgrade head`).
+
+        python database.py
+    """
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+
+
+if __name__ == "__main__":
+    create_schema()
+    logger.info("database schema created")
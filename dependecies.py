@@ -1,41 +1,83 @@
+import hmac
+from functools import lru_cache
 from fastapi import Request, HTTPException, status, Depends
-import os
 import jwt
-import boto3
-import logging
+import redis
 from sqlalchemy.orm import Session
-from database import get_db
+from config import get_settings
+from database import get_read_db
 import models
-from dotenv import load_dotenv
+from logger import get_logger
+from timing import span, timed
 
 
-load_dotenv()
+settings = get_settings()
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-AWS_REGION = os.getenv("AWS_REGION")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+AWS_REGION = settings.aws_region
 
 # Configure logging
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 
 
-# Initialize your S3 client
-s3_client = boto3.client("s3", region_name=AWS_REGION)
+@lru_cache
+def get_s3_client():
+    """
+    shared S3 client, built on first use.
+    importing boto3 and loading the botocore service model is the slowest part of
+    the worker start, so it is deferred until a request actually needs S3.
+    boto3 clients are thread safe, one per process is enough.
+    """
+    import boto3
+
+    return boto3.client("s3", region_name=AWS_REGION)
 
 
-def delete_s3_object(s3_key):
+class TimedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error: bool = True):
+        with span("cache"):
+            return super().execute(raise_on_error)
+
+
+class TimedRedis(redis.Redis):
     """
-    Deletes the corresponding S3 object after the File record is deleted from the database.
+    redis.Redis adding each round trip to the "cache" Server-Timing span (timing.py)
     """
-    try:
-        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-        logger.info(f"Deleted S3 object: {s3_key}")
-    except Exception as e:
-        logger.error(f"Failed to delete S3 object {s3_key}: {e}")
 
+    def execute_command(self, *args, **options):
+        with span("cache"):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
 
-def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)):
+
+@lru_cache
+def get_redis_client() -> redis.Redis:
+    """
+    shared Redis client (and its connection pool), built on first use.
+    """
+    if settings.redis_host_name is None:
+        raise RuntimeError("HOST_NAME is not set in env")
+    if settings.redis_port is None:
+        raise RuntimeError("PORT_NUMBER is not set in env")
+    if settings.redis_password is None:
+        raise RuntimeError("REDIS_PASSWORD is not set in env")
+
+    return TimedRedis(
+        host=settings.redis_host_name,
+        port=settings.redis_port,
+        password=settings.redis_password,
+    )
+
+
+@timed("auth")
+def get_current_user_from_cookie(
+    request: Request, db: Session = Depends(get_read_db)
+):
 
     # STEPS: get the token -> deocode the token -> get the user data -> fetch the user from the database -> return the user. (just handle the potentials errors)
 
@@ -52,7 +94,11 @@ def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)
         payload = jwt.decode(token, SECRET_KEY, ALGORITHM)
         username = payload.get("sub")
 
-        user = db.query(models.User).filter(models.User.username == username).first()
+        user = (
+            db.query(models.User)
+            .filter(models.User.username == username, models.User.deleted_at.is_(None))
+            .first()
+        )
 
         if not user:
             raise credential_exceptions
@@ -66,3 +112,19 @@ def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)
         )
     except jwt.InvalidTokenError:
         raise credential_exceptions
+
+
+def require_admin(request: Request):
+    """
+    the /admin endpoints: `Authorization: Bearer <ADMIN_TOKEN>`. without ADMIN_TOKEN
+    they don't exist (404).
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), settings.admin_token.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="admin token required"
+        )
@@ -0,0 +1,165 @@
+"""
+sweeper of the temporary files: a file whose expires_at has passed loses its stored
+object and its row, without going through the trash.
+
+    python expiry.py [--once] [--batch N] [--interval SECONDS]
+
+several instances can run at once, each batch is claimed with FOR UPDATE SKIP LOCKED
+from the partial index on expires_at, so a pass never scans the files that do not
+expire. after each pass the sweep lag (how late the oldest file of the pass was
+deleted) is stored in Redis, GET /metrics shows it under "expiry".
+"""
+
+import argparse
+import json
+import time
+from collections import defaultdict
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from changes import DELETE, record_changes
+from config import get_settings
+from database import SessionLocal
+from dependecies import get_redis_client
+from logger import get_logger
+import models
+from routers.user import any_id, delete_redis_folders
+from share_markers import ShareMarkerError, mark_files_deleted
+from storage import get_storage
+
+logger = get_logger("expiry")
+
+settings = get_settings()
+
+# last pass of any sweeper, read by the "expiry" metrics collector
+STATS_KEY = "expiry:stats"
+
+
+def sweep(db: Session, batch_size: int) -> dict:
+    """
+    objects first, then rows: a row whose object could not be deleted stays and is
+    retried on the next pass
+    """
+    stats = {"expired": 0, "failed": 0, "redis_failed": 0, "lag_seconds": 0.0}
+    while True:
+        now = models._utcnow()
+        rows = db.execute(
+            select(
+                models.File.id,
+                models.File.owner_id,
+                models.File.storage_path,
+                models.File.folder_path,
+                models.File.expires_at,
+            )
+            .where(models.File.expires_at <= now, models.File.deleted_at.is_(None))
+            .order_by(models.File.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            db.rollback()
+            return stats
+        stats["lag_seconds"] = max(
+            stats["lag_seconds"], (now - rows[0].expires_at).total_seconds()
+        )
+
+        failed = get_storage().delete_many(row.storage_path for row in rows)
+        done = [row for row in rows if row.storage_path not in failed]
+        folders = defaultdict(set)
+        if done:
+            db.execute(
+                delete(models.File)
+                .where(
+                    # the owners prune the partitions of file to theirs
+                    models.File.owner_id == any_id({row.owner_id for row in done}),
+                    models.File.id == any_id([row.id for row in done]),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            by_owner = defaultdict(list)
+            for row in done:
+                by_owner[row.owner_id].append(row.id)
+                folders[row.owner_id].add(row.folder_path)
+            for owner_id, file_ids in by_owner.items():
+                record_changes(db, owner_id, file_ids, DELETE)
+        db.commit()
+
+        # one invalidation per owner per batch, then the share links stop serving them.
+        # the batch is committed: a Redis failure is counted, the pass goes on
+        for owner_id, paths in folders.items():
+            try:
+                delete_redis_folders(owner_id, *paths)
+            except Exception as e:
+                stats["redis_failed"] += 1
+                logger.error("failed to invalidate the listings of %s: %s", owner_id, e)
+        try:
+            mark_files_deleted([row.id for row in done])
+        except ShareMarkerError:
+            # the objects are gone, a link to one fails at the download anyway
+            stats["redis_failed"] += 1
+
+        stats["expired"] += len(done)
+        stats["failed"] += len(failed)
+        logger.info("deleted %d expired files (%d failed)", len(done), len(failed))
+
+        if failed and not done:
+            # storage is failing, stop instead of spinning on the same rows
+            return stats
+
+
+def save_stats(stats: dict):
+    try:
+        get_redis_client().set(
+            STATS_KEY, json.dumps({**stats, "swept_at": time.time()})
+        )
+    except Exception as e:
+        logger.warning("could not save the expiry stats: %s", e)
+
+
+def read_stats() -> dict:
+    """
+    the "expiry" metrics collector: the last pass, and how long ago it ran (a sweeper
+    that stopped shows up as a growing seconds_since_sweep)
+    """
+    raw = get_redis_client().get(STATS_KEY)
+    if raw is None:
+        return {}
+    stats = json.loads(raw)
+    stats["seconds_since_sweep"] = round(time.time() - stats.pop("swept_at"), 1)
+    return stats
+
+
+def run(batch_size: int) -> dict:
+    with SessionLocal() as db:
+        stats = sweep(db, batch_size)
+    save_stats(stats)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="one pass, then exit")
+    parser.add_argument("--batch", type=int, default=settings.expiry_batch_size)
+    parser.add_argument("--interval", type=int, default=settings.expiry_interval_seconds)
+    args = parser.parse_args()
+
+    while True:
+        try:
+            stats = run(args.batch)
+            if stats["expired"] or stats["failed"]:
+                logger.info(
+                    "expiry done: %d files, %d failed, %.1fs late",
+                    stats["expired"],
+                    stats["failed"],
+                    stats["lag_seconds"],
+                )
+        except Exception as e:
+            logger.error("expiry failed: %s", e)
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
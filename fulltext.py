@@ -0,0 +1,187 @@
+"""
+full-text search of the file contents: which files are indexed, how their text is
+extracted (a bounded prefix read as a stream), and the pieces of the search query.
+the indexing itself runs in indexer.py.
+"""
+
+import codecs
+import html
+import tempfile
+from functools import lru_cache
+from sqlalchemy import func, or_
+from config import get_settings
+import models
+from storage import CHUNK_SIZE, StorageBackend
+
+settings = get_settings()
+
+# FileContent.status values
+PENDING = "pending"
+INDEXED = "indexed"
+# nothing to extract (a PDF without pypdf, a PDF over FULLTEXT_PDF_MAX_BYTES)
+SKIPPED = "skipped"
+FAILED = "failed"
+
+TEXT = "text"
+PDF = "pdf"
+
+# indexed as plain text besides text/*: csv, json and markdown are split into words by
+# the Postgres parser, their punctuation does not need its own extractor
+TEXT_CONTENT_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/csv",
+    "application/markdown",
+    "application/x-yaml",
+    "application/xml",
+}
+TEXT_EXTENSIONS = {
+    ".txt",
+    ".text",
+    ".md",
+    ".markdown",
+    ".csv",
+    ".tsv",
+    ".json",
+    ".ndjson",
+    ".log",
+    ".yaml",
+    ".yml",
+    ".xml",
+}
+
+# highlight markers of ts_headline: private use characters, stripped from the indexed
+# text, so the snippet can be html escaped and the markers turned into tags afterwards
+START_MARK = "\ue000"
+STOP_MARK = "\ue001"
+HEADLINE_OPTIONS = (
+    f"StartSel={START_MARK}, StopSel={STOP_MARK}, "
+    "MaxFragments=2, MaxWords=20, MinWords=5, FragmentDelimiter=\" ... \""
+)
+MARKS = str.maketrans("", "", START_MARK + STOP_MARK)
+
+
+@lru_cache
+def pdf_supported() -> bool:
+    # optional dependency, PDFs are only indexed when it is installed
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def extractor(content_type: str | None, file_extension: str | None) -> str | None:
+    """
+    TEXT / PDF, or None when the file is not indexed
+    """
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    file_extension = (file_extension or "").lower()
+    if content_type == "application/pdf" or file_extension == ".pdf":
+        return PDF if pdf_supported() else None
+    if (
+        content_type.startswith("text/")
+        or content_type in TEXT_CONTENT_TYPES
+        or file_extension in TEXT_EXTENSIONS
+    ):
+        return TEXT
+    return None
+
+
+def indexable():
+    """
+    the files extractor() accepts, as a SQL condition (indexer.py --backfill)
+    """
+    content_type = func.lower(models.File.content_type)
+    file_extension = func.lower(models.File.file_extension)
+    conditions = [
+        content_type.like("text/%"),
+        content_type.in_(TEXT_CONTENT_TYPES),
+        file_extension.in_(TEXT_EXTENSIONS),
+    ]
+    if pdf_supported():
+        conditions += [content_type == "application/pdf", file_extension == ".pdf"]
+    return or_(*conditions)
+
+
+def extract_text(storage: StorageBackend, key: str, kind: str, size: int) -> str | None:
+    """
+    at most FULLTEXT_MAX_BYTES of text, None when there is nothing to extract
+    """
+    if not size:
+        # S3 refuses a range of an empty object
+        return ""
+    if kind == PDF:
+        if size > settings.fulltext_pdf_max_bytes:
+            return None
+        text = extract_pdf(storage, key)
+    else:
+        text = extract_plain(storage, key)
+    return text.translate(MARKS).replace("\x00", "")
+
+
+def extract_plain(storage: StorageBackend, key: str) -> str:
+    # only the first FULLTEXT_MAX_BYTES are read, the rest of the object is never
+    # downloaded. the incremental decoder copes with a character split between chunks
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    parts = [
+        decoder.decode(chunk)
+        for chunk in storage.get(key, 0, settings.fulltext_max_bytes - 1)
+    ]
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+def extract_pdf(storage: StorageBackend, key: str) -> str:
+    # the cross reference table is at the end of a PDF, it can't be read as a stream:
+    # it is spooled to disk (memory only holds CHUNK_SIZE) and read page by page until
+    # the text reaches FULLTEXT_MAX_BYTES
+    from pypdf import PdfReader
+
+    with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as spool:
+        for chunk in storage.get(key):
+            spool.write(chunk)
+        spool.seek(0)
+
+        parts = []
+        length = 0
+        for page in PdfReader(spool).pages:
+            text = page.extract_text() or ""
+            parts.append(text)
+            length += len(text.encode())
+            if length >= settings.fulltext_max_bytes:
+                break
+    text = "\n".join(parts).encode()[: settings.fulltext_max_bytes]
+    return text.decode(errors="ignore")
+
+
+def to_tsvector(text):
+    return func.to_tsvector(settings.fulltext_config, text)
+
+
+def to_tsquery(q: str):
+    # the syntax of a search box: words, "quoted phrases", or, -excluded
+    return func.websearch_to_tsquery(settings.fulltext_config, q)
+
+
+def headline(document, query):
+    return func.ts_headline(settings.fulltext_config, document, query, HEADLINE_OPTIONS)
+
+
+def snippet_html(snippet: str | None) -> str | None:
+    """
+    the matched words in <b></b>, everything else escaped
+    """
+    if snippet is None:
+        return None
+    return (
+        html.escape(snippet)
+        .replace(START_MARK, "<b>")
+        .replace(STOP_MARK, "</b>")
+    )
+
+
+def normalize_query(q: str | None) -> str | None:
+    q = " ".join(q.split()) if q else None
+    return q or None
+
@@ -0,0 +1,217 @@
+"""
+full-text indexer: extracts the text of the files queued in file_content (pending since
+their upload) and stores it with its tsvector, searched by GET /user/files?q=.
+
+    python indexer.py [--once] [--batch N] [--interval SECONDS] [--backfill] [--retry-failed]
+
+--backfill queues the existing text-like files that have no file_content row,
+--retry-failed queues the failed ones again. several instances can run at once, each
+batch is claimed with FOR UPDATE SKIP LOCKED.
+"""
+
+import argparse
+import time
+from datetime import timedelta
+from sqlalchemy import and_, exists, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from config import get_settings
+from database import SessionLocal
+from fulltext import (
+    FAILED,
+    INDEXED,
+    PENDING,
+    SKIPPED,
+    extract_text,
+    extractor,
+    indexable,
+    to_tsvector,
+)
+from logger import get_logger
+import models
+from routers.user import bump_data_version
+from storage import StorageBackend, get_storage
+
+logger = get_logger("indexer")
+
+settings = get_settings()
+
+
+def index_file(db: Session, storage: StorageBackend, row) -> str:
+    kind = extractor(row.content_type, row.file_extension)
+    try:
+        text = extract_text(storage, row.storage_path, kind, row.size) if kind else None
+    except Exception as e:
+        logger.error("failed to extract the text of %s: %s", row.storage_path, e)
+        text, result = None, FAILED
+    else:
+        result = SKIPPED if text is None else INDEXED
+
+    stmt = (
+        update(models.FileContent)
+        .where(models.FileContent.file_id == row.file_id)
+        .values(status=result, indexed_at=models._utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if text is None:
+        db.execute(stmt)
+        return result
+    try:
+        # a savepoint: a text Postgres refuses (a tsvector over 1 MB) only fails its file
+        with db.begin_nested():
+            db.execute(stmt.values(document=text, search_vector=to_tsvector(text)))
+    except DBAPIError as e:
+        logger.error("failed to index %s: %s", row.storage_path, e)
+        db.execute(stmt.values(status=FAILED))
+        return FAILED
+    return result
+
+
+def index_pending(db: Session, batch_size: int) -> dict:
+    storage = get_storage()
+    counts = {INDEXED: 0, SKIPPED: 0, FAILED: 0}
+    while True:
+        cutoff = models._utcnow() - timedelta(seconds=settings.fulltext_delay_seconds)
+        rows = db.execute(
+            select(
+                models.FileContent.file_id,
+                models.FileContent.owner_id,
+                models.File.storage_path,
+                models.File.content_type,
+                models.File.file_extension,
+                models.File.size,
+            )
+            .join(
+                models.File,
+                and_(
+                    models.File.id == models.FileContent.file_id,
+                    models.File.owner_id == models.FileContent.owner_id,
+                ),
+            )
+            .where(
+                models.FileContent.status == PENDING,
+                models.FileContent.created_at < cutoff,
+            )
+            .order_by(models.FileContent.created_at)
+            .limit(batch_size)
+            .with_for_update(of=models.FileContent, skip_locked=True)
+        ).all()
+        if not rows:
+            db.rollback()
+            return counts
+
+        batch = {INDEXED: 0, SKIPPED: 0, FAILED: 0}
+        for row in rows:
+            batch[index_file(db, storage, row)] += 1
+        db.commit()
+        for result, count in batch.items():
+            counts[result] += count
+        logger.info(
+            "indexed %d files (%d skipped, %d failed)",
+            batch[INDEXED],
+            batch[SKIPPED],
+            batch[FAILED],
+        )
+
+        # the search results of these users changed, their cached listings are stale
+        for owner_id in {row.owner_id for row in rows}:
+            try:
+                bump_data_version(owner_id)
+            except Exception as e:
+                logger.warning("failed to bump the data version of %s: %s", owner_id, e)
+
+
+def backfill(db: Session, batch_size: int) -> int:
+    """
+    queues the files uploaded before the indexer existed, walking file by id
+    """
+    queued = 0
+    last_id = None
+    while True:
+        query = (
+            select(models.File.id, models.File.owner_id)
+            .where(
+                indexable(),
+                ~exists().where(models.FileContent.file_id == models.File.id),
+            )
+            .order_by(models.File.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            query = query.where(models.File.id > last_id)
+        rows = db.execute(query).all()
+        if not rows:
+            db.rollback()
+            return queued
+
+        db.execute(
+            pg_insert(models.FileContent)
+            .values(
+                [
+                    {"file_id": row.id, "owner_id": row.owner_id, "status": PENDING}
+                    for row in rows
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+        db.commit()
+        queued += len(rows)
+        last_id = rows[-1].id
+        logger.info("queued %d files for indexing", queued)
+
+
+def retry_failed(db: Session) -> int:
+    result = db.execute(
+        update(models.FileContent)
+        .where(models.FileContent.status == FAILED)
+        .values(status=PENDING, created_at=models._utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="one pass, then exit")
+    parser.add_argument("--batch", type=int, default=settings.fulltext_batch_size)
+    parser.add_argument(
+        "--interval", type=int, default=settings.fulltext_interval_seconds
+    )
+    parser.add_argument(
+        "--backfill", action="store_true", help="queue the existing files first"
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="queue the failed files again"
+    )
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.backfill:
+            logger.info("backfill done: %d files queued", backfill(db, args.batch))
+        if args.retry_failed:
+            logger.info("%d failed files queued again", retry_failed(db))
+
+    while True:
+        try:
+            with SessionLocal() as db:
+                counts = index_pending(db, args.batch)
+            if any(counts.values()):
+                logger.info(
+                    "indexing done: %d indexed, %d skipped, %d failed",
+                    counts[INDEXED],
+                    counts[SKIPPED],
+                    counts[FAILED],
+                )
+        except Exception as e:
+            logger.error("indexing failed: %s", e)
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
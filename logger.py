@@ -1,12 +1,199 @@
+import atexit
+import contextvars
+import json
 import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-LOG_FILE = "app.log"
+from config import get_settings
+from metrics import register_collector
 
-logging.basicConfig(
-    level=logging.INFO,
-    format=LOG_FORMAT,
-    handlers=[logging.FileHandler(LOG_FILE), logging.StreamHandler()],
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s [%(request_id)s]: %(message)s"
+
+_settings = get_settings()
+
+LOG_FILE = _settings.log_file
+LOG_LEVEL = _settings.log_level.upper()
+LOG_JSON = _settings.log_json
+LOG_MAX_BYTES = _settings.log_max_bytes
+LOG_BACKUP_COUNT = _settings.log_backup_count
+LOG_QUEUE_SIZE = _settings.log_queue_size
+
+# e.g. LOG_SAMPLE_RATES="routers.user=0.1,dependecies=0.5"
+LOG_SAMPLE_RATES = _settings.log_sample_rates
+
+# request id of the request currently being served (set by the middleware in main.py)
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "request_id", default="-"
 )
 
+# attributes every LogRecord has, anything else was passed through `extra=`
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+    "request_id",
+}
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    stamp the current request id on the record.
+    runs in the calling thread (before the record is queued) so the contextvar is still visible.
+    """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    keep only a fraction of the INFO/DEBUG records for the configured loggers.
+    WARNING and above always pass so errors are never dropped.
+    """
+
+    def __init__(self, rates: dict[str, float] | None = None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def rate_for(self, name: str) -> float:
+        # the most specific configured logger wins ("routers.user" before "routers")
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        log = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and key not in log:
+                log[key] = value
+        if record.exc_info:
+            log["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log["exc_info"] = record.exc_text
+        return json.dumps(log, default=str)
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """
+    QueueHandler.prepare() formats the message in the calling thread; we only merge the
+    args into the message (cheap) and leave the formatting/serialisation to the writer thread.
+    """
+
+    dropped = 0
+
+    def enqueue(self, record):
+        # never block the caller: if the writer thread falls behind, drop and count
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class _Listener(QueueListener):
+    """
+    QueueListener.stop() blows up when the thread isn't running; remember it ourselves
+    instead of peeking at its private _thread.
+    """
+
+    running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+def parse_sample_rates(raw: str) -> dict[str, float]:
+    rates = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def _build_handlers() -> list[logging.Handler]:
+    formatter = JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+    file_handler = RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    return [file_handler, stream_handler]
+
+
+def setup_logging() -> QueueListener:
+    """
+    root logger -> QueueHandler (non-blocking put) -> background thread -> file/stream handlers.
+    no disk write ever happens on the event loop.
+    """
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+    queue_handler = _PreparedQueueHandler(log_queue)
+    # sample first, so dropped records don't even get stamped
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [queue_handler]
+
+    listener = _Listener(log_queue, *_build_handlers(), respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    # records lost because the writer thread fell behind, per worker
+    register_collector(
+        "logging",
+        lambda: {"dropped": queue_handler.dropped, "queued": log_queue.qsize()},
+    )
+    return listener
+
+
+def _stop_listener(listener: _Listener):
+    # flush whatever is still queued; safe to call twice (atexit + explicit shutdown)
+    listener.stop()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+listener = setup_logging()
+
 logger = logging.getLogger(__name__)
@@ -1,33 +1,113 @@
-from dotenv import load_dotenv
-
-import os
-import redis
-from fastapi import FastAPI, Depends
+import asyncio
+import time
+import uuid
+from fastapi import FastAPI, Depends, Request
 from routers.auth import router as auth_router  # import router from the auth file
-from routers.user import router as files_router
-from database import SessionLocal
-from models import Dummy, Base
+from routers.user import (
+    router as files_router,
+    listing_etag_middleware,
+    start_invalidation_listener,
+    stop_invalidation_listener,
+)
+from routers.folders import router as folders_router
+from routers.shares import router as shares_router
+from routers.storage import router as storage_router
+from routers.admin import router as admin_router
+from config import get_settings
+from database import SessionLocal, create_schema
+from dependecies import get_redis_client
+from models import Dummy
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
-from logger import logger
+from logger import logger, get_logger, request_id_var
+from timing import log_fields, server_timing, spans_var, start_spans
+from metrics import collect, register_collector
+from expiry import read_stats as expiry_stats
+from ratelimit import rate_limit_middleware
+from admission import UploadAdmissionMiddleware
+from profiling import RequestProfilerMiddleware
 
-from database import engine
+settings = get_settings()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    Base.metadata.create_all(bind=engine)
+    # schema is owned by alembic / `python database.py`; only opt-in for local dev
+    if settings.create_schema_on_startup:
+        await asyncio.to_thread(create_schema)
+    # the per worker listing cache only runs while it can hear invalidations
+    await asyncio.to_thread(start_invalidation_listener)
     yield
+    stop_invalidation_listener()
 
 
 app = FastAPI(lifespan=lifespan)
 
+# written by the expiry.py sweepers, one Redis GET per scrape
+register_collector("expiry", expiry_stats)
+
+
+access_logger = get_logger("access")
+
+# innermost: sees the upload body while it streams, after the rate limit let it in
+app.add_middleware(UploadAdmissionMiddleware)
+
+# a conditional listing request is still rate limited and logged
+app.middleware("http")(listing_etag_middleware)
+
+# added before request_context, so it runs inside it (429s get a request id and an access log)
+app.middleware("http")(rate_limit_middleware)
+
+# not even in the stack unless profiling is configured
+if settings.profiling_sample_rate > 0 or settings.profiling_secret:
+    app.add_middleware(RequestProfilerMiddleware)
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    # reuse the caller's id (load balancer / client) so logs can be joined across services
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    # db / cache / storage / auth time of this request (timing.py)
+    spans, spans_token = start_spans()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+        response.headers["X-Request-ID"] = request_id
+        response.headers["Server-Timing"] = server_timing(spans, duration_ms)
+        access_logger.info(
+            "%s %s %s",
+            request.method,
+            request.url.path,
+            response.status_code,
+            extra={
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration_ms": round(duration_ms, 3),
+                **log_fields(spans),
+            },
+        )
+        return response
+    finally:
+        spans_var.reset(spans_token)
+        request_id_var.reset(token)
+
 
 app.include_router(auth_router)
 
 app.include_router(files_router)
 
+app.include_router(folders_router)
+
+app.include_router(shares_router)
+
+app.include_router(storage_router)
+
+app.include_router(admin_router)
+
 
 class Item(BaseModel):
     name: str
@@ -41,16 +121,13 @@ def get_db():
         db.close()
 
 
-load_dotenv()
-
-REDIS_HOST_NAME = os.getenv("REDIS_HOST_NAME")
-REDIS_PORT = os.getenv("REDIS_PORT")
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
-
-
 @app.get("/check-redis")
 async def check_redis():
-    if not REDIS_HOST_NAME or not REDIS_PORT or not REDIS_PASSWORD:
+    if (
+        not settings.redis_host_name
+        or not settings.redis_port
+        or not settings.redis_password
+    ):
         logger.error(
             "REDIS_USER, REDIS_PORT, or REDIS_PASSWORD environment variable is missing."
         )
@@ -58,21 +135,26 @@ async def check_redis():
             "error": "REDIS_USER, REDIS_PORT, or REDIS_PASSWORD environment variable is missing."
         }
     try:
-        redis_client = redis.Redis(
-            host=REDIS_HOST_NAME,
-            port=int(REDIS_PORT),
-            password=REDIS_PASSWORD,
-            decode_responses=True,
-        )
+        redis_client = get_redis_client()
         redis_client.set("test-value", "checked passed")
         checked_status = redis_client.get("test-value")
+        if isinstance(checked_status, bytes):
+            checked_status = checked_status.decode("utf-8")
         logger.info("Redis connection and set/get test passed.")
         return {"status": checked_status if checked_status else None}
     except Exception as e:
-        logger.error(f"Redis checked failed: {str(e)}")
+        logger.error("Redis checked failed: %s", e)
         return {"error": f"redis checked failed, {str(e)}"}
 
 
+@app.get("/metrics")
+def metrics():
+    # in-process snapshot of this worker (db pools, ...), see metrics.register_collector.
+    # plain def: some collectors block (the expiry stats are a Redis GET), FastAPI runs
+    # this in its thread pool
+    return collect()
+
+
 @app.post("/{name}")
 async def home(name: str, db: Session = Depends(get_db)):
     db_items = Dummy(name=name)
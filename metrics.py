@@ -0,0 +1,23 @@
+from typing import Callable
+
+# name -> function returning a JSON-able snapshot, served by GET /metrics in main.py
+_collectors: dict[str, Callable[[], dict]] = {}
+
+
+def register_collector(name: str, collector: Callable[[], dict]):
+    """
+    register a snapshot function under `name`. registering the same name again replaces it.
+    collectors are called on every scrape, keep them cheap. GET /metrics runs them in a
+    worker thread, a short blocking read (one Redis GET) is fine.
+    """
+    _collectors[name] = collector
+
+
+def collect() -> dict:
+    snapshot = {}
+    for name, collector in _collectors.items():
+        try:
+            snapshot[name] = collector()
+        except Exception as e:
+            snapshot[name] = {"error": str(e)}
+    return snapshot
@@ -1,14 +1,33 @@
 from datetime import datetime, timezone
 from typing import List
-from sqlalchemy import Column, ForeignKey, Integer, String, BigInteger
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    String,
+    Text,
+    UniqueConstraint,
+    event,
+    text,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from sqlalchemy.orm import declarative_base
 import uuid
 
 Base = declarative_base()
 
 
+def _utcnow():
+    # naive UTC, the timestamp columns are "timestamp without time zone"
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Dummy(Base):
     __tablename__ = "dummy"
 
@@ -23,34 +42,251 @@ class User(Base):
     username = Column(String, index=True, unique=True)
     hashed_password = Column(String)
     email = Column(String, unique=True, index=True)
+    # account deleted: can't log in any more, purged with its files after the retention
+    # window (until then the username and email stay taken)
+    deleted_at = Column(DateTime, nullable=True)
+    # last sequence number of the user's change log (FileChange.seq), and the highest
+    # one compacted away: a client behind change_floor has to list everything again
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+    change_floor = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index(
+            "ix_user_deleted_at",
+            "deleted_at",
+            postgresql_where=text("deleted_at IS NOT NULL"),
+        ),
+    )
 
     files: Mapped[List["File"]] = relationship(
         "File", back_populates="owner", cascade="all, delete-orphan"
     )
+    folders: Mapped[List["Folder"]] = relationship(
+        "Folder", back_populates="owner", cascade="all, delete-orphan"
+    )
+
+
+class Folder(Base):
+    """
+    materialised path: "/" is the root (implicit, no row), "/docs/" and
+    "/docs/2024/" are folders. a subtree is every path starting with its
+    path, so list/count/move/delete of a subtree is one prefix range scan on
+    (owner_id, path). text_pattern_ops makes LIKE 'prefix%' use the index
+    whatever the database collation.
+    """
+
+    __tablename__ = "folder"
+
+    __table_args__ = (
+        Index(
+            "ix_folder_owner_path",
+            "owner_id",
+            "path",
+            unique=True,
+            postgresql_ops={"path": "text_pattern_ops"},
+        ),
+    )
+
+    id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    path: Mapped[str] = mapped_column(String, nullable=False)
+    # number of segments, "/docs/" is 1; lets "direct children" stay a range scan
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(default=_utcnow)
+
+    owner_id: Mapped["User"] = mapped_column(ForeignKey("user.id"), nullable=False)
+
+    owner: Mapped["User"] = relationship("User", back_populates="folders")
+
+
+# predicates of the partial indexes on file
+LIVE = text("deleted_at IS NULL")
+TOMBSTONE = text("deleted_at IS NOT NULL")
+
+# hash partitions of file (file_p0 ...), fixed by the migration that created them
+FILE_PARTITIONS = 16
 
 
 class File(Base):
     __tablename__ = "file"
 
+    # hash partitioned on owner_id: an owner scoped query only touches the partition of
+    # its owner, and vacuum / index maintenance work on 1/FILE_PARTITIONS of the rows.
+    # every unique constraint has to include owner_id, so the primary key is
+    # (id, owner_id), id first so a lookup by id alone still probes each partition's
+    # index instead of scanning it.
+    # every query is owner scoped, so every index leads with owner_id.
+    # listing/cascade delete and date ranges walk the first one, size ranges the
+    # second, the exact filters the others.
+    # they only cover live rows (deleted_at IS NULL, which every live query has), the
+    # tombstones have their own small indexes for the trash and the purge.
+    __table_args__ = (
+        Index(
+            "ix_file_owner_uploaded_at_id",
+            "owner_id",
+            "uploaded_at",
+            "id",
+            postgresql_where=LIVE,
+        ),
+        Index("ix_file_owner_size_id", "owner_id", "size", "id", postgresql_where=LIVE),
+        Index(
+            "ix_file_owner_file_extension",
+            "owner_id",
+            "file_extension",
+            postgresql_where=LIVE,
+        ),
+        Index(
+            "ix_file_owner_content_type",
+            "owner_id",
+            "content_type",
+            postgresql_where=LIVE,
+        ),
+        Index(
+            "ix_file_owner_folder_path",
+            "owner_id",
+            "folder_path",
+            postgresql_ops={"folder_path": "text_pattern_ops"},
+            postgresql_where=LIVE,
+        ),
+        Index(
+            "ix_file_owner_deleted_at",
+            "owner_id",
+            "deleted_at",
+            postgresql_where=TOMBSTONE,
+        ),
+        Index("ix_file_deleted_at", "deleted_at", postgresql_where=TOMBSTONE),
+        # candidates of tiering.py: idle files in the standard tier, accessed files in
+        # the infrequent one
+        Index(
+            "ix_file_standard_last_access",
+            text("coalesce(last_accessed_at, uploaded_at)"),
+            postgresql_where=text("deleted_at IS NULL AND storage_tier = 'standard'"),
+        ),
+        Index(
+            "ix_file_infrequent_access_count",
+            "access_count",
+            postgresql_where=text("deleted_at IS NULL AND storage_tier = 'infrequent'"),
+        ),
+        # the expiring files, for expiry.py (most files never expire)
+        Index(
+            "ix_file_expires_at",
+            "expires_at",
+            postgresql_where=text("deleted_at IS NULL AND expires_at IS NOT NULL"),
+        ),
+        # storage_path starts with the owner id, unique per owner is unique
+        UniqueConstraint("storage_path", "owner_id", name="file_storage_path_key"),
+        {"postgresql_partition_by": "HASH (owner_id)"},
+    )
+
     id: Mapped[UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
     )
     filename: Mapped[str] = mapped_column(String, index=True)
-    uploaded_at: Mapped[datetime] = mapped_column(
-        default=datetime.now(timezone.utc), index=True
+    # callables, so the timestamp is taken per row and not once at import
+    uploaded_at: Mapped[datetime] = mapped_column(default=_utcnow, index=True)
+    updated_at: Mapped[datetime] = mapped_column(default=_utcnow, onupdate=_utcnow)
+    storage_path: Mapped[str] = mapped_column(String)
+    size: Mapped[int] = mapped_column(BigInteger)
+    # derived from storage_path, which is already unique
+    s3_url: Mapped[str] = mapped_column(String)
+    content_type: Mapped[str] = mapped_column(String)
+    file_extension: Mapped[str] = mapped_column(String, default=None)
+    # path of the containing Folder ("/" = root), copied here so a subtree's
+    # files are found without joining folder
+    folder_path: Mapped[str] = mapped_column(String, default="/", server_default="/")
+    # set when the file is deleted (it goes to the trash); the row and the stored object
+    # are purged by purge.py after the retention window
+    deleted_at: Mapped[datetime | None] = mapped_column(default=None, nullable=True)
+    # temporary files: expiry.py deletes the row and the stored object once this has
+    # passed (not through the trash, an expired file cannot be restored)
+    expires_at: Mapped[datetime | None] = mapped_column(default=None, nullable=True)
+    # counted in Redis (access.py) and added here in batches. accesses since the file
+    # last changed storage tier, tiering.py resets it
+    access_count: Mapped[int] = mapped_column(
+        BigInteger, default=0, server_default="0"
     )
-    updated_at: Mapped[datetime] = mapped_column(
-        default=datetime.now(timezone.utc),
-        onupdate=datetime.now(timezone.utc),
-        index=True,
+    last_accessed_at: Mapped[datetime | None] = mapped_column(
+        default=None, nullable=True
+    )
+    # storage.STANDARD / storage.INFREQUENT
+    storage_tier: Mapped[str] = mapped_column(
+        String, default="standard", server_default="standard"
     )
-    storage_path: Mapped[str] = mapped_column(String, unique=True)
-    size: Mapped[int] = mapped_column(BigInteger)
-    s3_url: Mapped[str] = mapped_column(String, unique=True, index=True)
-    content_type: Mapped[str] = mapped_column(String, index=True)
-    file_extension: Mapped[str] = mapped_column(String, index=True, default=None)
 
-    owner_id: Mapped["User"] = mapped_column(ForeignKey("user.id"), nullable=False)
+    owner_id: Mapped["User"] = mapped_column(ForeignKey("user.id"), primary_key=True)
 
     # NOTE: this is just used for the back_populate. main thing is the ForeignKey attribute
     owner: Mapped["User"] = relationship("User", back_populates="files")
+
+
+# the partitions, for create_all (the migrations create them on existing databases)
+for _remainder in range(FILE_PARTITIONS):
+    event.listen(
+        File.__table__,
+        "after_create",
+        DDL(
+            f"CREATE TABLE file_p{_remainder} PARTITION OF file "
+            f"FOR VALUES WITH (MODULUS {FILE_PARTITIONS}, REMAINDER {_remainder})"
+        ),
+    )
+
+
+class FileChange(Base):
+    """
+    per user change log of the files, read by GET /user/files/changes. seq comes from
+    User.change_seq, bumped in the transaction that changes the files: the user row
+    stays locked until the commit, so a user's entries commit in seq order and a
+    cursor never skips one.
+    """
+
+    __tablename__ = "file_change"
+
+    owner_id: Mapped[UUID] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    seq: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # no foreign key, the entry outlives the purged file
+    file_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    # insert / update / delete
+    op: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(default=_utcnow, index=True)
+
+
+class FileContent(Base):
+    """
+    extracted text of a text-like file (fulltext.py), one row per indexed file. apart
+    from file so the listings don't read it. the row is added with the file as
+    "pending" and filled in by indexer.py.
+    """
+
+    __tablename__ = "file_content"
+
+    __table_args__ = (
+        # owner_id is part of file's key (it is partitioned on it)
+        ForeignKeyConstraint(
+            ["file_id", "owner_id"],
+            ["file.id", "file.owner_id"],
+            ondelete="CASCADE",
+            name="file_content_file_fkey",
+        ),
+        Index("ix_file_content_search", "search_vector", postgresql_using="gin"),
+        # the queue of indexer.py
+        Index(
+            "ix_file_content_pending",
+            "created_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+
+    file_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    owner_id: Mapped[UUID] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+    )
+    # fulltext.PENDING / INDEXED / SKIPPED / FAILED
+    status: Mapped[str] = mapped_column(String, nullable=False, default="pending")
+    # the start of the text (FULLTEXT_MAX_BYTES), for the search snippets
+    document: Mapped[str | None] = mapped_column(Text, nullable=True)
+    search_vector: Mapped[str | None] = mapped_column(TSVECTOR, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=_utcnow)
+    indexed_at: Mapped[datetime | None] = mapped_column(default=None, nullable=True)
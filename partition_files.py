@@ -0,0 +1,164 @@
+"""
+online copy of file into its hash partitioned shadow (file_partitioned, created by the
+migration f3a7c9e1d5b8), while the app keeps running: a trigger on file mirrors every
+write, this copies the rows that were there before.
+
+    python partition_files.py backfill [--batch N] [--pause SECONDS]
+    python partition_files.py verify [--batch N]
+
+backfill walks file in id order, a batch per transaction, and records its position in
+file_partition_progress, so it resumes where it stopped. verify compares the two tables
+batch by batch, keys and row contents, and when they hold the same rows marks them
+verified, which the swap migration (a8d4e2f6b1c9) requires.
+"""
+
+import argparse
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from logger import get_logger
+
+logger = get_logger("partition_files")
+
+DEFAULT_BATCH = 5000
+
+# FOR KEY SHARE: a file deleted while its batch is copied waits for the copy (and its
+# trigger then deletes the copy), updates go through and the trigger upserts the new
+# version, which the copy (ON CONFLICT DO NOTHING) never overwrites
+COPY_BATCH = """
+WITH batch AS (
+    SELECT * FROM file
+    WHERE :last_id IS NULL OR id > :last_id
+    ORDER BY id
+    LIMIT :batch
+    FOR KEY SHARE
+), copied AS (
+    INSERT INTO file_partitioned SELECT * FROM batch ON CONFLICT DO NOTHING
+)
+SELECT (SELECT count(*) FROM batch) AS rows,
+       (SELECT id FROM batch ORDER BY id DESC LIMIT 1) AS last_id
+"""
+
+SAVE_PROGRESS = """
+UPDATE file_partition_progress
+SET last_id = :last_id, copied = copied + :rows, verified_at = NULL
+WHERE id = 1
+"""
+
+# rows of `source` (a batch in id order) missing in `target`, and the ones whose
+# contents differ there (same columns in the same order: a whole-row md5 per row)
+COMPARE_BATCH = """
+WITH batch AS (
+    SELECT id, owner_id, md5(s::text) AS digest FROM {source} AS s
+    WHERE :last_id IS NULL OR id > :last_id
+    ORDER BY id
+    LIMIT :batch
+)
+SELECT count(*) AS rows,
+       count(*) FILTER (WHERE t.id IS NULL) AS missing,
+       count(*) FILTER (WHERE md5(t::text) <> batch.digest) AS changed,
+       (SELECT id FROM batch ORDER BY id DESC LIMIT 1) AS last_id
+FROM batch
+LEFT JOIN {target} AS t ON t.id = batch.id AND t.owner_id = batch.owner_id
+"""
+
+
+def backfill(db: Session, batch_size: int, pause: float) -> int:
+    last_id, copied = db.execute(
+        text("SELECT last_id, copied FROM file_partition_progress WHERE id = 1")
+    ).one()
+    if last_id is not None:
+        logger.info("resuming after %s (%d rows copied)", last_id, copied)
+
+    while True:
+        batch = db.execute(
+            text(COPY_BATCH), {"last_id": last_id, "batch": batch_size}
+        ).one()
+        if not batch.rows:
+            db.commit()
+            return copied
+        last_id = batch.last_id
+        db.execute(text(SAVE_PROGRESS), {"last_id": last_id, "rows": batch.rows})
+        db.commit()
+        copied += batch.rows
+        logger.info("copied %d rows, up to %s", copied, last_id)
+        if pause:
+            # leave room for the app's writes and for vacuum / replication to keep up
+            time.sleep(pause)
+
+
+def compare(db: Session, source: str, target: str, batch_size: int):
+    """
+    (rows of source, missing in target, different in target)
+    """
+    rows = missing = changed = 0
+    last_id = None
+    stmt = text(COMPARE_BATCH.format(source=source, target=target))
+    while True:
+        batch = db.execute(stmt, {"last_id": last_id, "batch": batch_size}).one()
+        # each batch is its own snapshot, a long verify holds back no vacuum
+        db.commit()
+        if not batch.rows:
+            return rows, missing, changed
+        rows += batch.rows
+        missing += batch.missing
+        changed += batch.changed
+        last_id = batch.last_id
+
+
+def verify(db: Session, batch_size: int) -> bool:
+    """
+    both tables must hold the same rows with the same contents. a batch is compared
+    in one snapshot and the trigger writes in the writer's transaction, so a write
+    racing the verify does not show up. what does: writes made without the trigger
+    (dropped or disabled, session_replication_role = replica), a trigger that misses
+    a column, rows changed by hand in file_partitioned
+    """
+    rows, missing, changed = compare(db, "file", "file_partitioned", batch_size)
+    # the rows both have were compared above
+    shadow_rows, extra, _ = compare(db, "file_partitioned", "file", batch_size)
+    logger.info(
+        "file: %d rows, %d missing in file_partitioned, %d different there. "
+        "file_partitioned: %d rows, %d not in file",
+        rows,
+        missing,
+        changed,
+        shadow_rows,
+        extra,
+    )
+    if missing or changed or extra:
+        return False
+    db.execute(
+        text(
+            "UPDATE file_partition_progress "
+            "SET verified_at = now() AT TIME ZONE 'utc' WHERE id = 1"
+        )
+    )
+    db.commit()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["backfill", "verify"])
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="seconds to sleep between batches"
+    )
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "backfill":
+            copied = backfill(db, args.batch, args.pause)
+            logger.info("backfill done: %d rows copied, run verify next", copied)
+            return
+        if not verify(db, args.batch):
+            logger.error("the tables differ, run backfill again, then verify")
+            sys.exit(1)
+        logger.info("verified, the swap migration can run")
+
+
+if __name__ == "__main__":
+    main()
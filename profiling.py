@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+from config import get_settings
+from dependecies import get_redis_client
+from logger import get_logger, request_id_var
+from metrics import register_collector
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+PROFILE_HEADER = b"x-debug-profile"
+ADMIN_PREFIX = "/admin/"
+# newest first, the summaries of the stored profiles
+PROFILE_INDEX_KEY = "profiles"
+# stacks kept per profile, the most sampled ones
+MAX_STACKS = 500
+# allocation sites kept per profile, the largest ones
+MAX_ALLOCATIONS = 50
+
+# innermost frames of a thread that is waiting for work, not worth a sample
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+
+def profile_key(profile_id: str) -> str:
+    return f"profile:{profile_id}"
+
+
+def header_signature(expires_at: int) -> str:
+    return hmac.new(
+        (settings.profiling_secret or "").encode(),
+        str(expires_at).encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def debug_header(ttl: int) -> str:
+    """
+    value of X-Debug-Profile that profiles every request carrying it for `ttl` seconds
+    """
+    expires_at = int(time.time()) + ttl
+    return f"{expires_at}:{header_signature(expires_at)}"
+
+
+def valid_debug_header(value: str) -> bool:
+    if not settings.profiling_secret:
+        return False
+    expires_at, _, signature = value.partition(":")
+    try:
+        expires_at = int(expires_at)
+    except ValueError:
+        return False
+    return expires_at >= time.time() and hmac.compare_digest(
+        header_signature(expires_at), signature
+    )
+
+
+class StackSampler:
+    """
+    wall clock sampler: a thread reads the stacks of the other threads every
+    `interval` seconds and counts them in folded form ("root;...;leaf"). it sees the
+    whole worker, the event loop and the threadpool, so requests running next to the
+    profiled one show up too.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: dict[str, int] = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="request-profiler", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                folded = ";".join(reversed(stack))
+                self.stacks[folded] = self.stacks.get(folded, 0) + 1
+            self.samples += 1
+
+
+class RequestProfilerMiddleware:
+    """
+    profiles a sampled fraction of the requests (PROFILING_SAMPLE_RATE) and every one
+    with a valid X-Debug-Profile header: stack samples plus a tracemalloc snapshot,
+    stored in a bounded Redis ring read by GET /admin/profiles.
+
+    main.py only adds it when profiling is configured, otherwise it costs nothing.
+    one profile at a time per worker: tracemalloc is process wide, and the sampler
+    sees the whole worker anyway.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.busy = threading.Lock()
+        self.counters = {"profiled": 0, "busy": 0, "bad_header": 0, "store_errors": 0}
+        register_collector("profiling", lambda: dict(self.counters))
+
+    def wanted(self, scope) -> bool:
+        header = dict(scope["headers"]).get(PROFILE_HEADER)
+        if header is not None:
+            if valid_debug_header(header.decode("latin-1")):
+                return True
+            self.counters["bad_header"] += 1
+        return random.random() < settings.profiling_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"].startswith(ADMIN_PREFIX)
+            or not self.wanted(scope)
+        ):
+            return await self.app(scope, receive, send)
+        if not self.busy.acquire(blocking=False):
+            self.counters["busy"] += 1
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex
+        status = None
+
+        async def profiled_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-id", profile_id.encode()),
+                ]
+            await send(message)
+
+        sampler = StackSampler(settings.profiling_interval_ms / 1000)
+        tracemalloc.start(settings.profiling_tracemalloc_frames)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            duration = time.perf_counter() - start
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.busy.release()
+            self.counters["profiled"] += 1
+
+            profile = {
+                "id": profile_id,
+                "request_id": request_id_var.get(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "at": datetime.now(timezone.utc).isoformat(),
+                "duration_ms": round(duration * 1000, 3),
+                "interval_ms": settings.profiling_interval_ms,
+                "samples": sampler.samples,
+                "stacks": dict(
+                    sorted(sampler.stacks.items(), key=lambda kv: -kv[1])[:MAX_STACKS]
+                ),
+                "peak_traced_bytes": peak,
+                "allocations": [
+                    {
+                        "size": stat.size,
+                        "count": stat.count,
+                        "traceback": [
+                            f"{frame.filename}:{frame.lineno}"
+                            for frame in stat.traceback
+                        ],
+                    }
+                    for stat in snapshot.statistics("traceback")[:MAX_ALLOCATIONS]
+                ],
+            }
+            try:
+                await asyncio.to_thread(store_profile, profile)
+            except Exception as e:
+                self.counters["store_errors"] += 1
+                logger.error("failed to store profile %s: %s", profile_id, e)
+
+
+def summary(profile: dict) -> dict:
+    return {
+        key: profile[key]
+        for key in (
+            "id",
+            "request_id",
+            "method",
+            "path",
+            "status",
+            "at",
+            "duration_ms",
+            "samples",
+            "peak_traced_bytes",
+        )
+    }
+
+
+def store_profile(profile: dict):
+    """
+    the full profile under its own key (expires), its summary at the head of the
+    index, which is trimmed to PROFILING_RING_SIZE
+    """
+    pipe = get_redis_client().pipeline(transaction=True)
+    pipe.set(
+        profile_key(profile["id"]),
+        json.dumps(profile),
+        ex=settings.profiling_retention_seconds,
+    )
+    pipe.lpush(PROFILE_INDEX_KEY, json.dumps(summary(profile)))
+    pipe.ltrim(PROFILE_INDEX_KEY, 0, settings.profiling_ring_size - 1)
+    pipe.execute()
+
+
+def list_profiles() -> list[dict]:
+    return [
+        json.loads(entry)
+        for entry in get_redis_client().lrange(PROFILE_INDEX_KEY, 0, -1)
+    ]
+
+
+def get_profile(profile_id: str) -> dict | None:
+    data = get_redis_client().get(profile_key(profile_id))
+    return json.loads(data) if data else None
+
+
+def folded(profile: dict) -> str:
+    """
+    collapsed stacks, the input of flamegraph.pl / speedscope
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
@@ -0,0 +1,130 @@
+"""
+garbage collector for the trash: files deleted more than TRASH_RETENTION_SECONDS ago
+lose their stored object and their row, deleted accounts their folders and user row
+once none of their files is left. also compacts the file change log
+(CHANGE_LOG_RETENTION_SECONDS).
+
+    python purge.py [--once] [--retention SECONDS] [--batch N] [--interval SECONDS]
+
+several instances can run at once, each batch is claimed with FOR UPDATE SKIP LOCKED.
+"""
+
+import argparse
+import time
+from datetime import timedelta
+from sqlalchemy import delete, exists, select
+from sqlalchemy.orm import Session
+from changes import compact_changes
+from config import get_settings
+from database import SessionLocal
+from logger import get_logger
+import models
+from routers.user import any_id
+from storage import get_storage
+
+logger = get_logger("purge")
+
+settings = get_settings()
+
+
+def purge_files(db: Session, cutoff, batch_size: int) -> int:
+    """
+    objects first, then rows: a row whose object could not be deleted stays in the
+    trash and is retried on the next run
+    """
+    purged = 0
+    while True:
+        rows = db.execute(
+            select(models.File.id, models.File.owner_id, models.File.storage_path)
+            .where(models.File.deleted_at < cutoff)
+            .order_by(models.File.deleted_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            db.rollback()
+            return purged
+
+        failed = get_storage().delete_many(row.storage_path for row in rows)
+        done = [row for row in rows if row.storage_path not in failed]
+        if done:
+            db.execute(
+                delete(models.File)
+                .where(
+                    # the owners prune the partitions of file to theirs
+                    models.File.owner_id == any_id({row.owner_id for row in done}),
+                    models.File.id == any_id([row.id for row in done]),
+                )
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        purged += len(done)
+        logger.info("purged %d files (%d failed)", len(done), len(failed))
+
+        if failed and not done:
+            # storage is failing, stop instead of spinning on the same rows
+            return purged
+
+
+def purge_users(db: Session, cutoff, batch_size: int) -> int:
+    user_ids = db.scalars(
+        select(models.User.id)
+        .where(
+            models.User.deleted_at < cutoff,
+            ~exists().where(models.File.owner_id == models.User.id),
+        )
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if user_ids:
+        db.execute(
+            delete(models.Folder)
+            .where(models.Folder.owner_id == any_id(user_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            delete(models.User)
+            .where(models.User.id == any_id(user_ids))
+            .execution_options(synchronize_session=False)
+        )
+        logger.info("purged %d deleted accounts", len(user_ids))
+    db.commit()
+    return len(user_ids)
+
+
+def run(retention: int, batch_size: int):
+    now = models._utcnow()
+    cutoff = now - timedelta(seconds=retention)
+    with SessionLocal() as db:
+        files = purge_files(db, cutoff, batch_size)
+        users = purge_users(db, cutoff, batch_size)
+        compact_changes(
+            db, now - timedelta(seconds=settings.change_log_retention_seconds), batch_size
+        )
+    return files, users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="one pass, then exit")
+    parser.add_argument("--retention", type=int, default=settings.trash_retention_seconds)
+    parser.add_argument("--batch", type=int, default=settings.purge_batch_size)
+    parser.add_argument("--interval", type=int, default=settings.purge_interval_seconds)
+    args = parser.parse_args()
+
+    while True:
+        try:
+            files, users = run(args.retention, args.batch)
+            if files or users:
+                logger.info("purge done: %d files, %d accounts", files, users)
+        except Exception as e:
+            logger.error("purge failed: %s", e)
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
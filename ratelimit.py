@@ -0,0 +1,202 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import jwt
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from config import get_settings
+from dependecies import get_redis_client
+from logger import get_logger
+from metrics import register_collector
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+# refill the bucket for the time elapsed since the last call, then try to take `cost`.
+# uses the Redis clock, so workers with skewed clocks share one consistent bucket.
+# returns {allowed (0/1), retry after ms, tokens left}
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+-- a full bucket is the same as no bucket, let it expire
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1000)
+return {allowed, retry_after, math.floor(tokens)}
+"""
+
+# after a Redis error, use the local buckets for this long before trying Redis again
+REDIS_RETRY_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    name: str
+    # "ip" or "user" (the user id from the access token cookie, ip when there is none)
+    scope: str
+    capacity: int
+    period: int
+
+    @property
+    def rate_per_ms(self) -> float:
+        return self.capacity / (self.period * 1000)
+
+
+def parse_limit(name: str, scope: str, limit: str) -> RateLimitRule:
+    """
+    "10/60" -> 10 requests per 60 seconds (burst of 10, refilled evenly)
+    """
+    count, period = limit.split("/")
+    return RateLimitRule(name=name, scope=scope, capacity=int(count), period=int(period))
+
+
+RULES: dict[tuple[str, str], RateLimitRule] = {
+    ("POST", "/auth/login"): parse_limit("login", "ip", settings.rate_limit_login),
+    ("POST", "/auth/register"): parse_limit(
+        "register", "ip", settings.rate_limit_register
+    ),
+    ("POST", "/user/upload"): parse_limit("upload", "user", settings.rate_limit_upload),
+    ("GET", "/user/files"): parse_limit("files", "user", settings.rate_limit_files),
+}
+
+
+class LocalTokenBuckets:
+    """
+    per worker fallback while Redis is unreachable. the limits become per worker
+    instead of global, which is still far better than no limit at all.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key: str, rule: RateLimitRule, cost: int = 1):
+        now = time.monotonic() * 1000
+        with self.lock:
+            tokens, ts = self.buckets.pop(key, (rule.capacity, now))
+            tokens = min(rule.capacity, tokens + (now - ts) * rule.rate_per_ms)
+            if tokens >= cost:
+                allowed, retry_after, tokens = 1, 0, tokens - cost
+            else:
+                allowed = 0
+                retry_after = math.ceil((cost - tokens) / rule.rate_per_ms)
+            self.buckets[key] = (tokens, now)
+            # least recently used first
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, retry_after, int(tokens)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.local = LocalTokenBuckets()
+        self.script = None
+        self.redis_down_until = 0.0
+        self.counters = {"allowed": 0, "limited": 0, "local_fallback": 0}
+
+    def take(self, key: str, rule: RateLimitRule, cost: int = 1):
+        if time.monotonic() >= self.redis_down_until:
+            try:
+                if self.script is None:
+                    self.script = get_redis_client().register_script(TOKEN_BUCKET_LUA)
+                # one round trip: EVALSHA (EVAL + retry only the first time per server)
+                allowed, retry_after, remaining = self.script(
+                    keys=[key], args=[rule.capacity, rule.rate_per_ms, cost]
+                )
+                return int(allowed), int(retry_after), int(remaining)
+            except Exception as e:
+                logger.warning("rate limit store unavailable, using local buckets: %s", e)
+                self.redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        self.counters["local_fallback"] += 1
+        return self.local.take(key, rule, cost)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.counters,
+            "redis_available": time.monotonic() >= self.redis_down_until,
+            "local_buckets": len(self.local.buckets),
+        }
+
+
+limiter = RateLimiter()
+
+register_collector("rate_limit", limiter.snapshot)
+
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_forwarded_for:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def identity(request: Request, rule: RateLimitRule) -> str:
+    if rule.scope == "user":
+        token = request.cookies.get("access_token")
+        if token:
+            try:
+                payload = jwt.decode(token, settings.secret_key, settings.algorithm)
+                return f"user:{payload.get('user_id')}"
+            except jwt.InvalidTokenError:
+                # the auth dependency rejects it, still count it against the ip
+                pass
+    return f"ip:{client_ip(request)}"
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    """
+    checked before the route runs, and before FastAPI reads the body: an upload over
+    the limit is rejected without being received.
+    """
+    rule = RULES.get((request.method, request.url.path.rstrip("/") or "/"))
+    if rule is None or not settings.rate_limit_enabled:
+        return await call_next(request)
+
+    key = f"ratelimit:{rule.name}:{identity(request, rule)}"
+    allowed, retry_after_ms, remaining = await run_in_threadpool(
+        limiter.take, key, rule
+    )
+    headers = {
+        "X-RateLimit-Limit": str(rule.capacity),
+        "X-RateLimit-Remaining": str(max(remaining, 0)),
+    }
+    if not allowed:
+        limiter.counters["limited"] += 1
+        headers["Retry-After"] = str(max(1, math.ceil(retry_after_ms / 1000)))
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "too many requests, please slow down"},
+            headers=headers,
+        )
+
+    limiter.counters["allowed"] += 1
+    response = await call_next(request)
+    response.headers.update(headers)
+    return response
@@ -0,0 +1,410 @@
+"""
+storage / database reconciliation: walks the objects (list_objects_v2) and the file
+rows side by side, both in key order, and reports the differences:
+
+- orphaned objects: stored, but no row points at them (an upload whose row failed, a
+  purge that lost its row before its object)
+- dangling rows: a live file whose object is missing (the upload's background write
+  died after the commit)
+
+    python reconcile.py [--prefix P] [--workers N] [--min-age SECONDS] [--repair]
+    python reconcile.py --import-to USER_ID --prefix P [--folder /]
+
+--repair deletes the orphaned objects in bulk and marks the dangling rows (they go to
+the trash already past its retention: not restorable, purge.py removes them).
+--import-to adds a row for every object under the prefix that has none, owned by that
+user, instead of deleting it.
+
+the key space is split into ranges (by the character after the prefix) listed in
+parallel; each range is buffered a few pages ahead and the rows are streamed with a
+server side cursor, so memory does not grow with the bucket.
+"""
+
+import argparse
+import mimetypes
+import os
+import posixpath
+import queue
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from changes import DELETE, INSERT, record_changes
+from config import get_settings
+from database import SessionLocal
+from fulltext import PENDING, extractor
+from logger import get_logger
+import models
+from routers.user import (
+    any_id,
+    delete_redis,
+    like_prefix,
+    normalize_folder_path,
+    trash_cutoff,
+)
+from share_markers import ShareMarkerError, mark_files_deleted
+from storage import S3_DELETE_BATCH_SIZE, ObjectInfo, StorageBackend, get_storage
+
+logger = get_logger("reconcile")
+
+settings = get_settings()
+
+# the ranges split on the character after the prefix; storage keys start with a uuid
+SPLIT_CHARACTERS = "0123456789abcdef"
+# objects per page handed from a lister to the diff, and pages buffered per range
+PAGE_SIZE = 1000
+PAGES_AHEAD = 4
+# differences of each kind logged one by one, the rest are only counted
+MAX_LOGGED = 20
+
+_DONE = object()
+
+
+def key_ranges(prefix: str) -> list[tuple[str | None, str | None]]:
+    """
+    (after, upto] ranges covering every key, in order: None is open ended
+    """
+    bounds = [prefix + character for character in SPLIT_CHARACTERS]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def list_range(storage: StorageBackend, prefix, after, upto, pages: queue.Queue, stop):
+    def put(item):
+        # the diff may have stopped reading, don't block forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        page = []
+        for key, info in storage.list_objects(prefix, after):
+            if upto is not None and key > upto:
+                break
+            page.append((key, info))
+            if len(page) >= PAGE_SIZE:
+                put(page)
+                page = []
+        if page:
+            put(page)
+        put(_DONE)
+    except Exception as e:
+        put(e)
+
+
+def stored_objects(storage: StorageBackend, prefix: str, workers: int, stop):
+    """
+    (key, ObjectInfo) of every object under prefix, in key order. the ranges are
+    listed by a pool that takes them in order: the range being read has always started.
+    """
+    ranges = key_ranges(prefix)
+    queues = [queue.Queue(maxsize=PAGES_AHEAD) for _ in ranges]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for (after, upto), pages in zip(ranges, queues):
+                pool.submit(list_range, storage, prefix, after, upto, pages, stop)
+            for pages in queues:
+                while (page := pages.get()) is not _DONE:
+                    if isinstance(page, Exception):
+                        raise page
+                    yield from page
+        finally:
+            stop.set()
+
+
+def file_rows(prefix: str, batch_size: int):
+    """
+    the file rows under prefix in key order (byte order, COLLATE "C", like the
+    listing), one range per transaction so no snapshot is held for the whole run
+    """
+    path = models.File.storage_path.collate("C")
+    for after, upto in key_ranges(prefix):
+        query = select(
+            models.File.id,
+            models.File.owner_id,
+            models.File.storage_path,
+            models.File.size,
+            models.File.uploaded_at,
+            models.File.deleted_at,
+        ).order_by(path)
+        if prefix:
+            query = query.where(models.File.storage_path.like(like_prefix(prefix)))
+        if after is not None:
+            query = query.where(path > after)
+        if upto is not None:
+            query = query.where(path <= upto)
+        with SessionLocal() as db:
+            yield from db.execute(query.execution_options(yield_per=batch_size))
+
+
+def diff(objects, rows):
+    """
+    merge of the two ordered streams: (key, info, row) with info or row None on the
+    side that is missing. one object can match the rows of several owners (imports)
+    """
+    obj = next(objects, None)
+    row = next(rows, None)
+    while obj is not None or row is not None:
+        if row is None or (obj is not None and obj[0] < row.storage_path):
+            yield obj[0], obj[1], None
+            obj = next(objects, None)
+        elif obj is None or row.storage_path < obj[0]:
+            yield row.storage_path, None, row
+            row = next(rows, None)
+        else:
+            yield obj[0], obj[1], row
+            row = next(rows, None)
+            if row is None or row.storage_path != obj[0]:
+                obj = next(objects, None)
+
+
+def mark_dangling(rows) -> tuple[int, int]:
+    """
+    the rows go to the trash already past the retention: restore refuses them and the
+    next purge removes them (a missing object counts as deleted).
+    returns (rows marked, Redis updates that failed after the commit)
+    """
+    with SessionLocal() as db:
+        marked = db.execute(
+            update(models.File)
+            .where(
+                models.File.owner_id == any_id({row.owner_id for row in rows}),
+                models.File.id == any_id([row.id for row in rows]),
+                models.File.deleted_at.is_(None),
+            )
+            .values(deleted_at=trash_cutoff())
+            .returning(models.File.id, models.File.owner_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        by_owner = defaultdict(list)
+        for file_id, owner_id in marked:
+            by_owner[owner_id].append(file_id)
+        for owner_id, file_ids in by_owner.items():
+            record_changes(db, owner_id, file_ids, DELETE)
+        db.commit()
+
+    # the rows are committed: a failure below is counted, the pass goes on
+    failed = 0
+    for owner_id in by_owner:
+        try:
+            delete_redis(owner_id)
+        except Exception as e:
+            failed += 1
+            logger.error("failed to invalidate the listings of %s: %s", owner_id, e)
+    try:
+        mark_files_deleted([file_id for file_id, _ in marked])
+    except ShareMarkerError:
+        # their objects are gone, a share link of one fails at the download anyway
+        failed += 1
+    return len(marked), failed
+
+
+def naive_utc(value: datetime | None):
+    if value is None:
+        return models._utcnow()
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def import_objects(
+    storage: StorageBackend,
+    owner_id,
+    folder: str,
+    objects: list[tuple[str, ObjectInfo]],
+) -> int:
+    """
+    one multi-row INSERT per batch. the content type is guessed from the key, a HEAD
+    per object would cost more than the whole listing
+    """
+    rows, queued = [], []
+    for key, info in objects:
+        filename = posixpath.basename(key)
+        file_extension = os.path.splitext(filename)[1] or None
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        modified_at = naive_utc(info.modified_at)
+        file_id = uuid.uuid4()
+        rows.append(
+            {
+                "id": file_id,
+                "filename": filename,
+                "uploaded_at": modified_at,
+                "updated_at": modified_at,
+                "storage_path": key,
+                "size": info.size,
+                "s3_url": storage.object_url(key),
+                "content_type": content_type,
+                "file_extension": file_extension,
+                "folder_path": folder,
+                "owner_id": owner_id,
+            }
+        )
+        if extractor(content_type, file_extension):
+            queued.append(file_id)
+
+    with SessionLocal() as db:
+        inserted = set(
+            db.scalars(
+                pg_insert(models.File)
+                .values(rows)
+                .on_conflict_do_nothing()
+                .returning(models.File.id)
+            ).all()
+        )
+        if inserted & set(queued):
+            # indexed by indexer.py like an upload
+            db.execute(
+                pg_insert(models.FileContent).values(
+                    [
+                        {"file_id": file_id, "owner_id": owner_id, "status": PENDING}
+                        for file_id in queued
+                        if file_id in inserted
+                    ]
+                )
+            )
+        record_changes(db, owner_id, inserted, INSERT)
+        db.commit()
+    delete_redis(owner_id)
+    return len(inserted)
+
+
+def run(
+    prefix: str,
+    workers: int,
+    min_age: int,
+    batch_size: int,
+    repair: bool = False,
+    import_to=None,
+    folder: str = "/",
+) -> dict:
+    storage = get_storage()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age)
+    counts = defaultdict(int)
+    orphans, dangling = [], []
+
+    def flush_orphans():
+        if not orphans:
+            return
+        if import_to is not None:
+            counts["imported"] += import_objects(storage, import_to, folder, orphans)
+        elif repair:
+            failed = storage.delete_many(key for key, _ in orphans)
+            counts["objects_deleted"] += len(orphans) - len(failed)
+        orphans.clear()
+
+    def flush_dangling():
+        if dangling and repair:
+            marked, failed = mark_dangling(dangling)
+            counts["rows_marked"] += marked
+            counts["redis_updates_failed"] += failed
+        dangling.clear()
+
+    def note(kind: str, key: str):
+        counts[kind] += 1
+        if counts[kind] <= MAX_LOGGED:
+            logger.info("%s: %s", kind, key)
+
+    stop = threading.Event()
+    objects = stored_objects(storage, prefix, workers, stop)
+    try:
+        for key, info, row in diff(objects, file_rows(prefix, batch_size)):
+            if info is not None:
+                counts["objects"] += 1
+            if row is not None:
+                counts["rows"] += 1
+
+            if info is not None and row is not None:
+                counts["matched"] += 1
+                if row.size is not None and row.size != info.size:
+                    note("size_mismatch", key)
+            elif row is None:
+                # an import takes everything, a repair only what is surely not in flight
+                if import_to is None and (
+                    info.modified_at is None or info.modified_at > cutoff
+                ):
+                    counts["recent_objects_skipped"] += 1
+                    continue
+                note("orphaned_object", key)
+                orphans.append((key, info))
+                if len(orphans) >= S3_DELETE_BATCH_SIZE:
+                    flush_orphans()
+            elif row.deleted_at is not None:
+                # purge.py deletes it, a missing object counts as deleted there
+                counts["trashed_rows_without_object"] += 1
+            elif naive_utc(row.uploaded_at) > naive_utc(cutoff):
+                counts["recent_rows_skipped"] += 1
+            else:
+                note("dangling_row", key)
+                dangling.append(row)
+                if len(dangling) >= batch_size:
+                    flush_dangling()
+        flush_orphans()
+        flush_dangling()
+    finally:
+        stop.set()
+        objects.close()
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prefix", default="", help="only the keys under this prefix")
+    parser.add_argument("--workers", type=int, default=settings.reconcile_workers)
+    parser.add_argument(
+        "--min-age", type=int, default=settings.reconcile_min_age_seconds
+    )
+    parser.add_argument("--batch", type=int, default=settings.reconcile_batch_size)
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="delete the orphaned objects and mark the dangling rows",
+    )
+    parser.add_argument(
+        "--import-to",
+        type=UUID,
+        metavar="USER_ID",
+        help="add the objects without a row to this user's files",
+    )
+    parser.add_argument("--folder", default="/", help="folder of the imported files")
+    args = parser.parse_args()
+
+    folder = normalize_folder_path(args.folder)
+    if args.import_to is not None:
+        if args.repair:
+            parser.error("--import-to and --repair exclude each other")
+        if not args.prefix:
+            parser.error("--import-to needs --prefix")
+        with SessionLocal() as db:
+            if db.get(models.User, args.import_to) is None:
+                parser.error(f"user {args.import_to} does not exist")
+            if folder != "/" and not db.scalar(
+                select(models.Folder.id).where(
+                    models.Folder.owner_id == args.import_to,
+                    models.Folder.path == folder,
+                )
+            ):
+                parser.error(f"folder {folder} does not exist")
+
+    counts = run(
+        args.prefix,
+        args.workers,
+        args.min_age,
+        args.batch,
+        repair=args.repair,
+        import_to=args.import_to,
+        folder=folder,
+    )
+    logger.info(
+        "reconcile done: %s",
+        ", ".join(f"{kind}={count}" for kind, count in sorted(counts.items())),
+    )
+
+
+if __name__ == "__main__":
+    main()
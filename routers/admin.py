@@ -0,0 +1,82 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from config import get_settings
+from dependecies import require_admin
+from logger import get_logger
+from profiling import debug_header, folded, get_profile, list_profiles
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+)
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    request_id: str
+    method: str
+    path: str
+    status: int | None
+    at: str
+    duration_ms: float
+    samples: int
+    peak_traced_bytes: int
+
+
+class DebugHeader(BaseModel):
+    header: str
+    value: str
+
+
+# plain def: the profiles are read with blocking Redis calls, FastAPI runs these
+# handlers in its thread pool instead of on the event loop
+@router.get("/profiles", response_model=List[ProfileSummary])
+def profiles():
+    """
+    the stored request profiles of every worker, newest first
+    """
+    try:
+        return list_profiles()
+    except Exception as e:
+        logger.error("failed to list profiles: %s", e)
+        raise HTTPException(status_code=503, detail="profiles unavailable")
+
+
+@router.get("/profiles/{profile_id}")
+def profile(
+    profile_id: str, format: str = Query(default="json", pattern="^(json|folded)$")
+):
+    """
+    one profile: json (stacks, allocation sites), or folded stacks for a flame graph
+    (flamegraph.pl, speedscope)
+    """
+    try:
+        data = get_profile(profile_id)
+    except Exception as e:
+        logger.error("failed to read profile %s: %s", profile_id, e)
+        raise HTTPException(status_code=503, detail="profiles unavailable")
+    if data is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    if format == "folded":
+        return PlainTextResponse(folded(data))
+    return data
+
+
+@router.post(
+    "/profiles/header", response_model=DebugHeader, status_code=status.HTTP_201_CREATED
+)
+async def profile_header(ttl: int = Query(default=300, ge=1, le=3600)):
+    """
+    X-Debug-Profile value: every request sent with it in the next `ttl` seconds is
+    profiled. needs PROFILING_SECRET.
+    """
+    if not settings.profiling_secret:
+        raise HTTPException(status_code=409, detail="PROFILING_SECRET is not set")
+    return DebugHeader(header="X-Debug-Profile", value=debug_header(ttl))
@@ -1,5 +1,3 @@
-import os
-from dotenv import load_dotenv
 from fastapi.responses import JSONResponse
 import jwt
 from datetime import datetime, timedelta, timezone
@@ -7,23 +5,27 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 import models
-from database import get_db
+from config import get_settings
+from database import get_db, mark_user_write
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
-from logger import logger
+from logger import get_logger
+from timing import timed
 from uuid import UUID
 
+logger = get_logger(__name__)
+
 router = APIRouter(
     prefix="/auth", tags=["auth"], responses={401: {"message": "unauthorized access"}}
 )
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-load_dotenv()
+settings = get_settings()
 
-SECRET_KEY = os.getenv("SECRET_KEY")
+SECRET_KEY = settings.secret_key
 
-ALGORITHM = os.getenv("ALGORITHM")
+ALGORITHM = settings.algorithm
 
 # PYDANTIC MODE
 
@@ -83,7 +85,11 @@ def validate_user_data(user, db):
 
 
 def authenticate_user(username, password, db):
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = (
+        db.query(models.User)
+        .filter(models.User.username == username, models.User.deleted_at.is_(None))
+        .first()
+    )
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -91,10 +97,12 @@ def authenticate_user(username, password, db):
     return user
 
 
+@timed("bcrypt")
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+@timed("bcrypt")
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -119,7 +127,7 @@ def create_access_token(
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     except Exception as e:
-        logger.error(f"JWT encoding failed: {e}")
+        logger.error("JWT encoding failed: %s", e)
         raise HTTPException(status_code=500, detail="Could not generate token.")
 
 
@@ -145,15 +153,20 @@ async def register_user(
         db.add(user_model)
         db.commit()
         db.refresh(user_model)
+        mark_user_write(user_model.id)
         return user_model
     except HTTPException as e:
-        logger.error(f"Registration HTTPException for user {user.username}: {e.detail}")
+        logger.error(
+            "Registration HTTPException for user %s: %s", user.username, e.detail
+        )
         db.rollback()
         raise
     except Exception as e:
         db.rollback()
         logger.error(
-            f"Some internal issue occur in registration for user {user.username}: {e}"
+            "Some internal issue occur in registration for user %s: %s",
+            user.username,
+            e,
         )
         raise HTTPException(
             status_code=500,
@@ -167,7 +180,7 @@ async def loginUser(user: UserLogin, db: Session = Depends(get_db)):
         auth_user = authenticate_user(user.username, user.password, db)
         if not auth_user:
             logger.warning(
-                f"Login failed for username {user.username}: incorrect credentials."
+                "Login failed for username %s: incorrect credentials.", user.username
             )
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -183,13 +196,13 @@ async def loginUser(user: UserLogin, db: Session = Depends(get_db)):
         response.set_cookie(
             key="access_token", value=access_token, httponly=True, secure=True, path="/"
         )
-        logger.info(f"User {user.username} logged in successfully.")
+        logger.info("User %s logged in successfully.", user.username)
         return response
     except HTTPException as e:
-        logger.error(f"Login HTTPException for user {user.username}: {e.detail}")
+        logger.error("Login HTTPException for user %s: %s", user.username, e.detail)
         raise
     except Exception as e:
-        logger.error(f"Could not generate token for user {user.username}: {e}")
+        logger.error("Could not generate token for user %s: %s", user.username, e)
         raise HTTPException(status_code=500, detail=f"could not generate token")
 
 
@@ -202,5 +215,5 @@ async def logoutUser():
         logger.info("User logged out successfully.")
         return response
     except Exception as e:
-        logger.error(f"Error during logout: {e}")
+        logger.error("Error during logout: %s", e)
         raise HTTPException(status_code=500, detail="Could not logout user.")
@@ -0,0 +1,298 @@
+from datetime import datetime
+from typing import List
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import String, delete, func, literal, select, update
+from sqlalchemy.orm import Session
+from database import get_db, get_read_db, mark_user_write
+from dependecies import get_current_user_from_cookie
+import models
+from changes import DELETE, UPDATE, record_changes
+from logger import get_logger
+from share_markers import mark_files_deleted
+from routers.user import (
+    delete_redis_folders,
+    folder_depth,
+    like_prefix,
+    normalize_folder_path,
+    parent_folder,
+    write_delete_markers,
+)
+
+logger = get_logger(__name__)
+
+router = APIRouter(
+    prefix="/user/folders",
+    tags=["folders"],
+    dependencies=[Depends(get_current_user_from_cookie)],
+)
+
+
+class FolderCreate(BaseModel):
+    path: str
+
+
+class FolderMove(BaseModel):
+    path: str
+    new_path: str
+
+
+class FolderResponse(BaseModel):
+    id: UUID
+    path: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class FolderStats(BaseModel):
+    path: str
+    folder_count: int
+    file_count: int
+    total_size: int
+
+
+# HELPERS FUNCTION
+
+
+def get_folder(db: Session, owner_id, path: str) -> models.Folder | None:
+    return db.scalar(
+        select(models.Folder).where(
+            models.Folder.owner_id == owner_id, models.Folder.path == path
+        )
+    )
+
+
+def require_folder(db: Session, owner_id, path: str):
+    # the root always exists, it has no row
+    if path != "/" and get_folder(db, owner_id, path) is None:
+        raise HTTPException(status_code=404, detail=f"folder {path} does not exist")
+
+
+def subtree_filter(column, path: str):
+    """
+    every row whose path is `path` or below it (one prefix range scan)
+    """
+    return column.like(like_prefix(path))
+
+
+@router.post("", response_model=FolderResponse, status_code=status.HTTP_201_CREATED)
+async def create_folder(
+    folder: FolderCreate,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    path = normalize_folder_path(folder.path)
+    if path == "/":
+        raise HTTPException(status_code=400, detail="the root folder already exists")
+
+    require_folder(db, user.id, parent_folder(path))
+    if get_folder(db, user.id, path) is not None:
+        raise HTTPException(status_code=409, detail=f"folder {path} already exists")
+
+    try:
+        db_folder = models.Folder(path=path, depth=folder_depth(path), owner_id=user.id)
+        db.add(db_folder)
+        db.commit()
+        db.refresh(db_folder)
+        mark_user_write(user.id)
+        return db_folder
+    except Exception as e:
+        db.rollback()
+        logger.error("failed to create folder %s: %s", path, e)
+        raise HTTPException(status_code=500, detail=f"failed to create folder {path}")
+
+
+@router.get("", response_model=List[FolderResponse], status_code=status.HTTP_200_OK)
+async def list_folders(
+    path: str = "/",
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    direct sub folders of `path`. files are listed by GET /user/files?folder=<path>
+    """
+    path = normalize_folder_path(path)
+    require_folder(db, user.id, path)
+
+    return db.scalars(
+        select(models.Folder)
+        .where(
+            models.Folder.owner_id == user.id,
+            subtree_filter(models.Folder.path, path),
+            models.Folder.depth == folder_depth(path) + 1,
+        )
+        .order_by(models.Folder.path)
+    ).all()
+
+
+@router.get("/stats", response_model=FolderStats, status_code=status.HTTP_200_OK)
+async def folder_stats(
+    path: str = "/",
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    number of folders / files and total size of the whole subtree
+    """
+    path = normalize_folder_path(path)
+    require_folder(db, user.id, path)
+
+    file_count, total_size = db.execute(
+        select(func.count(), func.coalesce(func.sum(models.File.size), 0)).where(
+            models.File.owner_id == user.id,
+            models.File.deleted_at.is_(None),
+            subtree_filter(models.File.folder_path, path),
+        )
+    ).one()
+    # the folder itself matches its own prefix
+    folder_count = db.scalar(
+        select(func.count()).where(
+            models.Folder.owner_id == user.id,
+            subtree_filter(models.Folder.path, path),
+            models.Folder.path != path,
+        )
+    )
+
+    return FolderStats(
+        path=path,
+        folder_count=folder_count,
+        file_count=file_count,
+        total_size=total_size,
+    )
+
+
+@router.post("/move", response_model=FolderResponse, status_code=status.HTTP_200_OK)
+async def move_folder(
+    move: FolderMove,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    move/rename a folder with everything below it. only paths change (the S3 keys do
+    not depend on the folder), so it is one UPDATE per table for the whole subtree.
+    files in the trash move too, a restore puts them back in the new place.
+    """
+    path = normalize_folder_path(move.path)
+    new_path = normalize_folder_path(move.new_path)
+
+    if path == "/" or new_path == "/":
+        raise HTTPException(status_code=400, detail="the root folder can not be moved")
+    if new_path.startswith(path):
+        raise HTTPException(
+            status_code=400, detail="a folder can not be moved into itself"
+        )
+    db_folder = get_folder(db, user.id, path)
+    if db_folder is None:
+        raise HTTPException(status_code=404, detail=f"folder {path} does not exist")
+    require_folder(db, user.id, parent_folder(new_path))
+    if get_folder(db, user.id, new_path) is not None:
+        raise HTTPException(status_code=409, detail=f"folder {new_path} already exists")
+
+    # "/a/b/x/" -> "/c/x/": new prefix + whatever followed the old prefix
+    def rebase(column):
+        return literal(new_path, String) + func.substr(column, len(path) + 1)
+
+    try:
+        db.execute(
+            update(models.Folder)
+            .where(
+                models.Folder.owner_id == user.id,
+                subtree_filter(models.Folder.path, path),
+            )
+            .values(
+                path=rebase(models.Folder.path),
+                depth=models.Folder.depth + folder_depth(new_path) - folder_depth(path),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        moved = db.execute(
+            update(models.File)
+            .where(
+                models.File.owner_id == user.id,
+                subtree_filter(models.File.folder_path, path),
+            )
+            .values(folder_path=rebase(models.File.folder_path))
+            .returning(models.File.id, models.File.deleted_at)
+            .execution_options(synchronize_session=False)
+        ).all()
+        # the files in the trash are not in any listing
+        record_changes(
+            db, user.id, [file.id for file in moved if file.deleted_at is None], UPDATE
+        )
+        db.commit()
+        mark_user_write(user.id)
+    except Exception as e:
+        db.rollback()
+        logger.error("failed to move folder %s to %s: %s", path, new_path, e)
+        raise HTTPException(status_code=500, detail=f"failed to move folder {path}")
+
+    delete_redis_folders(user.id, path, new_path)
+
+    db.refresh(db_folder)
+    return db_folder
+
+
+@router.delete("", status_code=status.HTTP_200_OK)
+async def delete_folder(
+    path: str,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    delete a folder and its sub folders, their files go to the trash (restoring one
+    creates its folder again)
+    """
+    path = normalize_folder_path(path)
+    if path == "/":
+        raise HTTPException(
+            status_code=400,
+            detail="the root folder can not be deleted, use DELETE /user/files",
+        )
+    require_folder(db, user.id, path)
+
+    try:
+        file_ids = db.scalars(
+            update(models.File)
+            .where(
+                models.File.owner_id == user.id,
+                models.File.deleted_at.is_(None),
+                subtree_filter(models.File.folder_path, path),
+            )
+            .values(deleted_at=models._utcnow())
+            .returning(models.File.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        record_changes(db, user.id, file_ids, DELETE)
+        db.execute(
+            delete(models.Folder)
+            .where(
+                models.Folder.owner_id == user.id,
+                subtree_filter(models.Folder.path, path),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    except Exception as e:
+        db.rollback()
+        logger.error("failed to delete folder %s: %s", path, e)
+        raise HTTPException(status_code=500, detail=f"failed to delete folder {path}")
+
+    await write_delete_markers(db, mark_files_deleted, file_ids)
+
+    try:
+        db.commit()
+        mark_user_write(user.id)
+    except Exception as e:
+        db.rollback()
+        logger.error("failed to delete folder %s: %s", path, e)
+        raise HTTPException(status_code=500, detail=f"failed to delete folder {path}")
+
+    delete_redis_folders(user.id, path)
+
+    msg = {
+        "message": f"Folder {path} and its {len(file_ids)} files have been deleted."
+    }
+    return JSONResponse(content=msg)
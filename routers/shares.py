@@ -0,0 +1,214 @@
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Literal
+from urllib.parse import quote
+from uuid import UUID
+import jwt
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi.responses import JSONResponse, RedirectResponse
+from pydantic import BaseModel, Field
+from access import key_owner, record_access
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from config import get_settings
+from database import get_read_db
+from dependecies import get_current_user_from_cookie, get_redis_client
+import models
+from logger import get_logger
+from share_markers import deleted_file_key, deleted_owner_key, restored_file_key
+from storage import LocalStorage, get_storage
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+# same signing setup as the login token (routers/auth.py)
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+
+# a login token must never be accepted as a share token, and vice versa
+SHARE_TOKEN_TYPE = "share"
+
+# lifetime of the S3 url a share link redirects to; the link itself lives longer
+REDIRECT_URL_SECONDS = 5 * 60
+
+# a link issued up to this long after its owner deleted all files is refused too: the
+# time in the link and the one of the deletion come from the clocks of two workers
+CLOCK_SKEW_SECONDS = 5
+
+router = APIRouter(prefix="/share", tags=["share"])
+
+
+class ShareCreate(BaseModel):
+    file_id: UUID
+    # "view" opens inline in the browser, "download" forces a download
+    permission: Literal["view", "download"] = "download"
+    expires_in: int | None = Field(default=None, gt=0)
+
+
+class ShareRevoke(BaseModel):
+    token: str
+
+
+class ShareResponse(BaseModel):
+    token: str
+    url: str
+    expires_at: datetime
+
+
+# HELPERS FUNCTION
+
+
+def revoked_key(jti: str) -> str:
+    return f"share:revoked:{jti}"
+
+
+def create_share_token(file: models.File, permission: str, expires_at: datetime):
+    """
+    everything needed to serve the file is in the token (short claim names keep it
+    compact), so resolving it needs no database read.
+    NOTE: signed, not encrypted: the storage key and filename are readable by whoever
+    holds the link.
+    """
+    if not SECRET_KEY or not ALGORITHM:
+        logger.error("SECRET_KEY or ALGORITHM is not set in environment variables.")
+        raise HTTPException(status_code=500, detail="Token generation misconfiguration.")
+
+    payload = {
+        "typ": SHARE_TOKEN_TYPE,
+        "jti": secrets.token_urlsafe(9),
+        "fid": str(file.id),
+        "key": file.storage_path,
+        "name": file.filename,
+        "perm": permission,
+        "exp": int(expires_at.timestamp()),
+        # checked against the owner's "deleted all files at" marker. not "iat": PyJWT
+        # rejects an iat ahead of its clock, which another worker's may be
+        "own": str(file.owner_id),
+        "at": round(time.time(), 3),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def deleted_since_issued(payload: dict, owner_deleted_at, restored_at) -> bool:
+    """
+    the owner deleted all files after the link was issued (the file with them), and
+    the file was not restored since. a link without "at" is older than the marker
+    """
+    if owner_deleted_at is None:
+        return False
+    owner_deleted_at = float(owner_deleted_at)
+    if restored_at is not None and float(restored_at) > owner_deleted_at:
+        return False
+    return payload.get("at", 0) <= owner_deleted_at + CLOCK_SKEW_SECONDS
+
+
+def decode_share_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=410, detail="share link has expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=404, detail="share link not found")
+
+    if payload.get("typ") != SHARE_TOKEN_TYPE:
+        raise HTTPException(status_code=404, detail="share link not found")
+    return payload
+
+
+@router.post("", response_model=ShareResponse, status_code=status.HTTP_201_CREATED)
+async def create_share(
+    share: ShareCreate,
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    file = db.scalar(
+        select(models.File).where(
+            models.File.id == share.file_id,
+            models.File.owner_id == user.id,
+            models.File.deleted_at.is_(None),
+        )
+    )
+    if file is None:
+        raise HTTPException(status_code=404, detail="file not found")
+
+    expires_in = min(
+        share.expires_in or settings.share_link_default_seconds,
+        settings.share_link_max_seconds,
+    )
+    expires_at = datetime.fromtimestamp(
+        int(datetime.now(timezone.utc).timestamp()) + expires_in, timezone.utc
+    )
+    token = create_share_token(file, share.permission, expires_at)
+
+    return ShareResponse(token=token, url=f"{router.prefix}/{token}", expires_at=expires_at)
+
+
+@router.post("/revoke", status_code=status.HTTP_200_OK)
+async def revoke_share(
+    share: ShareRevoke,
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    payload = decode_share_token(share.token)
+
+    owner_id = db.scalar(
+        select(models.File.owner_id).where(models.File.id == UUID(payload["fid"]))
+    )
+    # a file that is gone can't be served anyway, only its owner may revoke otherwise
+    if owner_id is not None and owner_id != user.id:
+        raise HTTPException(status_code=404, detail="share link not found")
+
+    # keep the denylist entry only as long as the token could still be used
+    ttl = payload["exp"] - int(datetime.now(timezone.utc).timestamp())
+    if ttl > 0:
+        try:
+            get_redis_client().set(revoked_key(payload["jti"]), 1, ex=ttl)
+        except Exception as e:
+            logger.error("failed to revoke share link %s: %s", payload["jti"], e)
+            raise HTTPException(status_code=503, detail="could not revoke share link")
+
+    return JSONResponse(content={"message": "share link revoked"})
+
+
+@router.get("/{token}", status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+async def open_share(token: str, background_tasks: BackgroundTasks):
+    """
+    public: signature + expiry check, one Redis round trip for revocation (of the link,
+    of the file by deleting it, or of all the owner's files by deleting them all), then
+    a redirect to a short lived presigned url. no database access.
+    """
+    payload = decode_share_token(token)
+    # links issued before the owner claim: the storage key starts with the owner id
+    owner_id = payload.get("own") or payload["key"].split("/", 1)[0]
+
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        pipe.exists(revoked_key(payload["jti"]), deleted_file_key(payload["fid"]))
+        pipe.mget(deleted_owner_key(owner_id), restored_file_key(payload["fid"]))
+        revoked, (owner_deleted_at, restored_at) = pipe.execute()
+    except Exception as e:
+        # fail closed, a revoked link must never open because Redis is down
+        logger.error("share denylist unavailable: %s", e)
+        raise HTTPException(status_code=503, detail="please try again later")
+    if revoked or deleted_since_issued(payload, owner_deleted_at, restored_at):
+        raise HTTPException(status_code=410, detail="share link has been revoked")
+
+    disposition = "attachment" if payload["perm"] == "download" else "inline"
+    filename = quote(payload.get("name") or "download")
+    storage = get_storage()
+    url = storage.sign_url(
+        payload["key"],
+        expires=REDIRECT_URL_SECONDS,
+        disposition=f"{disposition}; filename*=UTF-8''{filename}",
+    )
+    if url is None:
+        raise HTTPException(status_code=502, detail="could not open shared file")
+    # the S3 download can't be seen from here, the redirect to it is the access. local
+    # downloads are counted by routers/storage.py
+    if not isinstance(storage, LocalStorage):
+        owner = payload.get("own") or key_owner(payload["key"])
+        background_tasks.add_task(record_access, [(owner, payload["key"])])
+
+    return RedirectResponse(url=url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
@@ -0,0 +1,94 @@
+import os
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Response, status
+from fastapi.responses import FileResponse
+from access import key_owner, record_access
+from starlette.datastructures import Headers
+from config import get_settings
+from logger import get_logger
+from storage import LocalStorage, get_storage
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+router = APIRouter(prefix="/storage", tags=["storage"])
+
+
+class LocalFileResponse(FileResponse):
+    """
+    FileResponse (Range requests, and `http.response.pathsend` when the server has it)
+    plus the ASGI zero-copy extension: a server offering `http.response.zerocopysend`
+    gets the open file and sendfile()s it to the socket, the bytes never go through
+    Python. otherwise it falls back to FileResponse's chunked reads.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if (
+            "http.response.zerocopysend" not in scope.get("extensions", {})
+            or scope["method"].upper() == "HEAD"
+            or "range" in Headers(scope=scope)
+        ):
+            return await super().__call__(scope, receive, send)
+
+        # content-length comes from the stat_result given to the constructor
+        with open(self.path, "rb") as f:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            await send({"type": "http.response.zerocopysend", "file": f})
+        if self.background is not None:
+            await self.background()
+
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"])
+async def download(
+    key: str,
+    exp: int,
+    sig: str,
+    background_tasks: BackgroundTasks,
+    disp: str | None = None,
+):
+    """
+    target of the urls signed by storage.LocalStorage (the local counterpart of an S3
+    presigned url): HMAC of key, expiry and disposition, no session needed.
+    """
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="not found")
+    if not storage.verify(key, exp, disp or "", sig):
+        raise HTTPException(status_code=403, detail="invalid or expired url")
+
+    try:
+        path = storage.path(key)
+        info = storage.head(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="not found")
+    if info is None:
+        raise HTTPException(status_code=404, detail="not found")
+
+    # the url does not carry the owner, the app's keys start with it
+    background_tasks.add_task(record_access, [(key_owner(key), key)])
+
+    headers = {"Cache-Control": "private, max-age=0"}
+    if disp:
+        headers["Content-Disposition"] = disp
+
+    if settings.storage_local_accel_prefix:
+        # nginx serves the file itself (sendfile), the app only checked the signature
+        headers["X-Accel-Redirect"] = settings.storage_local_accel_prefix + key
+        return Response(
+            status_code=status.HTTP_200_OK,
+            headers=headers,
+            media_type=info.content_type or "application/octet-stream",
+        )
+
+    return LocalFileResponse(
+        path,
+        media_type=info.content_type or "application/octet-stream",
+        headers=headers,
+        stat_result=os.stat(path),
+    )
@@ -1,41 +1,136 @@
+import asyncio
 import hashlib
-import io
+import math
 import os
-import redis
-import boto3
 import json
-from botocore.exceptions import ClientError
-from dotenv import load_dotenv
-from typing import List
-from datetime import datetime
+import random
+import secrets
+import time
+from typing import Annotated, List, Literal, Union
+from urllib.parse import quote
+from datetime import datetime, timedelta, timezone
 from uuid import UUID
 import uuid
+import jwt
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
     Request,
+    Response,
     status,
     UploadFile,
     BackgroundTasks,
+    Form,
 )
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, field_validator, ValidationInfo
-from sqlalchemy import delete, select
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, field_validator, ValidationInfo
+from sqlalchemy import (
+    DateTime,
+    String,
+    and_,
+    any_,
+    cast,
+    column,
+    func,
+    literal,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID, insert as pg_insert
 from sqlalchemy.orm import Session
-from database import get_db
-from dependecies import get_current_user_from_cookie, delete_s3_object
+from database import get_db, get_read_db, mark_user_write
+from config import get_settings
+from dependecies import (
+    get_current_user_from_cookie,
+    get_redis_client,
+)
 import models
-from logger import logger
-
-load_dotenv()
-
+from access import record_access
+from archive import ArchiveEntry, archive_names, stream_zip
+from cache import LocalCache
+from changes import DELETE, INSERT, UPDATE, record_changes
+from fulltext import (
+    PENDING,
+    extractor,
+    headline,
+    normalize_query,
+    snippet_html,
+    to_tsquery,
+)
+from logger import get_logger
+from metrics import register_collector
+from share_markers import ShareMarkerError, mark_files_deleted, mark_owner_deleted
+from storage import get_storage
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+# listings are fresh for CACHE_TTL, then served stale for up to CACHE_STALE_SECONDS
+# while a single request recomputes them
+CACHE_TTL = 5 * 60
+CACHE_STALE_SECONDS = 60
+# > 1 refreshes earlier, < 1 later
+EARLY_REFRESH_BETA = 1.0
+# how long the recomputing request holds the lock / how long the others wait for it
+REFRESH_LOCK_MS = 10_000
+REFRESH_WAIT_SECONDS = 0.05
+REFRESH_WAIT_STEPS = 40
+
+# delete the lock only if it is still ours (it may have expired and been taken)
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+cache_stats = {
+    "hits": 0,
+    "stale": 0,
+    "refreshes": 0,
+    "waits": 0,
+    "lock_timeouts": 0,
+    "redis_hits": 0,
+    "redis_misses": 0,
+}
+
+# L1: this worker's copy of recently used listings, in front of Redis (L2)
+local_cache = LocalCache(settings.l1_cache_max_bytes, settings.l1_cache_ttl_seconds)
+# every worker evicts its local copies on the invalidations published here
+INVALIDATION_CHANNEL = "cache:invalidate"
+WORKER_ID = uuid.uuid4().hex
+_invalidation_thread = None
+
+register_collector(
+    "listing_cache", lambda: {**cache_stats, "local": local_cache.snapshot()}
+)
 
-AWS_REGION = os.getenv("AWS_REGION")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-REDIS_HOST_NAME = os.getenv("REDIS_HOST_NAME")
-REDIS_PORT = os.getenv("REDIS_PORT")
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+# per user data, only the browser may keep it and it must revalidate every time
+LISTING_CACHE_CONTROL = "private, no-cache"
+# lifetime of the signed access_urls of a listing
+ACCESS_URL_SECONDS = 60 * 60
+# a listing's ETag changes this often even without a write: a 304 only confirms a
+# body younger than this, whose urls (signed at most CACHE_TTL + CACHE_STALE_SECONDS
+# before it was sent) are still valid
+LISTING_ETAG_SECONDS = ACCESS_URL_SECONDS // 2
+
+# per request limit of POST /user/files/batch
+MAX_BATCH_OPERATIONS = 1000
+# files in one GET /user/files/archive
+MAX_ARCHIVE_FILES = 10000
+# most change log entries returned by one GET /user/files/changes
+MAX_CHANGES_PAGE = 1000
+# best matches returned by a content search (GET /user/files?q=)
+MAX_SEARCH_RESULTS = 100
+MAX_QUERY_LENGTH = 256
+
+# a version that is not bumped for this long expires; the next read starts a new one
+DATA_VERSION_TTL = 30 * 24 * 60 * 60
 
 router = APIRouter(
     prefix="/user",
@@ -43,8 +138,6 @@ router = APIRouter(
     dependencies=[Depends(get_current_user_from_cookie)],
 )
 
-s3_client = boto3.client("s3", region_name=AWS_REGION)
-
 
 class UserFiles(BaseModel):
     id: UUID
@@ -54,6 +147,13 @@ class UserFiles(BaseModel):
     size: int
     access_url: str
     content_type: str
+    folder_path: str = "/"
+    # temporary files: deleted (not restorable) once this has passed
+    expires_at: datetime | None = None
+    # only set when searching the contents (q=): ts_rank_cd of the match, and the
+    # matching passages, html escaped with the matched words in <b></b>
+    rank: float | None = None
+    snippet: str | None = None
 
     class Config:
         from_attributes = True
@@ -66,6 +166,8 @@ class UserFileDetail(BaseModel):
     s3_url: str
     size: int | None
     content_type: str | None
+    folder_path: str = "/"
+    expires_at: datetime | None = None
 
     class config:
         validate_assignment = True
@@ -88,49 +190,69 @@ class UserFileDetail(BaseModel):
         return v
 
 
-def create_presigned_url(bucket_name, object_name, expiration=3600):
-    """
+class DeleteOperation(BaseModel):
+    op: Literal["delete"]
+    id: UUID
 
-    Args:
-        bucket_name (): Name of the s3_bucket.
-        object_name (): s3_object_key.
-        expiration (): time till the link will be valid.
 
-    Returns:
-        public access url for s3_object
+class RenameOperation(BaseModel):
+    op: Literal["rename"]
+    id: UUID
+    filename: str = Field(min_length=1, max_length=255)
 
 
-    """
-    s3_client = boto3.client("s3")
-    try:
-        response = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": bucket_name, "Key": object_name},
-            ExpiresIn=expiration,
-        )
-    except Exception as e:
-        logger.error(f"Error generating presigned URL: {e}")
-        return None
-    return response
+class RetagOperation(BaseModel):
+    # there are no free form tags, the tag of a file is its content type
+    op: Literal["retag"]
+    id: UUID
+    content_type: str = Field(min_length=1, max_length=255)
 
 
-def authenticate_redis():
-    if REDIS_HOST_NAME is None:
-        raise RuntimeError("HOST_NAME is not set in env")
-    if REDIS_PORT is None:
-        raise RuntimeError("PORT_NUMBER is not set in env")
-    if REDIS_PASSWORD is None:
-        raise RuntimeError("REDIS_PASSWORD is not set in env")
+class ExpireOperation(BaseModel):
+    # seconds from now until expiry.py deletes the file, None = keep it
+    op: Literal["expire"]
+    id: UUID
+    expires_in: int | None = Field(ge=1, le=settings.file_expiry_max_seconds)
 
-    # print(REDIS_PASSWORD)
 
-    try:
-        r = redis.Redis(
-            host=REDIS_HOST_NAME, port=int(REDIS_PORT), password=REDIS_PASSWORD
-        )
-        return r
-    except Exception as e:
-        raise
+class FileBatch(BaseModel):
+    operations: List[
+        Annotated[
+            Union[DeleteOperation, RenameOperation, RetagOperation, ExpireOperation],
+            Field(discriminator="op"),
+        ]
+    ] = Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+
+class FileBatchResult(BaseModel):
+    deleted: int
+    renamed: int
+    retagged: int
+    expiry_updated: int = 0
+
+
+class FileChangeEntry(BaseModel):
+    seq: int
+    # insert / update / delete
+    op: str
+    file_id: UUID
+    # the file as it is now (same fields as in GET /user/files), None once deleted
+    file: dict | None = None
+
+
+class FileChanges(BaseModel):
+    # pass it as `since` in the next request
+    cursor: int
+    has_more: bool
+    # the cursor is older than the log: list everything again (GET /user/files), then
+    # follow the changes from `cursor`
+    resync_required: bool = False
+    changes: List[FileChangeEntry] = []
+
+
+def authenticate_redis():
+    # shared client, the connection pool is reused across requests
+    return get_redis_client()
 
 
 def get_redis_key(base, filter_param):
@@ -150,53 +272,178 @@ def get_redis_key(base, filter_param):
             key = f"{str(base)}:all"
         else:
             hashed_key = hashlib.md5(filter_param.encode()).hexdigest()
-            key = f"{str(base)}:filter:{hashed_key}"
+            query_param = json.loads(filter_param)
+            folder = query_param.get("folder")
+            if folder:
+                # folder listings carry their path so a subtree can be evicted on its own
+                scope = "r" if query_param.get("recursive") else "d"
+                key = f"{str(base)}:folder:{folder}:{scope}:{hashed_key}"
+            else:
+                key = f"{str(base)}:filter:{hashed_key}"
     return key
 
 
-def get_redis(base, filter_param):
+def get_redis(base, filter_param, version=None):
     """
 
     Args:
         base (): user.id
         filter_param (): either "all" or JSON string json.dumps()
+        version (): current data version, a local copy of another version is dropped
 
     Returns:
-        return the data for key from redis
+        the cache entry for the key ({"data", "version", "expires_at", "delta"}) or
+        None. an empty listing is a valid entry, not a miss.
 
     """
-    r = authenticate_redis()
-
     key = get_redis_key(base, filter_param)
+    if not key:
+        return None
 
-    if key:
-        if r.exists(key):
-            data = r.get(key)
-            if isinstance(data, bytes):
-                list_of_files = json.loads(data.decode("utf-8"))
-            elif isinstance(data, str):
-                list_of_files = json.loads(data)
-            else:
-                list_of_files = None
+    if local_cache_active():
+        entry = local_cache.get(key)
+        if entry is not None:
+            # only fresh copies are kept locally, an expired one is refreshed (or
+            # served stale) through Redis like on any other worker
+            if (
+                version is None or entry["version"] == version
+            ) and time.time() < entry["expires_at"]:
+                return entry
+            local_cache.delete(key)
 
-            if list_of_files is not None:
-                return list_of_files
+    r = authenticate_redis()
 
+    data = r.get(key)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    if isinstance(data, str):
+        entry = json.loads(data)
+        # entries written before the envelope format are plain lists
+        if isinstance(entry, dict) and "data" in entry:
+            cache_stats["redis_hits"] += 1
+            keep_local(key, entry, len(data))
+            return entry
+
+    cache_stats["redis_misses"] += 1
     return None
 
 
-def set_redis(base, filter_param, data):
+def keep_local(key, entry, size):
+    ttl = entry["expires_at"] - time.time()
+    if local_cache_active() and ttl > 0:
+        local_cache.set(key, entry, size, ttl=ttl)
+
 
+def set_redis(base, filter_param, data, version=None, delta=0.0):
+    """
+    `version` is the data version read before `data` was computed, `delta` how long
+    computing it took (used for the early refresh). the key outlives its freshness
+    by CACHE_STALE_SECONDS so the entry can still be served while it is refreshed.
+    """
     r = authenticate_redis()
 
     key = get_redis_key(base, filter_param)
     if key:
+        entry = {
+            "data": data,
+            "version": version,
+            "expires_at": time.time() + CACHE_TTL,
+            "delta": delta,
+        }
+        payload = json.dumps(entry)
         try:
-            r.set(key, json.dumps(data), ex=5 * 60)  # expire in 5 minutes
+            r.set(key, payload, ex=CACHE_TTL + CACHE_STALE_SECONDS)
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Error in storing value in redis {str(e)}"
             )
+        keep_local(key, entry, len(payload))
+
+
+def should_refresh_early(entry, now: float) -> bool:
+    """
+    probabilistic early expiration ("XFetch"): the closer the entry is to expiring,
+    and the longer it took to compute, the more likely one request refreshes it
+    ahead of time, so hot keys rarely expire at all.
+    """
+    delta = entry.get("delta") or 0.0
+    if delta <= 0:
+        return False
+    # -log(u) is exponentially distributed, mostly small, sometimes large
+    early_by = -delta * EARLY_REFRESH_BETA * math.log(1.0 - random.random())
+    return now + early_by >= entry["expires_at"]
+
+
+def acquire_refresh_lock(key):
+    """
+    single flight: only the request holding the lock recomputes `key`. the lock expires
+    on its own if that request dies.
+    """
+    token = secrets.token_hex(8)
+    if authenticate_redis().set(f"lock:{key}", token, px=REFRESH_LOCK_MS, nx=True):
+        return token
+    return None
+
+
+def release_refresh_lock(key, token):
+    try:
+        authenticate_redis().eval(RELEASE_LOCK_LUA, 1, f"lock:{key}", token)
+    except Exception as e:
+        # it expires by itself
+        logger.warning("failed to release cache lock %s: %s", key, e)
+
+
+async def cached_listing(db: Session, user: models.User, filters: dict, version):
+    """
+    fresh entry -> served. expired (or picked for early refresh) -> the request that
+    gets the lock recomputes it while the others keep serving the stale entry. no entry
+    at all -> the others wait for the lock holder, then read its result.
+    """
+    filter_param = get_filter_param(**filters)
+    key = get_redis_key(user.id, filter_param)
+
+    for _ in range(REFRESH_WAIT_STEPS):
+        entry = get_redis(user.id, filter_param, version)
+        # computed from data older than the current version (a write raced the refresh)
+        if entry is not None and version is not None and entry["version"] != version:
+            entry = None
+
+        now = time.time()
+        if (
+            entry is not None
+            and now < entry["expires_at"]
+            and not should_refresh_early(entry, now)
+        ):
+            cache_stats["hits"] += 1
+            return entry["data"]
+
+        token = acquire_refresh_lock(key)
+        if token:
+            try:
+                cache_stats["refreshes"] += 1
+                start = time.perf_counter()
+                response_files = search_files(db, user, **filters)
+                set_redis(
+                    user.id,
+                    filter_param,
+                    response_files,
+                    version=version,
+                    delta=time.perf_counter() - start,
+                )
+                return response_files
+            finally:
+                release_refresh_lock(key, token)
+
+        if entry is not None:
+            cache_stats["stale"] += 1
+            return entry["data"]
+
+        cache_stats["waits"] += 1
+        await asyncio.sleep(REFRESH_WAIT_SECONDS)
+
+    # the lock holder is too slow, don't make the caller wait any longer
+    cache_stats["lock_timeouts"] += 1
+    return search_files(db, user, **filters)
 
 
 def delete_redis(base):
@@ -205,47 +452,441 @@ def delete_redis(base):
     pattern = f"{str(base)}:*"
     for key in r.scan_iter(pattern):
         r.delete(key)
+    invalidate_local(base)
+    bump_data_version(base)
+
+
+def delete_redis_folders(base, *paths):
+    """
+
+    Args:
+        base (): user.id
+        paths (): normalised folder paths whose content changed
+
+    evicts only the listings a change under `paths` can affect: every listing inside
+    those subtrees, the recursive listings of their ancestors, and the listings that are
+    not folder scoped ("all", plain filters). other folders stay cached.
+
+    """
+    r = authenticate_redis()
+
+    is_stale = stale_key_filter(base, paths)
+    stale = []
+    for key in r.scan_iter(f"{str(base)}:*"):
+        name = key.decode("utf-8") if isinstance(key, bytes) else key
+        if is_stale(name):
+            stale.append(key)
+    if stale:
+        r.delete(*stale)
+    invalidate_local(base, paths)
+    bump_data_version(base)
+
+
+def stale_key_filter(base, paths=None):
+    """
+    predicate for the cache keys of `base` that a change under `paths` makes stale
+    (all of them when there are no paths)
+    """
+    user_prefix = f"{str(base)}:"
+    if not paths:
+        return lambda name: name.startswith(user_prefix)
+
+    folder_prefix = f"{user_prefix}folder:"
+    stale_prefixes = tuple(f"{folder_prefix}{path}" for path in paths) + tuple(
+        f"{folder_prefix}{ancestor}:r:"
+        for path in paths
+        for ancestor in folder_ancestors(path)
+    )
+    return lambda name: name.startswith(user_prefix) and (
+        not name.startswith(folder_prefix) or name.startswith(stale_prefixes)
+    )
+
+
+def invalidate_local(base, paths=()):
+    """
+    evict from this worker's cache and tell the other workers to do the same
+    """
+    if not local_cache_active():
+        return
+    local_cache.delete_where(stale_key_filter(base, paths))
+    message = {"origin": WORKER_ID, "user": str(base), "paths": list(paths)}
+    try:
+        authenticate_redis().publish(INVALIDATION_CHANNEL, json.dumps(message))
+    except Exception as e:
+        # the other workers still drop their copy on the data version check
+        logger.warning("failed to broadcast cache invalidation: %s", e)
+
+
+def handle_invalidation(message):
+    payload = json.loads(message["data"])
+    if payload.get("origin") == WORKER_ID:
+        return
+    local_cache.delete_where(stale_key_filter(payload["user"], payload.get("paths")))
+
 
+def handle_listener_error(error, pubsub, thread):
+    # redis-py reconnects and subscribes again on the next get_message(). anything
+    # published meanwhile is lost, so start over with an empty cache.
+    logger.warning("cache invalidation listener lost its connection: %s", error)
+    local_cache.delete_where(lambda name: True)
+    time.sleep(1)
 
-def search_files(
-    db: Session,
-    user: models.User,
+
+def start_invalidation_listener():
+    """
+    called once per worker at startup. the local cache is only used while this
+    listener runs, a worker that can't hear invalidations must not keep copies.
+    """
+    global _invalidation_thread
+    if _invalidation_thread is not None or settings.l1_cache_max_bytes <= 0:
+        return
+    try:
+        pubsub = authenticate_redis().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: handle_invalidation})
+        _invalidation_thread = pubsub.run_in_thread(
+            sleep_time=1.0, daemon=True, exception_handler=handle_listener_error
+        )
+    except Exception as e:
+        logger.warning("local listing cache disabled, can't subscribe: %s", e)
+
+
+def stop_invalidation_listener():
+    global _invalidation_thread
+    if _invalidation_thread is None:
+        return
+    _invalidation_thread.stop()
+    _invalidation_thread = None
+    local_cache.delete_where(lambda name: True)
+
+
+def local_cache_active() -> bool:
+    return _invalidation_thread is not None
+
+
+def data_version_key(base):
+    # outside the `{user_id}:*` namespace, evicting the listings must not reset it
+    return f"ver:{str(base)}"
+
+
+def new_data_version():
+    # never reused (unlike a counter that restarts when its key expires), so an old
+    # ETag can not match again
+    return f"{time.time_ns():x}{secrets.token_hex(4)}"
+
+
+def bump_data_version(base):
+    """
+    called after every change of the user's files/folders, once the stale listings
+    are evicted (a listing cached under the new version is then always fresh)
+    """
+    r = authenticate_redis()
+    r.set(data_version_key(base), new_data_version(), ex=DATA_VERSION_TTL)
+
+
+def get_data_version(base) -> str:
+    r = authenticate_redis()
+    key = data_version_key(base)
+    version = r.get(key)
+    if version is None:
+        # first read (or expired): whoever sets it first wins
+        r.set(key, new_data_version(), ex=DATA_VERSION_TTL, nx=True)
+        version = r.get(key)
+    return version.decode("utf-8") if isinstance(version, bytes) else version
+
+
+def listing_etag(version: str, request: Request, now: float | None = None) -> str:
+    """
+    strong ETag of a listing: the user's data version + the query string (sorted, so
+    the parameter order does not matter) + the current LISTING_ETAG_SECONDS period,
+    the body holds signed urls that expire
+    """
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    period = int((time.time() if now is None else now) // LISTING_ETAG_SECONDS)
+    digest = hashlib.sha256(f"{version}?{query}@{period}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, as If-None-Match requires
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+async def listing_etag_middleware(request: Request, call_next):
+    """
+    answers a conditional GET /user/files with 304 from one Redis GET (the data
+    version), before the auth dependency loads the user from Postgres. a valid signed
+    token is enough here, a 304 carries no data.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    token = request.cookies.get("access_token")
+    if (
+        request.method != "GET"
+        or request.url.path.rstrip("/") != "/user/files"
+        or not if_none_match
+        or not token
+    ):
+        return await call_next(request)
+
+    try:
+        payload = jwt.decode(token, settings.secret_key, settings.algorithm)
+        version = await run_in_threadpool(
+            authenticate_redis().get, data_version_key(payload.get("user_id"))
+        )
+    except jwt.InvalidTokenError:
+        # let the route reject it
+        return await call_next(request)
+    except Exception as e:
+        logger.warning("data version lookup failed, serving the full listing: %s", e)
+        return await call_next(request)
+
+    if version is not None:
+        if isinstance(version, bytes):
+            version = version.decode("utf-8")
+        etag = listing_etag(version, request)
+        if etag_matches(etag, if_none_match):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL},
+            )
+    return await call_next(request)
+
+
+def normalize_folder_path(path: str | None) -> str:
+    """
+    "docs/2024", "/docs//2024/" -> "/docs/2024/"; None or "" -> "/" (root)
+    """
+    segments = [segment.strip() for segment in (path or "").split("/")]
+    segments = [segment for segment in segments if segment]
+    if any(segment in (".", "..") for segment in segments):
+        raise HTTPException(status_code=400, detail=f"invalid folder path {path}")
+    return "/" + "".join(f"{segment}/" for segment in segments)
+
+
+def folder_depth(path: str) -> int:
+    return path.count("/") - 1
+
+
+def parent_folder(path: str) -> str:
+    return path[: path.rstrip("/").rfind("/") + 1] if path != "/" else "/"
+
+
+def folder_ancestors(path: str) -> list[str]:
+    """
+    "/a/b/" -> ["/", "/a/"]
+    """
+    ancestors = []
+    while path != "/":
+        path = parent_folder(path)
+        ancestors.append(path)
+    return ancestors[::-1]
+
+
+def like_prefix(prefix: str) -> str:
+    """
+    LIKE pattern for "starts with prefix". escapes with backslash, postgres' default
+    LIKE escape, because an explicit ESCAPE clause stops the planner from using the
+    text_pattern_ops index.
+    """
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+SORT_COLUMNS = {
+    "uploaded_at": models.File.uploaded_at,
+    "size": models.File.size,
+    "filename": models.File.filename,
+}
+
+DEFAULT_SORT_BY = "uploaded_at"
+# relevance of a content search, only with q
+RANK = "rank"
+DEFAULT_ORDER = "desc"
+
+
+def _to_naive_utc(value: datetime | None):
+    # file.uploaded_at is a naive UTC timestamp; a naive filter value is taken as UTC
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def normalize_filters(
     filename: str | None = None,
     file_extension: str | None = None,
     content_type: str | None = None,
-) -> list:
+    min_size: int | None = None,
+    max_size: int | None = None,
+    uploaded_after: datetime | None = None,
+    uploaded_before: datetime | None = None,
+    folder: str | None = None,
+    recursive: bool = False,
+    q: str | None = None,
+    sort_by: str = DEFAULT_SORT_BY,
+    order: str = DEFAULT_ORDER,
+) -> dict:
+    """
+    canonical form of the listing filters, used for both the query and the cache key,
+    so equivalent requests ("pdf" / ".pdf", "+01:00" / UTC, unset / default sort) share
+    one cache entry and one result.
+    """
+    filename = filename.strip() if filename else None
+    file_extension = file_extension.strip() if file_extension else None
+    if file_extension and not file_extension.startswith("."):
+        file_extension = f".{file_extension}"
+    content_type = content_type.strip() if content_type else None
+
+    filters = {
+        "filename": filename or None,
+        "file_extension": file_extension or None,
+        "content_type": content_type or None,
+        "min_size": min_size,
+        "max_size": max_size,
+        "uploaded_after": _to_naive_utc(uploaded_after),
+        "uploaded_before": _to_naive_utc(uploaded_before),
+        "folder": normalize_folder_path(folder) if folder is not None else None,
+        # only meaningful inside a folder, and only stored when set
+        "recursive": True if folder is not None and recursive else None,
+        "q": normalize_query(q),
+    }
+    filters = {key: value for key, value in filters.items() if value is not None}
+    filters["sort_by"] = sort_by
+    filters["order"] = order
+    return filters
+
+
+def build_files_query(
+    owner_id,
+    filename: str | None = None,
+    file_extension: str | None = None,
+    content_type: str | None = None,
+    min_size: int | None = None,
+    max_size: int | None = None,
+    uploaded_after: datetime | None = None,
+    uploaded_before: datetime | None = None,
+    folder: str | None = None,
+    recursive: bool = False,
+    q: str | None = None,
+    sort_by: str = DEFAULT_SORT_BY,
+    order: str = DEFAULT_ORDER,
+):
+    """
+    the listing query. owner_id always comes first: Postgres only reads the owner's
+    partition of file, and the owner-leading indexes on models.File apply (see
+    benchmarks/query_plans.py):
+    (owner_id, uploaded_at, id) serves date ranges and the default sort,
+    (owner_id, size, id) serves size ranges and the size sort,
+    (owner_id, folder_path) serves a folder (equality) or its subtree (prefix).
+
+    with q it is a content search: the GIN index on file_content finds the matches, and
+    the query selects (File, rank, snippet) rows, at most MAX_SEARCH_RESULTS of them.
+    """
+    # the partial indexes only cover live rows, this predicate lets the planner use them
+    filters = [models.File.owner_id == owner_id, models.File.deleted_at.is_(None)]
+
+    if filename:
+        filters.append(models.File.filename.ilike(f"%{filename}%"))
+    if file_extension:
+        filters.append(models.File.file_extension == file_extension)
+    if content_type:
+        filters.append(models.File.content_type == content_type)
+    if min_size is not None:
+        filters.append(models.File.size >= min_size)
+    if max_size is not None:
+        filters.append(models.File.size <= max_size)
+    if uploaded_after is not None:
+        filters.append(models.File.uploaded_at >= uploaded_after)
+    if uploaded_before is not None:
+        filters.append(models.File.uploaded_at < uploaded_before)
+    if folder is not None:
+        if not recursive:
+            filters.append(models.File.folder_path == folder)
+        elif folder != "/":
+            filters.append(models.File.folder_path.like(like_prefix(folder)))
+
+    if q:
+        query = to_tsquery(q)
+        rank = func.ts_rank_cd(models.FileContent.search_vector, query)
+        filters.append(models.FileContent.search_vector.op("@@")(query))
+
+    # id breaks ties, so the order is stable and matches the index
+    sort_column = rank if sort_by == RANK else SORT_COLUMNS[sort_by]
+    if order == "desc":
+        order_by = (sort_column.desc(), models.File.id.desc())
+    else:
+        order_by = (sort_column.asc(), models.File.id.asc())
+
+    if not q:
+        return select(models.File).where(*filters).order_by(*order_by)
+
+    # Postgres evaluates the (costly) ts_headline after the sort and the limit, only
+    # for the rows returned
+    return (
+        select(
+            models.File,
+            rank.label("rank"),
+            headline(models.FileContent.document, query).label("snippet"),
+        )
+        .join(
+            models.FileContent,
+            and_(
+                models.FileContent.file_id == models.File.id,
+                # the whole key of file: the join stays in the owner's partition
+                models.FileContent.owner_id == models.File.owner_id,
+            ),
+        )
+        .where(*filters)
+        .order_by(*order_by)
+        .limit(MAX_SEARCH_RESULTS)
+    )
+
+
+def file_data(file: models.File) -> dict:
+    """
+    one file of a listing (GET /user/files, GET /user/files/changes)
+    """
+    access_url = get_storage().sign_url(file.storage_path, expires=ACCESS_URL_SECONDS)
+
+    return {
+        "id": str(file.id),
+        "filename": file.filename,
+        "uploaded_at": str(file.uploaded_at),
+        "updated_at": str(file.updated_at),
+        "size": file.size,
+        "access_url": access_url,
+        "content_type": file.content_type,
+        "folder_path": file.folder_path,
+        "expires_at": str(file.expires_at) if file.expires_at else None,
+    }
+
+
+def search_files(db: Session, user: models.User, **filters) -> list:
+    """
+    filters: keyword arguments of build_files_query (see normalize_filters)
+    """
 
     response_files = []
 
     try:
-        filters = [models.File.owner_id == user.id]
-
-        if filename:
-            filters.append(models.File.filename.ilike("%{filename}%"))
-        if file_extension:
-            filters.append(models.File.file_extension == file_extension)
-        if content_type:
-            filters.append(models.File.content_type == content_type)
         try:
-            stmt = select(models.File).where(*filters)
+            stmt = build_files_query(user.id, **filters)
             result = db.execute(stmt)
-            user_files = result.scalars().all()
-            response_files = []
-            for file in user_files:
-                access_url = create_presigned_url(
-                    S3_BUCKET_NAME, file.storage_path, expiration=3600
-                )
-
-                file_data = {
-                    "id": str(file.id),
-                    "filename": file.filename,
-                    "uploaded_at": str(file.uploaded_at),
-                    "updated_at": str(file.updated_at),
-                    "size": file.size,
-                    "access_url": access_url,
-                    "content_type": file.content_type,
-                }
-                response_files.append(file_data)
+            if filters.get("q"):
+                response_files = [
+                    {
+                        **file_data(row.File),
+                        "rank": row.rank,
+                        "snippet": snippet_html(row.snippet),
+                    }
+                    for row in result
+                ]
+            else:
+                user_files = result.scalars().all()
+                response_files = [file_data(file) for file in user_files]
         except Exception as e:
             raise HTTPException(
                 status_code=500,
@@ -259,46 +900,39 @@ def search_files(
     return response_files
 
 
-def get_filter_param(
-    filename: str | None = None,
-    file_extension: str | None = None,
-    content_type: str | None = None,
-):
+def get_filter_param(**filters):
+    """
+    filters: output of normalize_filters (or nothing)
 
-    filter_param = None
+    Returns:
+        "all" for the unfiltered listing in the default order, otherwise a
+        canonical JSON string (sorted keys, ISO dates) of the filters
+    """
+    # normalize_filters is idempotent, already normalised filters pass through unchanged
+    filters = normalize_filters(**filters)
 
-    if not filename and not content_type and not file_extension:
-        filter_param = "all"
-    else:
-        query_param = {
-            "filename": filename,
-            "content_type": content_type,
-            "file_extension": file_extension,
-        }
-        filter_param = json.dumps(query_param)
+    query_param = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in filters.items()
+    }
+    if query_param == {"sort_by": DEFAULT_SORT_BY, "order": DEFAULT_ORDER}:
+        return "all"
 
-    return filter_param
+    return json.dumps(query_param, sort_keys=True, separators=(",", ":"))
 
 
-def upload_to_s3(file_bytes, content_type, s3_object_key: str, filename):
+def store_objects(items: list[tuple[str, bytes, str | None]]):
+    """
+    items: (storage key, content, content type) of the files whose rows are committed
+    """
     try:
-        s3_client.upload_fileobj(
-            io.BytesIO(file_bytes),  # The file-like object from UploadFile
-            S3_BUCKET_NAME,  # Your bucket name
-            s3_object_key,  # The unique key (path) in S3
-            ExtraArgs={  # Optional: Set metadata like ContentType
-                "ContentType": content_type
-            },
-        )
-    except ClientError as e:
-        logger.error(f"s3 upload error {filename}: {e}")
-        raise HTTPException(
-            status_code=500, detail=f"failed to upload {filename} to S3"
-        )
+        get_storage().put_many(items)
     except Exception as e:
-        logger.error(f"failed to process the file {filename}: {e}")
-        raise HTTPException(
-            status_code=400, detail=f"failed to process the file {filename}"
+        logger.error(
+            "failed to store %d uploaded files (%s): %s",
+            len(items),
+            ", ".join(key for key, _, _ in items),
+            e,
         )
 
 
@@ -307,65 +941,568 @@ async def check_redis(request: Request):
     try:
         logger.info("inside-parameter-function")
         r = authenticate_redis()
-        logger.info(f"Redis instance: {r}")
+        logger.info("Redis instance: %s", r)
         r.set("test", "test-successfull")
         return {r.get("test")}
     except Exception as e:
-        logger.error(f"Error in /check-redis: {e}")
+        logger.error("Error in /check-redis: %s", e)
         raise HTTPException(status_code=500, detail="Error in check-redis endpoint.")
 
 
 @router.get("/files", response_model=List[UserFiles], status_code=status.HTTP_200_OK)
 async def get_files(
     request: Request,
+    response: Response,
     filename: str | None = None,
     content_type: str | None = None,
     file_extension: str | None = None,
+    min_size: int | None = Query(default=None, ge=0),
+    max_size: int | None = Query(default=None, ge=0),
+    uploaded_after: datetime | None = None,
+    uploaded_before: datetime | None = None,
+    folder: str | None = None,
+    recursive: bool = False,
+    q: str | None = Query(default=None, max_length=MAX_QUERY_LENGTH),
+    sort_by: Literal["uploaded_at", "size", "filename", "rank"] | None = None,
+    order: Literal["asc", "desc"] = DEFAULT_ORDER,
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    q = normalize_query(q)
+    # a content search is sorted by relevance unless asked otherwise
+    sort_by = sort_by or (RANK if q else DEFAULT_SORT_BY)
+    if sort_by == RANK and not q:
+        raise HTTPException(status_code=400, detail="sort_by=rank needs q")
+    if min_size is not None and max_size is not None and min_size > max_size:
+        raise HTTPException(
+            status_code=400, detail="min_size can not be greater than max_size"
+        )
+
+    filters = normalize_filters(
+        filename=filename,
+        file_extension=file_extension,
+        content_type=content_type,
+        min_size=min_size,
+        max_size=max_size,
+        uploaded_after=uploaded_after,
+        uploaded_before=uploaded_before,
+        folder=folder,
+        recursive=recursive,
+        q=q,
+        sort_by=sort_by,
+        order=order,
+    )
+    # compared once both are naive UTC, a bound with an offset and one without are
+    # not comparable as given
+    after, before = filters.get("uploaded_after"), filters.get("uploaded_before")
+    if after and before and after >= before:
+        raise HTTPException(
+            status_code=400, detail="uploaded_after must be before uploaded_before"
+        )
+
+    # read before the data: a write in between only makes the ETag older than the
+    # listing, so the next request gets a 200 again instead of a stale 304
+    try:
+        version = get_data_version(user.id)
+        etag = listing_etag(version, request)
+    except Exception as e:
+        logger.warning("data version lookup failed, listing sent without ETag: %s", e)
+        version = etag = None
+    if etag:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = LISTING_CACHE_CONTROL
+        if etag_matches(etag, request.headers.get("If-None-Match")):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers)
+            )
+
+    return await cached_listing(db, user, filters, version)
+
+
+@router.get("/files/changes", response_model=FileChanges)
+async def get_file_changes(
+    since: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=500, ge=1, le=MAX_CHANGES_PAGE),
+    # the primary: a cursor it handed out may be ahead of a replica
     db: Session = Depends(get_db),
     user: models.User = Depends(get_current_user_from_cookie),
 ):
+    """
+    what changed in the files since the cursor `since`, oldest first, the latest
+    change of each file only. without `since` (first sync) or when the entries after
+    it have been compacted away, resync_required is set with the current cursor.
+    """
+    rows = []
+    if since is not None:
+        rows = db.execute(
+            select(models.FileChange.seq, models.FileChange.file_id, models.FileChange.op)
+            .where(models.FileChange.owner_id == user.id, models.FileChange.seq > since)
+            .order_by(models.FileChange.seq)
+            .limit(limit + 1)
+        ).all()
+    # after the entries: a compaction in between shows up as a higher floor
+    last_seq, floor = db.execute(
+        select(models.User.change_seq, models.User.change_floor).where(
+            models.User.id == user.id
+        )
+    ).one()
+    if since is None or since < floor or since > last_seq:
+        return FileChanges(cursor=last_seq, has_more=False, resync_required=True)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for row in rows:
+        latest.pop(row.file_id, None)
+        latest[row.file_id] = row
+    files = {}
+    if latest:
+        files = {
+            file.id: file
+            for file in db.scalars(
+                select(models.File).where(
+                    models.File.owner_id == user.id,
+                    models.File.id == any_id(latest),
+                    models.File.deleted_at.is_(None),
+                )
+            )
+        }
 
-    filter_param = get_filter_param(filename, file_extension, content_type)
+    changes = []
+    for row in latest.values():
+        file = files.get(row.file_id)
+        changes.append(
+            FileChangeEntry(
+                seq=row.seq,
+                # gone by now, whatever this entry says (a later page has the delete)
+                op=row.op if file is not None else DELETE,
+                file_id=row.file_id,
+                file=file_data(file) if file is not None else None,
+            )
+        )
+    return FileChanges(
+        cursor=rows[-1].seq if rows else since, has_more=has_more, changes=changes
+    )
 
-    if not get_redis(user.id, filter_param):
-        response_files = search_files(db, user, filename, file_extension, content_type)
-        if response_files:
-            set_redis(user.id, filter_param, response_files)
-        return response_files
 
-    else:
-        list_of_files = get_redis(user.id, filter_param)
-        return list_of_files
+@router.get("/files/archive", status_code=status.HTTP_200_OK)
+async def download_archive(
+    background_tasks: BackgroundTasks,
+    ids: List[UUID] | None = Query(default=None),
+    filename: str | None = None,
+    content_type: str | None = None,
+    file_extension: str | None = None,
+    folder: str | None = None,
+    recursive: bool = True,
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    one zip of the selected files (`ids`, or the same filters as GET /user/files; a
+    folder is taken with its subtree unless recursive=false), streamed while it is
+    built. paths inside the archive are relative to `folder`.
+    """
+    filters = normalize_filters(
+        filename=filename,
+        file_extension=file_extension,
+        content_type=content_type,
+        folder=folder,
+        recursive=recursive,
+        sort_by="filename",
+        order="asc",
+    )
+    query = build_files_query(user.id, **filters)
+    if ids:
+        query = query.where(models.File.id == any_id(ids))
+    files = db.scalars(query.limit(MAX_ARCHIVE_FILES + 1)).all()
+    if len(files) > MAX_ARCHIVE_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"an archive can hold at most {MAX_ARCHIVE_FILES} files",
+        )
+    if ids and len(files) != len(set(ids)):
+        raise HTTPException(status_code=404, detail="some of the files were not found")
+
+    # normalize_filters leaves out the unset filters
+    base = filters.get("folder") or "/"
+    names = archive_names(
+        f"{file.folder_path}{file.filename or 'untitled'}"[len(base) :]
+        for file in files
+    )
+    entries = [
+        ArchiveEntry(
+            name=name, key=file.storage_path, size=file.size, modified_at=file.updated_at
+        )
+        for name, file in zip(names, files)
+    ]
+
+    # after the response, Redis is not on the event loop
+    accessed = [(user.id, entry.key) for entry in entries]
+    background_tasks.add_task(record_access, accessed)
+
+    archive_name = quote(base.strip("/").rsplit("/", 1)[-1] or "files")
+    return StreamingResponse(
+        stream_zip(
+            entries, lambda key, chunk_size: get_storage().get(key, chunk_size=chunk_size)
+        ),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{archive_name}.zip"
+        },
+    )
 
 
 @router.delete("/files", status_code=status.HTTP_200_OK)
 async def delete_files(
     request: Request,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     user: models.User = Depends(get_current_user_from_cookie),
 ):
+    """
+    moves every file to the trash: one UPDATE, the rows and objects are purged later.
+    owner scoped, it only touches the owner's partition of file. share links stop
+    working through one owner marker, not one per file
+    """
+    now = models._utcnow()
     try:
-        user_files = db.scalars(
-            select(models.File).where(models.File.owner_id == user.id)
+        file_ids = db.scalars(
+            update(models.File)
+            .where(models.File.owner_id == user.id, models.File.deleted_at.is_(None))
+            .values(deleted_at=now)
+            .returning(models.File.id)
+            .execution_options(synchronize_session=False)
         ).all()
+        record_changes(db, user.id, file_ids, DELETE)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"fail to delete files {str(e)}")
+
+    await write_delete_markers(db, mark_owner_deleted, user.id, now)
 
-        db.execute(delete(models.File).where(models.File.owner_id == user.id))
+    try:
         db.commit()
+        mark_user_write(user.id)
 
         delete_redis(user.id)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"fail to delete files {str(e)}")
+
+    msg = {"message": "All your files have been deleted successfully."}
+    return JSONResponse(content=msg)
+
+
+def trash_cutoff() -> datetime:
+    # files deleted before this are past the retention window
+    return models._utcnow() - timedelta(seconds=settings.trash_retention_seconds)
+
+
+def expires_at(now: datetime, expires_in: int | None) -> datetime | None:
+    return now + timedelta(seconds=expires_in) if expires_in else None
+
+
+async def write_delete_markers(db: Session, mark, *args):
+    """
+    share markers of a delete (share_markers.py), written before its commit: once the
+    files or the account are gone the request can't be repeated (404, 401), so a lost
+    write must not leave them committed. on failure the transaction is rolled back and
+    the request fails with 503, nothing changed. a commit that fails after the write
+    leaves links refused, never deleted files shareable.
+    """
+    try:
+        await run_in_threadpool(mark, *args)
+    except ShareMarkerError:
+        db.rollback()
+        raise HTTPException(
+            status_code=503,
+            detail="share links could not be updated, nothing was deleted: "
+            "please retry",
+        )
+
+
+class TrashedFile(BaseModel):
+    id: UUID
+    filename: str | None
+    folder_path: str
+    size: int
+    deleted_at: datetime
+    purge_at: datetime
+
+
+class FileRestore(BaseModel):
+    ids: List[UUID] = Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+
+@router.get("/files/trash", response_model=List[TrashedFile])
+async def list_trash(
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: Session = Depends(get_read_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    deleted files that can still be restored, most recently deleted first
+    """
+    retention = timedelta(seconds=settings.trash_retention_seconds)
+    files = db.execute(
+        select(
+            models.File.id,
+            models.File.filename,
+            models.File.folder_path,
+            models.File.size,
+            models.File.deleted_at,
+        )
+        .where(
+            models.File.owner_id == user.id,
+            models.File.deleted_at.is_not(None),
+            models.File.deleted_at >= trash_cutoff(),
+        )
+        .order_by(models.File.deleted_at.desc())
+        .limit(limit)
+    ).all()
+    return [
+        TrashedFile(**file._asdict(), purge_at=file.deleted_at + retention)
+        for file in files
+    ]
+
+
+@router.post("/files/restore", status_code=status.HTTP_200_OK)
+async def restore_files(
+    restore: FileRestore,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    takes files out of the trash, all of them or none. folders deleted since are
+    created again.
+    """
+    ids = set(restore.ids)
+    try:
+        restored = db.execute(
+            update(models.File)
+            .where(
+                models.File.owner_id == user.id,
+                models.File.id == any_id(ids),
+                models.File.deleted_at.is_not(None),
+                models.File.deleted_at >= trash_cutoff(),
+            )
+            .values(deleted_at=None, updated_at=models._utcnow())
+            .returning(models.File.id, models.File.folder_path)
+            .execution_options(synchronize_session=False)
+        ).all()
+        missing = ids - {file.id for file in restored}
+        if missing:
+            db.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail="not in the trash: " + ", ".join(sorted(map(str, missing))),
+            )
+
+        folders = {file.folder_path for file in restored}
+        paths = {
+            path
+            for folder in folders
+            for path in folder_ancestors(folder) + [folder]
+            if path != "/"
+        }
+        if paths:
+            db.execute(
+                pg_insert(models.Folder)
+                .values(
+                    [
+                        {
+                            "id": uuid.uuid4(),
+                            "path": path,
+                            "depth": folder_depth(path),
+                            "created_at": models._utcnow(),
+                            "owner_id": user.id,
+                        }
+                        for path in sorted(paths)
+                    ]
+                )
+                .on_conflict_do_nothing()
+            )
+        record_changes(db, user.id, [file.id for file in restored], INSERT)
+        db.commit()
+        mark_user_write(user.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error("failed to restore %d files: %s", len(ids), e)
+        raise HTTPException(status_code=500, detail="failed to restore the files")
+
+    delete_redis_folders(user.id, *folders)
+    try:
+        await run_in_threadpool(mark_files_deleted, ids, False)
+    except ShareMarkerError:
+        # fails closed: the files are restored, their links stay refused (logged)
+        pass
+
+    return JSONResponse(content={"message": f"{len(restored)} files restored."})
+
+
+def any_id(ids):
+    """
+    `= ANY(:ids)`: the whole list is one array parameter, so the statement is the same
+    whatever the number of ids
+    """
+    # rendered as `:ids::UUID[]`
+    return any_(literal(list(ids), ARRAY(PG_UUID(as_uuid=True))))
+
+
+def update_from_values(owner_id, name: str, columns: list[str], rows, casts=None):
+    """
+    UPDATE file SET <col> = v.<col>, ... FROM (VALUES (id, ...), ...) AS v (id, ...)
+    WHERE file.id = v.id AND file.owner_id = :owner_id
+
+    the values are sent as strings, `casts` maps the columns of another type to it
+    (a VALUES column of NULLs only would be text)
+    """
+    casts = casts or {}
+    data = values(
+        column("id", PG_UUID(as_uuid=True)),
+        *(column(col, String) for col in columns),
+        name=name,
+    ).data(rows)
+    return (
+        update(models.File)
+        .where(
+            models.File.id == data.c.id,
+            models.File.owner_id == owner_id,
+            models.File.deleted_at.is_(None),
+        )
+        .values(
+            **{
+                col: cast(data.c[col], casts[col]) if col in casts else data.c[col]
+                for col in columns
+            },
+            updated_at=models._utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+@router.post(
+    "/files/batch", response_model=FileBatchResult, status_code=status.HTTP_200_OK
+)
+async def batch_files(
+    batch: FileBatch,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user_from_cookie),
+):
+    """
+    delete (to the trash) / rename / retag / expire many files in one transaction: all of them
+    or none. one statement per kind of operation, whatever the number of files, then
+    one cache invalidation.
+    """
+    ids = [operation.id for operation in batch.operations]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=400, detail="each file can only appear once in a batch"
+        )
+
+    # ownership check, and the folders whose listings change
+    folders = dict(
+        db.execute(
+            select(models.File.id, models.File.folder_path).where(
+                models.File.owner_id == user.id,
+                models.File.id == any_id(ids),
+                models.File.deleted_at.is_(None),
+            )
+        ).all()
+    )
+    missing = [str(file_id) for file_id in ids if file_id not in folders]
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"files not found: {', '.join(missing)}"
+        )
 
-        for file in user_files:
-            background_tasks.add_task(delete_s3_object, file.storage_path)
+    to_delete = [op.id for op in batch.operations if op.op == "delete"]
+    renames = [
+        (op.id, op.filename, os.path.splitext(op.filename)[1] or None)
+        for op in batch.operations
+        if op.op == "rename"
+    ]
+    retags = [(op.id, op.content_type) for op in batch.operations if op.op == "retag"]
+    now = models._utcnow()
+    expiries = [
+        (op.id, expires_at(now, op.expires_in))
+        for op in batch.operations
+        if op.op == "expire"
+    ]
+
+    deleted = []
+    try:
+        if to_delete:
+            # to the trash, purge.py removes the rows and objects later
+            deleted = db.scalars(
+                update(models.File)
+                .where(
+                    models.File.owner_id == user.id,
+                    models.File.id == any_id(to_delete),
+                    models.File.deleted_at.is_(None),
+                )
+                .values(deleted_at=models._utcnow())
+                .returning(models.File.id)
+                .execution_options(synchronize_session=False)
+            ).all()
+        updated = set()
+        if renames:
+            updated.update(
+                db.scalars(
+                    update_from_values(
+                        user.id, "renames", ["filename", "file_extension"], renames
+                    ).returning(models.File.id)
+                )
+            )
+        if retags:
+            updated.update(
+                db.scalars(
+                    update_from_values(
+                        user.id, "retags", ["content_type"], retags
+                    ).returning(models.File.id)
+                )
+            )
+        if expiries:
+            updated.update(
+                db.scalars(
+                    update_from_values(
+                        user.id,
+                        "expiries",
+                        ["expires_at"],
+                        [
+                            (file_id, str(value) if value else None)
+                            for file_id, value in expiries
+                        ],
+                        casts={"expires_at": DateTime()},
+                    ).returning(models.File.id)
+                )
+            )
+        record_changes(db, user.id, deleted, DELETE)
+        record_changes(db, user.id, updated, UPDATE)
+    except Exception as e:
+        db.rollback()
+        logger.error("batch of %d file operations failed: %s", len(ids), e)
+        raise HTTPException(status_code=500, detail="failed to apply the batch")
 
-        msg = {"message": "All your files have been deleted successfully."}
-        return JSONResponse(content=msg)
+    await write_delete_markers(db, mark_files_deleted, deleted)
 
+    try:
+        db.commit()
+        mark_user_write(user.id)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"fail to delete files {str(e)}")
+        db.rollback()
+        logger.error("batch of %d file operations failed: %s", len(ids), e)
+        raise HTTPException(status_code=500, detail="failed to apply the batch")
 
+    delete_redis_folders(user.id, *set(folders.values()))
 
-# TODO: set a max limit for excepting the file
+    return FileBatchResult(
+        deleted=len(deleted),
+        renamed=len(renames),
+        retagged=len(retags),
+        expiry_updated=len(expiries),
+    )
 
 
 @router.post(
@@ -375,10 +1512,44 @@ async def upload_user_files(
     request: Request,
     background_tasks: BackgroundTasks,
     files: List[UploadFile],  # NOTE: key : files, value = actual file
+    folder: str = Form(default="/"),
+    # temporary upload: seconds until expiry.py deletes the files
+    expires_in: int | None = Form(
+        default=None, ge=1, le=settings.file_expiry_max_seconds
+    ),
     db: Session = Depends(get_db),
     user=Depends(get_current_user_from_cookie),
 ):
+    # the total size is enforced while the body streams (admission.py)
+    if len(files) > settings.upload_max_files:
+        raise HTTPException(
+            status_code=413,
+            detail=f"at most {settings.upload_max_files} files can be uploaded at once",
+        )
+    too_large = [
+        file.filename
+        for file in files
+        if (file.size or 0) > settings.upload_max_file_bytes
+    ]
+    if too_large:
+        raise HTTPException(
+            status_code=413,
+            detail=f"files over {settings.upload_max_file_bytes} bytes: "
+            + ", ".join(name or "untitled" for name in too_large),
+        )
+
+    folder = normalize_folder_path(folder)
+    if folder != "/" and not db.scalar(
+        select(models.Folder.id).where(
+            models.Folder.owner_id == user.id, models.Folder.path == folder
+        )
+    ):
+        raise HTTPException(status_code=404, detail=f"folder {folder} does not exist")
+
+    file_expires_at = expires_at(models._utcnow(), expires_in)
     uploaded_files_details = []
+    # written once their rows are committed, a failed insert leaves nothing to clean up
+    stored = []
     for file in files:
 
         # build bucket key (user_id/uuid<.ext>)
@@ -392,16 +1563,10 @@ async def upload_user_files(
         file_bytes = (
             await file.read()
         )  # read the file before you add to the background task
-        background_tasks.add_task(
-            upload_to_s3, file_bytes, file.content_type, s3_object_key, file.filename
-        )
 
-        # --- 3. Construct the S3 URL (Optional but useful) ---
         # Note: This URL might not be publicly accessible unless bucket/object ACLs allow it,
         # or you generate pre-signed URLs later for access.
-        s3_url = (
-            f"https://{S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_object_key}"
-        )
+        s3_url = get_storage().object_url(s3_object_key)
 
         try:
             db_file = models.File(
@@ -410,22 +1575,29 @@ async def upload_user_files(
                 storage_path=s3_object_key,
                 s3_url=s3_url,
                 content_type=file.content_type,
+                folder_path=folder,
+                expires_at=file_expires_at,
                 owner_id=user.id,
-                owner=user,
             )
 
             if file_extension:
                 db_file.file_extension = file_extension
 
             db.add(db_file)
+            db.flush()
+            if extractor(file.content_type, file_extension):
+                # queued for indexer.py, which reads the text once the object is stored
+                db.add(
+                    models.FileContent(
+                        file_id=db_file.id, owner_id=user.id, status=PENDING
+                    )
+                )
+            record_changes(db, user.id, [db_file.id], INSERT)
             db.commit()
             db.refresh(db_file)
-            user_files = search_files(db, user)
-            filter_param = get_filter_param()
-            set_redis(user.id, filter_param, user_files)
-
-            # TODO: add a method to update the redis instance todo-2
-            delete_redis(user.id)
+            mark_user_write(user.id)
+            delete_redis_folders(user.id, folder)
+            stored.append((s3_object_key, file_bytes, file.content_type))
 
             response_object = UserFileDetail(
                 filename=file.filename,
@@ -434,21 +1606,25 @@ async def upload_user_files(
                 size=file.size,
                 s3_url=s3_url,
                 content_type=file.content_type,
+                folder_path=folder,
+                expires_at=file_expires_at,
             )
             uploaded_files_details.append(response_object)
 
         except Exception as e:
-            logger.error(f"database upload error {file.filename}: {e}")
+            logger.error("database upload error %s: %s", file.filename, e)
             db.rollback()
-            try:
-                s3_client.delete_object(Bucket=S3_BUCKET_NAME, key=s3_object_key)
-            except Exception as delete_error:
-                logger.error(f"failed to delete orphaned s3 file: {delete_error}")
+            # background tasks don't run after an error, store the files saved so far
+            if stored:
+                await run_in_threadpool(store_objects, stored)
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to save the metadata of file {file.filename}",
             )
 
+    # one batch for the whole request (the local backend syncs each directory once)
+    background_tasks.add_task(store_objects, stored)
+
     return uploaded_files_details
 
 
@@ -459,21 +1635,45 @@ async def deleteUser(
 ):
     try:
         user_id = user.id
-        db.delete(user)
-        db.commit()
+        # tombstones only: two UPDATEs whatever the number of files. purge.py deletes
+        # the files, folders and the user row after the retention window
+        now = models._utcnow()
+        db.execute(
+            update(models.File)
+            .where(models.File.owner_id == user_id, models.File.deleted_at.is_(None))
+            .values(deleted_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(deleted_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=500, detail=f"failed to delete the user instance {str(e)}"
+        )
 
-        delete_redis(user_id)
+    # before the commit: afterwards the cookie no longer authenticates a retry
+    await write_delete_markers(db, mark_owner_deleted, user_id, now)
 
-        # NOTE: now delete the access token also
-        msg = {
-            "message": "Your account and all files have been deleted successfully. We're sorry to see you go!"
-        }
-        response = JSONResponse(content=msg)
-        response.delete_cookie(key="access_token")
-        return response
+    try:
+        db.commit()
+        mark_user_write(user_id)
 
+        delete_redis(user_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=500, detail=f"failed to delete the user instance {str(e)}"
         )
+
+    # NOTE: now delete the access token also
+    msg = {
+        "message": "Your account and all files have been deleted successfully. We're sorry to see you go!"
+    }
+    response = JSONResponse(content=msg)
+    response.delete_cookie(key="access_token")
+    return response
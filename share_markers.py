@@ -0,0 +1,99 @@
+import time
+from datetime import datetime, timezone
+from typing import Callable
+from config import get_settings
+from dependecies import get_redis_client
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+# share links resolve without the database (routers/shares.py), they check these keys
+# to stop serving deleted files. writes are retried this many times, then fail
+SHARE_MARKER_ATTEMPTS = 3
+SHARE_MARKER_BACKOFF_SECONDS = 0.05
+
+
+class ShareMarkerError(Exception):
+    """the markers were not written: the files they cover may still be shareable"""
+
+
+def deleted_file_key(file_id) -> str:
+    return f"deleted:{file_id}"
+
+
+def deleted_owner_key(owner_id) -> str:
+    # every file of the owner was deleted at this time (DELETE /user/files, account)
+    return f"deleted:owner:{owner_id}"
+
+
+def restored_file_key(file_id) -> str:
+    # restored at this time, after (and despite) an older deleted_owner_key
+    return f"restored:{file_id}"
+
+
+def write_share_markers(commands: Callable, what: str):
+    """
+    one pipeline with `commands(pipe)`, retried with a backoff. blocks while it waits,
+    call it from a thread in the async routes (run_in_threadpool).
+    raises ShareMarkerError once every attempt failed.
+    """
+    for attempt in range(SHARE_MARKER_ATTEMPTS):
+        try:
+            pipe = get_redis_client().pipeline(transaction=False)
+            commands(pipe)
+            pipe.execute()
+            return
+        except Exception as e:
+            logger.warning(
+                "failed to update share access of %s (attempt %d): %s",
+                what,
+                attempt + 1,
+                e,
+            )
+            if attempt + 1 < SHARE_MARKER_ATTEMPTS:
+                time.sleep(SHARE_MARKER_BACKOFF_SECONDS * 2**attempt)
+    logger.error("share access of %s not updated", what)
+    raise ShareMarkerError(f"share access of {what} not updated")
+
+
+def mark_files_deleted(file_ids, deleted: bool = True):
+    """
+    per file markers, for targeted deletes (a batch, a folder, expiry) and restores.
+    O(files) Redis writes in one round trip
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    now = time.time()
+
+    def commands(pipe):
+        for file_id in file_ids:
+            if deleted:
+                pipe.set(
+                    deleted_file_key(file_id), 1, ex=settings.trash_retention_seconds
+                )
+            else:
+                pipe.delete(deleted_file_key(file_id))
+                pipe.set(
+                    restored_file_key(file_id),
+                    now,
+                    ex=settings.share_link_max_seconds,
+                )
+
+    write_share_markers(commands, f"{len(file_ids)} files")
+
+
+def mark_owner_deleted(owner_id, deleted_at: datetime):
+    """
+    one marker for all of the owner's files, whatever their number: share links
+    issued before it are refused. kept as long as such a link can be valid
+    """
+    timestamp = deleted_at.replace(tzinfo=timezone.utc).timestamp()
+    write_share_markers(
+        lambda pipe: pipe.set(
+            deleted_owner_key(owner_id), timestamp, ex=settings.share_link_max_seconds
+        ),
+        "all files",
+    )
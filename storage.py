@@ -0,0 +1,445 @@
+import hashlib
+import hmac
+import io
+import mimetypes
+import os
+import posixpath
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import BinaryIO, Iterable, Iterator
+from urllib.parse import quote, urlencode
+from config import get_settings
+from logger import get_logger
+from timing import timed
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+CHUNK_SIZE = 1024 * 1024
+# the most keys a single S3 DeleteObjects request accepts
+S3_DELETE_BATCH_SIZE = 1000
+# extended attribute holding the content type of a local file
+CONTENT_TYPE_XATTR = "user.content_type"
+
+# File.storage_tier values
+STANDARD = "standard"
+INFREQUENT = "infrequent"
+
+# HKDF info of the key signing the local download urls: derived from SECRET_KEY, never
+# SECRET_KEY itself, which signs the session JWTs
+LOCAL_URL_KEY_INFO = b"file-share local storage urls"
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    size: int
+    content_type: str | None
+    modified_at: datetime | None
+
+
+class StorageBackend(ABC):
+    """
+    where the file contents live. keys are the File.storage_path values
+    ("<user_id>/<uuid><ext>"). `end` of a range is inclusive, as in an HTTP Range.
+    """
+
+    name = ""
+    # whether set_tier can move objects between storage classes
+    tiered = False
+
+    @abstractmethod
+    def put(self, key: str, data: bytes | BinaryIO, content_type: str | None): ...
+
+    @timed("storage")
+    def put_many(self, items: Iterable[tuple[str, bytes | BinaryIO, str | None]]):
+        for key, data, content_type in items:
+            self.put(key, data, content_type)
+
+    @abstractmethod
+    def get(
+        self, key: str, start: int = 0, end: int | None = None, chunk_size=CHUNK_SIZE
+    ) -> Iterator[bytes]: ...
+
+    @abstractmethod
+    def head(self, key: str) -> ObjectInfo | None: ...
+
+    @abstractmethod
+    def delete_many(self, keys: Iterable[str]) -> set:
+        """
+        returns the keys that could not be deleted (a missing key counts as deleted)
+        """
+
+    @abstractmethod
+    def sign_url(
+        self, key: str, expires: int = 3600, disposition: str | None = None
+    ) -> str | None:
+        """
+        time limited download url, `disposition` overrides the Content-Disposition
+        """
+
+    @abstractmethod
+    def object_url(self, key: str) -> str:
+        """
+        permanent (unsigned) address of the object, stored in File.s3_url
+        """
+
+    @abstractmethod
+    def set_tier(self, key: str, tier: str):
+        """
+        moves the object to the storage class of `tier` (STANDARD / INFREQUENT).
+        only called on a backend that is `tiered`
+        """
+
+    @abstractmethod
+    def list_objects(
+        self, prefix: str = "", start_after: str | None = None
+    ) -> Iterator[tuple[str, ObjectInfo]]:
+        """
+        (key, info) of the objects under `prefix` whose key sorts after `start_after`,
+        in key order (the byte order of the UTF-8 keys, like S3). info.content_type is
+        None, a listing does not carry it.
+        """
+
+
+class S3Storage(StorageBackend):
+    name = "s3"
+    tiered = True
+
+    def __init__(
+        self,
+        bucket: str | None,
+        region: str | None,
+        infrequent_class: str = "STANDARD_IA",
+    ):
+        self.bucket = bucket
+        self.region = region
+        self.storage_classes = {STANDARD: "STANDARD", INFREQUENT: infrequent_class}
+
+    @property
+    def client(self):
+        # boto3 is imported on first use (dependecies.get_s3_client)
+        from dependecies import get_s3_client
+
+        return get_s3_client()
+
+    def put(self, key, data, content_type):
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+        self.client.upload_fileobj(
+            data, self.bucket, key, ExtraArgs={"ContentType": content_type}
+        )
+
+    def get(self, key, start=0, end=None, chunk_size=CHUNK_SIZE):
+        params = {"Bucket": self.bucket, "Key": key}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(**params)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def list_objects(self, prefix="", start_after=None):
+        params = {"Bucket": self.bucket, "Prefix": prefix}
+        if start_after:
+            params["StartAfter"] = start_after
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**params):
+            for obj in page.get("Contents", []):
+                yield obj["Key"], ObjectInfo(
+                    size=obj["Size"], content_type=None, modified_at=obj["LastModified"]
+                )
+
+    @timed("storage")
+    def head(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        return ObjectInfo(
+            size=response["ContentLength"],
+            content_type=response.get("ContentType"),
+            modified_at=response.get("LastModified"),
+        )
+
+    @timed("storage")
+    def delete_many(self, keys):
+        keys = list(keys)
+        failed = set()
+        for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            chunk = keys[start : start + S3_DELETE_BATCH_SIZE]
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+                )
+            except Exception as e:
+                logger.error("Failed to delete %d S3 objects: %s", len(chunk), e)
+                failed.update(chunk)
+                continue
+            # quiet mode: only the failures are listed
+            for error in response.get("Errors", []):
+                logger.error(
+                    "Failed to delete S3 object %s: %s",
+                    error.get("Key"),
+                    error.get("Message"),
+                )
+                failed.add(error.get("Key"))
+            logger.info(
+                "Deleted %d S3 objects", len(chunk) - len(response.get("Errors", []))
+            )
+        return failed
+
+    @timed("storage")
+    def sign_url(self, key, expires=3600, disposition=None):
+        params = {"Bucket": self.bucket, "Key": key}
+        if disposition:
+            params["ResponseContentDisposition"] = disposition
+        try:
+            return self.client.generate_presigned_url(
+                "get_object", Params=params, ExpiresIn=expires
+            )
+        except Exception as e:
+            logger.error("Error generating presigned URL: %s", e)
+            return None
+
+    def object_url(self, key):
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    @timed("storage")
+    def set_tier(self, key, tier):
+        # an in place copy is how S3 changes the class of an existing object. one
+        # CopyObject, not the managed client.copy: that one goes multipart from 8 MB
+        # and a multipart copy drops the Content-Type and metadata. CopyObject takes
+        # up to 5 GB, uploads are far below (UPLOAD_MAX_FILE_BYTES)
+        self.client.copy_object(
+            CopySource={"Bucket": self.bucket, "Key": key},
+            Bucket=self.bucket,
+            Key=key,
+            StorageClass=self.storage_classes[tier],
+            MetadataDirective="COPY",
+        )
+
+
+class LocalStorage(StorageBackend):
+    """
+    files under `root`, laid out like the keys. writes go to a temporary file that is
+    fsynced and renamed over the target (readers never see a partial file); put_many
+    fsyncs each directory once for the whole batch instead of once per file.
+    downloads go through signed urls served by routers/storage.py.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, secret: str | None, base_url: str = ""):
+        self.root = os.path.abspath(root)
+        self.secret = derive_key(secret or "", LOCAL_URL_KEY_INFO)
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str) -> str:
+        normalized = posixpath.normpath(key)
+        if (
+            not key
+            or normalized.startswith(("/", "../"))
+            or normalized in (".", "..")
+        ):
+            raise ValueError(f"invalid storage key {key!r}")
+        return os.path.join(self.root, *normalized.split("/"))
+
+    def put(self, key, data, content_type):
+        self.put_many([(key, data, content_type)])
+
+    @timed("storage")
+    def put_many(self, items):
+        written, directories = [], set()
+        try:
+            for key, data, content_type in items:
+                target = self.path(key)
+                written.append((self._write_temp(target, data, content_type), target))
+            for tmp, target in written:
+                os.replace(tmp, target)
+                directories.add(os.path.dirname(target))
+        except BaseException:
+            for tmp, _ in written:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            raise
+        # the renames are durable once their directories are
+        for directory in directories:
+            fsync_directory(directory)
+
+    def _write_temp(self, target: str, data, content_type) -> str:
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, f".tmp-{uuid.uuid4().hex}")
+        with open(tmp, "wb") as f:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f, CHUNK_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+        if content_type:
+            try:
+                os.setxattr(tmp, CONTENT_TYPE_XATTR, content_type.encode())
+            except (AttributeError, OSError):
+                # no xattr support, head() falls back to the extension
+                pass
+        return tmp
+
+    def get(self, key, start=0, end=None, chunk_size=CHUNK_SIZE):
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(
+                    chunk_size if remaining is None else min(chunk_size, remaining)
+                )
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    @timed("storage")
+    def head(self, key):
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        try:
+            content_type = os.getxattr(path, CONTENT_TYPE_XATTR).decode()
+        except (AttributeError, OSError):
+            content_type = mimetypes.guess_type(key)[0]
+        return ObjectInfo(
+            size=stat.st_size,
+            content_type=content_type,
+            modified_at=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        )
+
+    def list_objects(self, prefix="", start_after=None):
+        def walk(directory: str, key_prefix: str):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                return
+            # a directory's keys all start with "name/", it sorts as that
+            entries.sort(
+                key=lambda entry: entry.name
+                + ("/" if entry.is_dir(follow_symlinks=False) else "")
+            )
+            for entry in entries:
+                if entry.name.startswith(".tmp-"):
+                    continue
+                key = key_prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subtree = key + "/"
+                    if not (subtree.startswith(prefix) or prefix.startswith(subtree)):
+                        continue
+                    # every key below sorts before start_after
+                    if (
+                        start_after
+                        and subtree < start_after
+                        and not start_after.startswith(subtree)
+                    ):
+                        continue
+                    yield from walk(entry.path, subtree)
+                elif key.startswith(prefix) and (not start_after or key > start_after):
+                    stat = entry.stat()
+                    yield key, ObjectInfo(
+                        size=stat.st_size,
+                        content_type=None,
+                        modified_at=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                    )
+
+        yield from walk(self.root, "")
+
+    @timed("storage")
+    def delete_many(self, keys):
+        failed = set()
+        for key in keys:
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error("Failed to delete local object %s: %s", key, e)
+                failed.add(key)
+        return failed
+
+    def signature(self, key: str, expires_at: int, disposition: str) -> str:
+        message = f"{key}\n{expires_at}\n{disposition}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    @timed("storage")
+    def sign_url(self, key, expires=3600, disposition=None):
+        expires_at = int(time.time()) + expires
+        params = {"exp": expires_at}
+        if disposition:
+            params["disp"] = disposition
+        params["sig"] = self.signature(key, expires_at, disposition or "")
+        return f"{self.object_url(key)}?{urlencode(params)}"
+
+    def verify(self, key: str, expires_at: int, disposition: str, sig: str) -> bool:
+        expected = self.signature(key, expires_at, disposition)
+        return hmac.compare_digest(expected, sig) and expires_at >= time.time()
+
+    def object_url(self, key):
+        return f"{self.base_url}/storage/{quote(key)}"
+
+    def set_tier(self, key, tier):
+        # a filesystem has a single class of storage: tiered is False, tiering.py only
+        # flushes the access counters here
+        raise NotImplementedError("the local backend has no storage tiers")
+
+
+def derive_key(secret: str, info: bytes) -> bytes:
+    """
+    a key of its own for `info` (HKDF-SHA256 of `secret`): a signature made with it
+    says nothing about `secret` or the other keys derived from it
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(
+        secret.encode()
+    )
+
+
+def fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@lru_cache
+def get_storage() -> StorageBackend:
+    """
+    the backend chosen by STORAGE_BACKEND ("s3" or "local"), one per process
+    """
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            settings.s3_bucket_name,
+            settings.aws_region,
+            settings.tiering_s3_storage_class,
+        )
+    if settings.storage_backend == "local":
+        return LocalStorage(
+            settings.storage_local_root,
+            settings.secret_key,
+            settings.storage_public_base_url,
+        )
+    raise ValueError(f"unknown STORAGE_BACKEND {settings.storage_backend!r}")
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# the modules live at the top of the repo and read their settings at import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for name, value in {
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "test",
+    "POSTGRES_SERVICE": "localhost",
+    "SECRET_KEY": "test",
+    "ALGORITHM": "HS256",
+    "LOG_FILE": os.devnull,
+}.items():
+    os.environ.setdefault(name, value)
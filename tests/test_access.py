@@ -0,0 +1,41 @@
+"""
+access counters: each one carries its owner so the write-back finds the row in its
+partition of file
+"""
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from access import access_field, add_access_counts, key_owner, parse_access_field
+
+
+def test_field_round_trip():
+    owner_id = uuid.uuid4()
+    key = f"{owner_id}/{uuid.uuid4()}.pdf"
+
+    assert parse_access_field(access_field(owner_id, key)) == (owner_id, key)
+    assert parse_access_field(access_field(None, "legacy/a|b.pdf")) == (
+        None,
+        "legacy/a|b.pdf",
+    )
+    # recorded before the owner was part of the field
+    assert parse_access_field(key) == (None, key)
+
+
+def test_key_owner():
+    owner_id = uuid.uuid4()
+    assert key_owner(f"{owner_id}/{uuid.uuid4()}.pdf") == str(owner_id)
+    assert key_owner("legacy/photos/a.jpg") is None
+
+
+def test_write_back_joins_on_the_owner():
+    owner_id = uuid.uuid4()
+    statement = add_access_counts(
+        [(owner_id, f"{owner_id}/a.pdf", 3, datetime(2024, 1, 1))]
+    )
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+
+    assert "file.owner_id = accesses.owner_id" in sql
+    assert "file.storage_path = accesses.storage_path" in sql
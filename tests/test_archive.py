@@ -0,0 +1,115 @@
+"""
+GET /user/files/archive, with the database replaced by the rows the query would return
+and the objects on the local storage backend
+"""
+
+import io
+import uuid
+import zipfile
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import models
+from database import get_read_db
+from dependecies import get_current_user_from_cookie
+from routers import user as user_router
+from storage import LocalStorage
+
+OWNER_ID = uuid.uuid4()
+
+
+class FakeSession:
+    """
+    answers db.scalars(query) with `files`, keeps the queries for the assertions
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.queries = []
+
+    def scalars(self, query):
+        self.queries.append(query)
+        return self
+
+    def all(self):
+        return self.files
+
+
+def make_file(storage, filename: str, folder_path: str = "/") -> models.File:
+    key = f"{OWNER_ID}/{uuid.uuid4()}"
+    storage.put(key, filename.encode(), "text/plain")
+    return models.File(
+        id=uuid.uuid4(),
+        filename=filename,
+        storage_path=key,
+        size=len(filename.encode()),
+        content_type="text/plain",
+        folder_path=folder_path,
+        updated_at=datetime(2024, 1, 1),
+        owner_id=OWNER_ID,
+    )
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    local = LocalStorage(str(tmp_path), "test")
+    monkeypatch.setattr(user_router, "get_storage", lambda: local)
+    # access counting goes to Redis, not under test here
+    monkeypatch.setattr(user_router, "record_access", lambda keys: list(keys))
+    return local
+
+
+def client_for(session: FakeSession) -> TestClient:
+    app = FastAPI()
+    app.include_router(user_router.router)
+    app.dependency_overrides[get_read_db] = lambda: session
+    app.dependency_overrides[get_current_user_from_cookie] = lambda: models.User(
+        id=OWNER_ID
+    )
+    return TestClient(app)
+
+
+def archive_names(response) -> list[str]:
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        return archive.namelist()
+
+
+def test_archive_by_ids(storage):
+    files = [make_file(storage, "a.txt"), make_file(storage, "b.txt", "/docs/")]
+    session = FakeSession(files)
+
+    response = client_for(session).get(
+        "/user/files/archive", params={"ids": [str(file.id) for file in files]}
+    )
+
+    # no folder: the paths are relative to the root
+    assert archive_names(response) == ["a.txt", "docs/b.txt"]
+    assert 'filename*=UTF-8\'\'files.zip' in response.headers["content-disposition"]
+
+
+def test_archive_by_filters(storage):
+    files = [make_file(storage, "report.pdf"), make_file(storage, "slides.pdf")]
+    session = FakeSession(files)
+
+    response = client_for(session).get(
+        "/user/files/archive", params={"file_extension": "pdf"}
+    )
+
+    assert archive_names(response) == ["report.pdf", "slides.pdf"]
+    (query,) = session.queries
+    assert ".pdf" in query.compile().params.values()
+
+
+def test_archive_missing_ids(storage):
+    session = FakeSession([make_file(storage, "a.txt")])
+
+    response = client_for(session).get(
+        "/user/files/archive", params={"ids": [str(uuid.uuid4()), str(uuid.uuid4())]}
+    )
+
+    assert response.status_code == 404
@@ -0,0 +1,75 @@
+"""
+expiry.sweep: once a batch is committed, a failing Redis is counted and the sweep
+goes on with the next batch
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import expiry
+from share_markers import ShareMarkerError
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    def __init__(self, batches):
+        self.batches = batches
+        self.commits = 0
+
+    def execute(self, statement):
+        if statement.is_select:
+            return FakeResult(self.batches.pop(0) if self.batches else [])
+        return FakeResult([])
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class FakeStorage:
+    def delete_many(self, keys):
+        list(keys)
+        return set()
+
+
+def expired_row():
+    owner_id = uuid.uuid4()
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        owner_id=owner_id,
+        storage_path=f"{owner_id}/{uuid.uuid4()}.txt",
+        folder_path="/",
+        expires_at=datetime.utcnow() - timedelta(minutes=1),
+    )
+
+
+def test_redis_failures_do_not_stop_the_sweep(monkeypatch):
+    session = FakeSession([[expired_row()], [expired_row(), expired_row()]])
+    monkeypatch.setattr(expiry, "get_storage", lambda: FakeStorage())
+    monkeypatch.setattr(expiry, "record_changes", lambda *args: None)
+
+    def redis_down(*args):
+        raise ConnectionError("redis is down")
+
+    def markers_lost(file_ids):
+        raise ShareMarkerError("share access not updated")
+
+    monkeypatch.setattr(expiry, "delete_redis_folders", redis_down)
+    monkeypatch.setattr(expiry, "mark_files_deleted", markers_lost)
+
+    stats = expiry.sweep(session, batch_size=2)
+
+    assert stats["expired"] == 3
+    # per batch: one invalidation per owner, one marker write
+    assert stats["redis_failed"] == (1 + 1) + (2 + 1)
+    assert session.commits == 2
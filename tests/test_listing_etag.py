@@ -0,0 +1,54 @@
+"""
+ETags of GET /user/files: a 304 must never confirm a body whose signed urls expired
+"""
+
+from starlette.requests import Request
+
+from routers.user import (
+    ACCESS_URL_SECONDS,
+    CACHE_STALE_SECONDS,
+    CACHE_TTL,
+    LISTING_ETAG_SECONDS,
+    listing_etag,
+)
+
+
+def listing_request(query: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/user/files",
+            "query_string": query.encode(),
+            "headers": [],
+        }
+    )
+
+
+def test_etag_ignores_parameter_order():
+    now = 1_700_000_000
+    assert listing_etag("v1", listing_request("a=1&b=2"), now) == listing_etag(
+        "v1", listing_request("b=2&a=1"), now
+    )
+
+
+def test_etag_changes_with_version_and_query():
+    now = 1_700_000_000
+    etag = listing_etag("v1", listing_request("a=1"), now)
+    assert etag != listing_etag("v2", listing_request("a=1"), now)
+    assert etag != listing_etag("v1", listing_request("a=2"), now)
+
+
+def test_etag_changes_every_period():
+    start = LISTING_ETAG_SECONDS * 1000
+    request = listing_request("a=1")
+    etag = listing_etag("v1", request, start)
+
+    assert listing_etag("v1", request, start + LISTING_ETAG_SECONDS - 1) == etag
+    assert listing_etag("v1", request, start + LISTING_ETAG_SECONDS) != etag
+
+
+def test_etag_period_shorter_than_the_urls():
+    # oldest body still validated: served from a cache entry at its oldest, then
+    # revalidated until the end of the period
+    assert CACHE_TTL + CACHE_STALE_SECONDS + LISTING_ETAG_SECONDS < ACCESS_URL_SECONDS
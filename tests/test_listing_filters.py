@@ -0,0 +1,74 @@
+"""
+validation of the GET /user/files filters, before anything is read
+"""
+
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import models
+from database import get_read_db
+from dependecies import get_current_user_from_cookie
+from routers import user as user_router
+
+
+@pytest.fixture
+def client(monkeypatch):
+    listed = []
+
+    async def cached_listing(db, user, filters, version):
+        listed.append(filters)
+        return []
+
+    def no_version(owner_id):
+        raise RuntimeError("no redis in the tests")
+
+    monkeypatch.setattr(user_router, "cached_listing", cached_listing)
+    monkeypatch.setattr(user_router, "get_data_version", no_version)
+
+    app = FastAPI()
+    app.include_router(user_router.router)
+    app.dependency_overrides[get_read_db] = lambda: None
+    app.dependency_overrides[get_current_user_from_cookie] = lambda: models.User(
+        id=uuid.uuid4()
+    )
+    test_client = TestClient(app)
+    test_client.listed = listed
+    return test_client
+
+
+@pytest.mark.parametrize(
+    "after, before",
+    [
+        # an offset on one bound only
+        ("2024-02-01T00:00:00Z", "2024-01-01T00:00:00"),
+        ("2024-02-01T00:00:00", "2024-01-01T00:00:00+00:00"),
+        # equal once both are in UTC
+        ("2024-01-01T01:00:00+01:00", "2024-01-01T00:00:00"),
+    ],
+)
+def test_uploaded_bounds_out_of_order(client, after, before):
+    response = client.get(
+        "/user/files", params={"uploaded_after": after, "uploaded_before": before}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "uploaded_after must be before uploaded_before"
+    assert client.listed == []
+
+
+def test_uploaded_bounds_mixed_offsets(client):
+    response = client.get(
+        "/user/files",
+        params={
+            "uploaded_after": "2024-01-01T00:00:00Z",
+            "uploaded_before": "2024-02-01T00:00:00",
+        },
+    )
+
+    assert response.status_code == 200, response.text
+    (filters,) = client.listed
+    assert filters["uploaded_after"].tzinfo is None
+    assert filters["uploaded_before"].tzinfo is None
@@ -0,0 +1,42 @@
+"""
+urls signed by the local backend, checked by routers/storage.py
+"""
+
+import hashlib
+import hmac
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from storage import INFREQUENT, LocalStorage
+
+
+def signed(local: LocalStorage, key: str, disposition=None) -> dict:
+    query = parse_qs(urlsplit(local.sign_url(key, disposition=disposition)).query)
+    return {name: values[0] for name, values in query.items()}
+
+
+def test_signed_url_verifies(tmp_path):
+    local = LocalStorage(str(tmp_path), "secret")
+    params = signed(local, "owner/file.pdf", "attachment")
+    expires_at, sig = int(params["exp"]), params["sig"]
+
+    assert local.verify("owner/file.pdf", expires_at, "attachment", sig)
+    assert not local.verify("owner/other.pdf", expires_at, "attachment", sig)
+    assert not local.verify("owner/file.pdf", expires_at, "", sig)
+
+
+def test_urls_are_not_signed_with_the_session_key(tmp_path):
+    local = LocalStorage(str(tmp_path), "secret")
+    params = signed(local, "owner/file.pdf")
+
+    message = f"owner/file.pdf\n{params['exp']}\n".encode()
+    assert params["sig"] != hmac.new(b"secret", message, hashlib.sha256).hexdigest()
+
+
+def test_local_backend_has_no_tiers(tmp_path):
+    local = LocalStorage(str(tmp_path), "secret")
+
+    assert not local.tiered
+    with pytest.raises(NotImplementedError):
+        local.set_tier("owner/file.pdf", INFREQUENT)
@@ -0,0 +1,30 @@
+"""
+the queue-backed logging pipeline: dropped records show up in the metrics, and the
+listener can be stopped twice (atexit + explicit shutdown)
+"""
+
+import logging
+
+import logger as app_logging
+from metrics import collect
+
+
+def test_listener_stops_twice():
+    listener = app_logging._Listener(app_logging.queue.Queue(), logging.NullHandler())
+    listener.start()
+
+    app_logging._stop_listener(listener)
+    app_logging._stop_listener(listener)
+
+    assert not listener.running
+
+
+def test_dropped_records_are_collected():
+    handler = app_logging._PreparedQueueHandler(app_logging.queue.Queue(maxsize=1))
+    record = logging.makeLogRecord({"msg": "hello"})
+
+    handler.enqueue(record)
+    handler.enqueue(record)
+
+    assert handler.dropped == 1
+    assert set(collect()["logging"]) == {"dropped", "queued"}
@@ -0,0 +1,42 @@
+"""
+the plan checks of benchmarks/query_plans.py against the configured postgres
+(POSTGRES_* env). skipped when it can't be reached.
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from benchmarks import query_plans
+from database import engine
+
+# the defaults of the script: smaller tables can make a sequential scan the better plan
+USERS = 200
+FILES = 200_000
+
+QUERY_NAMES = [name for name, _, _ in query_plans.core_queries(str(uuid.uuid4()))]
+
+
+@pytest.fixture(scope="module")
+def plans():
+    try:
+        conn = engine.connect()
+    except OperationalError as e:
+        pytest.skip(f"postgres unreachable: {e.orig}")
+    with conn:
+        try:
+            owner_id, parents = query_plans.create_scratch_schema(conn, USERS, FILES)
+            yield {
+                name: problems
+                for name, problems, _ in query_plans.check_queries(
+                    conn, owner_id, parents
+                )
+            }
+        finally:
+            query_plans.drop_scratch_schema(conn)
+
+
+@pytest.mark.parametrize("name", QUERY_NAMES)
+def test_query_uses_the_expected_index(plans, name):
+    assert plans[name] == []
@@ -0,0 +1,31 @@
+"""
+get_read_db falling back to the primary: the session is closed whatever happens
+"""
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import database
+
+
+class FakeSession:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_primary_checkout_closes_the_session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(database, "replica_engines", [])
+    monkeypatch.setattr(database, "SessionLocal", lambda: session)
+
+    def checkout(db, stats):
+        raise OperationalError("SELECT 1", None, Exception("pool exhausted"))
+
+    monkeypatch.setattr(database, "_checkout", checkout)
+
+    with pytest.raises(OperationalError):
+        next(database.get_read_db(request=None))
+
+    assert session.closed
@@ -0,0 +1,57 @@
+"""
+reconcile.mark_dangling: once the rows are committed, a failing Redis is counted and
+the pass goes on
+"""
+
+import uuid
+from types import SimpleNamespace
+
+import reconcile
+from share_markers import ShareMarkerError
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    committed = False
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement):
+        return FakeResult(self.rows)
+
+    def commit(self):
+        self.committed = True
+
+
+def test_redis_failures_after_the_commit_are_counted(monkeypatch):
+    owner_id = uuid.uuid4()
+    rows = [SimpleNamespace(id=uuid.uuid4(), owner_id=owner_id) for _ in range(3)]
+    session = FakeSession([(row.id, row.owner_id) for row in rows])
+    monkeypatch.setattr(reconcile, "SessionLocal", lambda: session)
+    monkeypatch.setattr(reconcile, "record_changes", lambda *args: None)
+
+    def redis_down(*args):
+        raise ConnectionError("redis is down")
+
+    def markers_lost(file_ids):
+        raise ShareMarkerError("share access of 3 files not updated")
+
+    monkeypatch.setattr(reconcile, "delete_redis", redis_down)
+    monkeypatch.setattr(reconcile, "mark_files_deleted", markers_lost)
+
+    assert reconcile.mark_dangling(rows) == (3, 2)
+    assert session.committed
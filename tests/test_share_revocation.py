@@ -0,0 +1,149 @@
+"""
+share links of deleted files: the per owner marker of the bulk deletes, the per file
+markers, and what happens when Redis does not take them
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import share_markers
+from routers.shares import CLOCK_SKEW_SECONDS, deleted_since_issued
+from routers.user import write_delete_markers
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append(("set", key, value))
+
+    def delete(self, key):
+        self.commands.append(("delete", key))
+
+    def execute(self):
+        if self.redis.failures:
+            self.redis.failures -= 1
+            raise ConnectionError("redis is down")
+        for command, key, *value in self.commands:
+            if command == "set":
+                self.redis.data[key] = value[0]
+            else:
+                self.redis.data.pop(key, None)
+        self.redis.round_trips += 1
+
+
+class FakeRedis:
+    def __init__(self, failures=0):
+        self.data = {}
+        self.failures = failures
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(share_markers, "get_redis_client", lambda: fake)
+    monkeypatch.setattr(share_markers, "SHARE_MARKER_BACKOFF_SECONDS", 0)
+    return fake
+
+
+def test_link_issued_before_the_bulk_delete_is_refused():
+    deleted_at = 1_700_000_000.0
+    assert deleted_since_issued({"at": deleted_at - 60}, deleted_at, None)
+    # issued by a worker whose clock is slightly ahead
+    assert deleted_since_issued({"at": deleted_at + 1}, deleted_at, None)
+
+
+def test_link_issued_after_the_bulk_delete_opens():
+    deleted_at = 1_700_000_000.0
+    payload = {"at": deleted_at + CLOCK_SKEW_SECONDS + 1}
+    assert not deleted_since_issued(payload, deleted_at, None)
+    assert not deleted_since_issued({"at": deleted_at}, None, None)
+
+
+def test_restored_file_opens_again():
+    deleted_at = 1_700_000_000.0
+    payload = {"at": deleted_at - 60}
+    assert not deleted_since_issued(payload, b"1700000000.0", b"1700000100.0")
+    # deleted again after the restore
+    assert deleted_since_issued(payload, b"1700000200.0", b"1700000100.0")
+
+
+def test_link_without_issue_time_is_older_than_the_marker():
+    assert deleted_since_issued({}, b"1700000000.0", None)
+
+
+def test_bulk_delete_is_one_marker(redis):
+    owner_id = uuid.uuid4()
+    deleted_at = datetime(2024, 1, 1)
+
+    share_markers.mark_owner_deleted(owner_id, deleted_at)
+
+    assert redis.data == {
+        share_markers.deleted_owner_key(owner_id): deleted_at.replace(
+            tzinfo=timezone.utc
+        ).timestamp()
+    }
+    assert redis.round_trips == 1
+
+
+def test_restore_overrides_the_owner_marker(redis):
+    file_id = uuid.uuid4()
+    share_markers.mark_files_deleted([file_id])
+    assert share_markers.deleted_file_key(file_id) in redis.data
+
+    before = time.time()
+    share_markers.mark_files_deleted([file_id], deleted=False)
+
+    assert share_markers.deleted_file_key(file_id) not in redis.data
+    assert redis.data[share_markers.restored_file_key(file_id)] >= before
+
+
+def test_marker_write_is_retried(redis):
+    redis.failures = share_markers.SHARE_MARKER_ATTEMPTS - 1
+
+    share_markers.mark_owner_deleted(uuid.uuid4(), datetime(2024, 1, 1))
+
+    assert redis.round_trips == 1
+
+
+def test_lost_marker_write_raises(redis):
+    redis.failures = share_markers.SHARE_MARKER_ATTEMPTS
+
+    with pytest.raises(share_markers.ShareMarkerError):
+        share_markers.mark_files_deleted([uuid.uuid4()])
+
+    assert redis.data == {}
+
+
+class FakeSession:
+    rolled_back = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def test_lost_marker_write_rolls_the_delete_back(redis):
+    # written before the commit: the client can still authenticate and retry
+    redis.failures = share_markers.SHARE_MARKER_ATTEMPTS
+    db = FakeSession()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(
+            write_delete_markers(
+                db, share_markers.mark_owner_deleted, uuid.uuid4(), datetime.utcnow()
+            )
+        )
+
+    assert error.value.status_code == 503
+    assert db.rolled_back
@@ -0,0 +1,47 @@
+"""
+S3Storage.set_tier against botocore's Stubber: the request is checked against the
+S3 API model, nothing is sent
+"""
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import storage
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    )
+    monkeypatch.setattr(storage.S3Storage, "client", property(lambda self: client))
+    with Stubber(client) as stubber:
+        yield storage.S3Storage("bucket", "us-east-1", "STANDARD_IA"), stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize(
+    "tier, storage_class",
+    [(storage.INFREQUENT, "STANDARD_IA"), (storage.STANDARD, "STANDARD")],
+)
+def test_set_tier_is_one_copy_keeping_the_metadata(s3, tier, storage_class):
+    backend, stubber = s3
+    # a single CopyObject whatever the size: a multipart copy would drop the
+    # Content-Type of the upload
+    stubber.add_response(
+        "copy_object",
+        {},
+        {
+            "CopySource": {"Bucket": "bucket", "Key": "owner/file.pdf"},
+            "Bucket": "bucket",
+            "Key": "owner/file.pdf",
+            "StorageClass": storage_class,
+            "MetadataDirective": "COPY",
+        },
+    )
+
+    backend.set_tier("owner/file.pdf", tier)
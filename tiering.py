@@ -0,0 +1,142 @@
+"""
+storage tiering: adds the access counters collected in Redis (access.py) to the file
+rows, then moves files not accessed for TIERING_COLD_AFTER_SECONDS to the infrequent
+access storage class and files accessed TIERING_WARM_ACCESSES times there back.
+
+    python tiering.py [--once] [--batch N] [--interval SECONDS]
+
+several instances can run at once, each batch is claimed with FOR UPDATE SKIP LOCKED.
+"""
+
+import argparse
+import time
+from datetime import timedelta
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from access import flush_access_counts
+from config import get_settings
+from database import SessionLocal
+from logger import get_logger
+import models
+from routers.user import any_id
+from storage import INFREQUENT, STANDARD, StorageBackend, get_storage
+
+logger = get_logger("tiering")
+
+settings = get_settings()
+
+
+def move_files(db: Session, storage: StorageBackend, query, tier: str, batch_size: int):
+    """
+    objects first, then rows: a file whose object could not be moved keeps its tier
+    and is tried again on the next run
+    """
+    moved = 0
+    while True:
+        rows = db.execute(
+            query.limit(batch_size).with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            db.rollback()
+            return moved
+
+        done = []
+        for row in rows:
+            try:
+                storage.set_tier(row.storage_path, tier)
+                done.append(row)
+            except Exception as e:
+                logger.error("failed to move %s to %s: %s", row.storage_path, tier, e)
+        if done:
+            db.execute(
+                update(models.File)
+                .where(
+                    # the owners prune the partitions of file to theirs
+                    models.File.owner_id == any_id({row.owner_id for row in done}),
+                    models.File.id == any_id([row.id for row in done]),
+                )
+                .values(
+                    storage_tier=tier,
+                    access_count=0,
+                    updated_at=models.File.updated_at,
+                )
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        moved += len(done)
+        logger.info("moved %d files to %s (%d failed)", len(done), tier, len(rows) - len(done))
+
+        if not done:
+            # storage is failing, stop instead of spinning on the same rows
+            return moved
+
+
+def cold_files(cutoff):
+    last_access = func.coalesce(models.File.last_accessed_at, models.File.uploaded_at)
+    return (
+        select(models.File.id, models.File.owner_id, models.File.storage_path)
+        .where(
+            models.File.deleted_at.is_(None),
+            models.File.storage_tier == STANDARD,
+            last_access < cutoff,
+            models.File.size >= settings.tiering_min_size_bytes,
+        )
+        .order_by(last_access)
+    )
+
+
+def warm_files():
+    return (
+        select(models.File.id, models.File.owner_id, models.File.storage_path)
+        .where(
+            models.File.deleted_at.is_(None),
+            models.File.storage_tier == INFREQUENT,
+            models.File.access_count >= settings.tiering_warm_accesses,
+        )
+        .order_by(models.File.access_count.desc())
+    )
+
+
+def run(batch_size: int):
+    storage = get_storage()
+    with SessionLocal() as db:
+        flush_access_counts(db, batch_size)
+        if not storage.tiered:
+            return 0, 0
+        cutoff = models._utcnow() - timedelta(
+            seconds=settings.tiering_cold_after_seconds
+        )
+        # warm first: a file can't qualify for both in the same pass
+        warmed = move_files(db, storage, warm_files(), STANDARD, batch_size)
+        cooled = move_files(db, storage, cold_files(cutoff), INFREQUENT, batch_size)
+    return cooled, warmed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="one pass, then exit")
+    parser.add_argument("--batch", type=int, default=settings.tiering_batch_size)
+    parser.add_argument(
+        "--interval", type=int, default=settings.tiering_interval_seconds
+    )
+    args = parser.parse_args()
+
+    if not get_storage().tiered:
+        logger.info("the %s storage has no tiers, only flushing counters", get_storage().name)
+
+    while True:
+        try:
+            cooled, warmed = run(args.batch)
+            if cooled or warmed:
+                logger.info("tiering done: %d cooled, %d warmed", cooled, warmed)
+        except Exception as e:
+            logger.error("tiering failed: %s", e)
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+# name -> [milliseconds, calls] of the request being served, set by request_context in
+# main.py. a mutable dict: the threadpool (sync routes and dependencies) gets a copy of
+# the context, which still points to the same dict.
+spans_var: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "spans", default=None
+)
+
+# Server-Timing descriptions
+DESCRIPTIONS = {
+    "db": "Postgres",
+    "cache": "Redis",
+    "storage": "object storage",
+    "auth": "authentication",
+    "bcrypt": "password hashing",
+}
+
+
+def start_spans() -> tuple[dict, contextvars.Token]:
+    spans = {}
+    return spans, spans_var.set(spans)
+
+
+def add_span(name: str, seconds: float):
+    spans = spans_var.get()
+    if spans is None:
+        return
+    entry = spans.setdefault(name, [0.0, 0])
+    entry[0] += seconds * 1000
+    entry[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    """
+    adds the time spent in the block to `name`. outside of a request (jobs, background
+    threads) it only costs a perf_counter call.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """
+    decorator version of span()
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing(spans: dict, total_ms: float) -> str:
+    """
+    `db;dur=12.5;desc="Postgres (3)", ..., total;dur=40.1`. the spans can overlap
+    (auth includes the database lookup of the user).
+    """
+    metrics = [
+        f'{name};dur={ms:.1f};desc="{DESCRIPTIONS.get(name, name)} ({calls})"'
+        for name, (ms, calls) in spans.items()
+    ]
+    metrics.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(metrics)
+
+
+def log_fields(spans: dict) -> dict:
+    return {f"{name}_ms": round(ms, 3) for name, (ms, _) in spans.items()}